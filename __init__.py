@@ -1,6 +1,6 @@
 from webapp2_extras.routes import RedirectRoute
 
-from .model_register import register, ModelAdmin
+from .model_register import register, ModelAdmin, cached_column
 
 
 def get_application_routes(handler_cls=None):
@@ -13,9 +13,15 @@ def get_application_routes(handler_cls=None):
 
   application_routes = (
     ('appengine_admin.index', 'GET', r'/', handler_cls, 'index'),
+    ('appengine_admin.jobs', 'GET', r'/jobs/', handler_cls, 'job_list'),
+    ('appengine_admin.job_slice', 'POST', r'/jobs/slice/', handler_cls, 'job_slice'),
+    ('appengine_admin.job_cancel', 'POST', r'/jobs/<job_id:\d+>/cancel/', handler_cls, 'job_cancel'),
+    ('appengine_admin.job_start', 'POST', r'/<model_name>/jobs/start/', handler_cls, 'job_start'),
+    ('appengine_admin.schema', 'GET', r'/<model_name>/schema/', handler_cls, 'schema'),
     ('appengine_admin.list', 'GET', r'/<model_name>/list/', handler_cls, 'list'),
     ('appengine_admin.new', None, r'/<model_name>/new/', handler_cls, 'new'),
     ('appengine_admin.edit', None, r'/<model_name>/edit/<key>/', handler_cls, 'edit'),
+    ('appengine_admin.references', 'GET', r'/<model_name>/references/<key>/', handler_cls, 'references'),
     ('appengine_admin.clone', 'GET', r'/<model_name>/clone/<key>/', handler_cls, 'clone'),
     ('appengine_admin.delete', 'POST', r'/<model_name>/delete/<key>/', handler_cls, 'delete'),
     ('appengine_admin.blob', 'GET', r'/<model_name>/blob/<field_name>/<key>/', handler_cls, 'blob'),
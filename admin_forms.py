@@ -1,19 +1,57 @@
+from datetime import datetime
+
 from google.appengine.ext import db
 
-from . import fields, wtforms
+from . import fields, labels, request_stats, widgets, wtforms
 from wtforms.ext.appengine.db import ModelConverter, model_form
 
 
+class _ReferenceKeys(object):
+  '''Reads an instance's ReferenceProperty values as keys, without resolving them.'''
+
+  def __init__(self, instance, reference_names):
+    self._instance = instance
+    self._keys = dict((name, getattr(instance.__class__, name).get_value_for_datastore(instance))
+                      for name in reference_names)
+
+  def __getattr__(self, name):
+    if name in self._keys:
+      return self._keys[name]
+    return getattr(self._instance, name)
+
+
 class WTForm(wtforms.Form):
+  # Set per edited instance by the edit handler, see handlers.AdminHandler.edit
+  dynamic_properties = {}
+
   def __init__(self, formdata=None, obj=None, prefix='', handler=None, **kwargs):
     if self.pre_init:
-      obj = self.pre_init(self, obj, formdata)
+      with request_stats.timed('pre_init'):
+        obj = self.pre_init(self, obj, formdata)
     self.instance = obj
     self.handler = handler
 
     super(WTForm, self).__init__(formdata=formdata, obj=obj, prefix=prefix, **kwargs)
     if self.post_init:
-      obj = self.post_init(self, obj, formdata, handler)
+      with request_stats.timed('post_init'):
+        obj = self.post_init(self, obj, formdata, handler)
+
+  @classmethod
+  def get_model_properties(cls):
+    '''Get the model's properties by attribute name.'''
+    return cls.model.properties()
+
+  def process(self, formdata=None, obj=None, **kwargs):
+    '''Process the form, passing references of obj to their fields as keys.
+
+    The widgets show referenced entities by their label, see labels.py.
+    '''
+    if obj is not None:
+      reference_names = [name for name, prop in self.get_model_properties().items()
+                         if name in self._fields and isinstance(prop, db.ReferenceProperty)]
+      if reference_names:
+        obj = _ReferenceKeys(obj, reference_names)
+    super(WTForm, self).process(formdata, obj, **kwargs)
 
   def validate(self):
     """
@@ -30,16 +68,84 @@ class WTForm(wtforms.Form):
     for field_name in field_names_to_skip:
       delattr(self, field_name)
 
-    self._valid = super(wtforms.Form, self).validate(self.field_validators)
+    # Only run the ModelAdmin validate_<field> hooks for fields that changed.
+    field_validators = None
+    if self.field_validators:
+      changed_fields = self.changed_fields()
+      field_validators = dict(
+        (field_name, [request_stats.timed_callable('validate_%s' % field_name, validator)
+                      for validator in validators])
+        for field_name, validators in self.field_validators.items()
+        if field_name in changed_fields)
+    self._valid = super(wtforms.Form, self).validate(field_validators)
     return self._valid
 
+  def enable_list_deltas(self):
+    '''Let ListProperty(db.Key) fields submit only added/removed keys.
+
+    Only for forms editing a stored instance, the deltas are applied to its lists.
+    '''
+    for field in self:
+      if isinstance(field, fields.AjaxKeyField) and field.multiple:
+        field.delta = True
+
+  def prefetch(self):
+    '''Start the datastore reads of the AjaxKeyField widgets together.
+
+    The labels of the keys shown by every field are read in one batch, and the
+    first selector page of each referenced kind is started once. Their RPCs
+    overlap instead of running one after another while the form renders.
+    '''
+    ajax_fields = [field for field in self if isinstance(field, fields.AjaxKeyField)]
+    if not ajax_fields:
+      return
+    handler = self.handler
+    if handler is None:
+      from .handlers import AdminHandler
+      handler = AdminHandler()
+    keys = []
+    for field in ajax_fields:
+      keys.extend(field.get_display_keys())
+    prefetched_labels = labels.get_labels_async(keys)
+    selector_pages = {}
+    for field in ajax_fields:
+      for cls_name, cls in field.object_classes.items():
+        if cls_name not in selector_pages:
+          selector_pages[cls_name] = widgets.AjaxKeyWidget.start_selector_page(cls, handler)
+      field.prefetched_labels = prefetched_labels
+      field.selector_pages = selector_pages
+
+  def changed_fields(self):
+    '''Get the names of the fields whose data differs from the edited instance.
+
+    Every field counts as changed when creating a new instance.
+    '''
+    if self.instance is None:
+      return set(self._fields)
+    properties = self.get_model_properties()
+    changed_fields = set()
+    for name, field in self._fields.items():
+      prop = properties.get(name)
+      if isinstance(prop, db.ReferenceProperty):
+        # Compare keys, without resolving the reference.
+        current_value = prop.get_value_for_datastore(self.instance)
+      else:
+        current_value = getattr(self.instance, name, None)
+      if _comparable(field.data, field) != _comparable(current_value, field):
+        changed_fields.add(name)
+    return changed_fields
+
   def save(self, put=True):
     if not hasattr(self, '_valid'):
       raise Exception('self.validate() not called before saving.')
     data = self.data
+    if self.instance:
+      # Leave unchanged values alone on existing instances.
+      changed_fields = self.changed_fields()
+      data = dict((name, value) for name, value in data.items() if name in changed_fields)
     model_properties = {}
     dynamic_properties = {}
-    properties = self.model.properties().keys()
+    properties = self.get_model_properties().keys()
     for name, value in data.items():
       if name in properties:
         model_properties[name] = value
@@ -55,21 +161,46 @@ class WTForm(wtforms.Form):
       setattr(instance, name, value)
 
     if self.pre_save:
-      instance = self.pre_save(self, instance, self.handler)
+      with request_stats.timed('pre_save'):
+        instance = self.pre_save(self, instance, self.handler)
 
     if put:
-      instance_or_result = instance.put()
-
-      if isinstance(instance_or_result, self.model):
-        instance = instance_or_result
-      elif isinstance(instance_or_result, db.Key):
-        instance = db.get(instance_or_result)
-
+      instance = self.put(instance)
       if self.post_save:
-        return self.post_save(self, instance, self.handler)
+        with request_stats.timed('post_save'):
+          return self.post_save(self, instance, self.handler)
 
     return instance
 
+  def put(self, instance):
+    '''Store the saved instance, returns the stored instance.'''
+    instance_or_result = instance.put()
+    if isinstance(instance_or_result, self.model):
+      return instance_or_result
+    if isinstance(instance_or_result, db.Key):
+      return db.get(instance_or_result)
+    return instance
+
+
+def _comparable(value, field=None):
+  '''Normalize form and model values of field so that equal values compare equal.'''
+  if value == '' and isinstance(field, wtforms.fields.StringField):
+    # Optional strings stored as None are submitted empty.
+    return None
+  if isinstance(value, db.Model):
+    return value.key()
+  if isinstance(value, datetime):
+    if value.tzinfo:
+      # The datastore stores naive UTC datetimes.
+      value = (value - value.utcoffset()).replace(tzinfo=None)
+    if isinstance(field, wtforms.fields.DateTimeField) and '%f' not in field.format:
+      # The form shows and submits whole seconds.
+      value = value.replace(microsecond=0)
+    return value
+  if isinstance(value, (list, tuple)):
+    return [_comparable(item) for item in value]
+  return value
+
 
 def convert_DateTimeProperty(model, prop, kwargs):
   """Returns a form field for a ``db.DateTimeProperty``."""
@@ -158,7 +289,7 @@ class AdminConverter(ModelConverter):
 
 def create(model, only=None, exclude=None, base_class=WTForm, converter=None,
            pre_init=None, post_init=None, pre_save=None, post_save=None,
-           field_validators=None):
+           field_validators=None, form_factory=model_form):
   '''Factory for admin forms.
 
   Input:
@@ -178,9 +309,12 @@ def create(model, only=None, exclude=None, base_class=WTForm, converter=None,
   All the following receive the form and the field as parameters:
     * field_validators - a dict of field -> callback function for validating
                          individual properties
+
+  form_factory builds the form class from the converter, wtforms'
+  db model_form by default.
   '''
   converter = converter or AdminConverter(model)
-  form = model_form(
+  form = form_factory(
     model=model, base_class=base_class, only=only, exclude=exclude, converter=converter)
   form.model = model
   form.pre_init = pre_init
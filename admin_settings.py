@@ -21,6 +21,22 @@ FEATURE_PICKLE_PROPERTY_PATH = None
 # Items per page in admin list view
 ADMIN_ITEMS_PER_PAGE = 50
 
+# Seconds the list page may spend computing its rows, after which the rows
+# completed so far are shown with a link to continue. Keep it well below the
+# request deadline.
+LIST_TIME_BUDGET = 30
+
+# Default seconds computed list columns decorated with model_register.cached_column
+# are cached for, 0 for no expiry.
+LIST_COLUMN_CACHE_TTL = 3600
+
+# Seconds the display labels of referenced entities are cached for, see labels.py.
+LABEL_CACHE_TTL = 24 * 3600
+
+# Referenced objects shown when editing a ListProperty(db.Key), the rest of the
+# list is kept as is and only additions/removals are submitted.
+AJAX_KEY_FIELD_PAGE_SIZE = 50
+
 # Set by Google - currently 10MB
 # This is used for validation of file uploads.
 # TODO: implement
@@ -41,5 +57,51 @@ CSRF_HANDLER_PATH = 'gae_csrf.handlers.CSRFRequestHandler'
 # Useful e.g. when errors occur in the admin handler
 NOTIFY_CALLBACK = None
 
+# Count datastore/memcache RPCs and time rendering and ModelAdmin hooks per request.
+# Shown in the page footer during development, logged and sent as a
+# Server-Timing header in production.
+REQUEST_STATS = True
+
+# Request budgets, checked when REQUEST_STATS is enabled. Requests that take
+# longer than latency_ms or make more than datastore_rpcs datastore RPCs call
+# NOTIFY_CALLBACK with reason 'slow_request'. None disables a check.
+REQUEST_BUDGET = {
+  'latency_ms': None,
+  'datastore_rpcs': None,
+}
+# Per route overrides of REQUEST_BUDGET, by route name, e.g.
+# {'appengine_admin.list': {'datastore_rpcs': 5}}
+# ModelAdmin.request_budget and ModelAdmin.route_request_budgets override these.
+ROUTE_REQUEST_BUDGETS = {}
+
+# Background jobs (see jobs.py). Task queue used to run job slices, the admin
+# URLs must accept task queue requests.
+JOB_QUEUE = 'default'
+# Entities processed per slice.
+JOB_BATCH_SIZE = 100
+# Token bucket throttling each job: entities per second on average and the
+# most tokens that can be saved up. None disables throttling.
+JOB_RATE_LIMIT = 50
+JOB_BURST = 500
+# Default number of shards, processed in parallel, for map jobs started in the admin.
+JOB_SHARDS = 8
+# Stored entities sampled for the schema report of a model, see backfill.py.
+BACKFILL_SAMPLE_SIZE = 500
+# Jobs are marked failed after this many failed slices.
+JOB_MAX_FAILURES = 5
+# Entities counted when starting a job to show its progress, more are shown as unknown.
+JOB_COUNT_LIMIT = 10000
+# Referencing entities counted per property for the edit page's reverse-references panel.
+REVERSE_REFERENCE_LIMIT = 100
+
+# Connections kept open by the engines of sqlalchemy_admin.create_session, and
+# the seconds after which a pooled connection is replaced.
+SQLALCHEMY_POOL_SIZE = 5
+SQLALCHEMY_POOL_RECYCLE = 3600
+
+# Rows offered as choices for a relationship in SQLAlchemyModelAdmin forms. The
+# selected rows are always offered, and submitted rows are looked up by primary key.
+SQLALCHEMY_CHOICES_LIMIT = 100
+
 # Default timezone for use in admin dates
 TIMEZONE = 'America/Los_Angeles'
@@ -0,0 +1,160 @@
+'''Schema backfill for properties added to or changed on a model.
+
+Entities written before a property was added don't store it, so queries and
+sorts on the property miss them. Entities written before a property changed
+type store values the model can no longer load.
+
+schema_report() compares the model's properties with a sample of the raw
+stored entities. The backfill job operation rewrites the affected entities
+(defaults for missing properties, converted values for stale types) in
+resumable slices, or only counts them with the dry_run param.
+'''
+import logging
+
+from google.appengine.api import datastore
+from google.appengine.ext import db
+
+from . import admin_settings, jobs, labels
+
+
+# Stored value conversions for properties whose type changed, by Property.data_type.
+_CONVERSIONS = {
+  basestring: unicode,
+  int: int,
+  long: long,
+  float: float,
+  db.Text: db.Text,
+}
+
+
+def _is_valid(prop, value):
+  try:
+    prop.validate(prop.make_value_from_datastore(value))
+  except (db.BadValueError, TypeError, ValueError):
+    return False
+  return True
+
+
+def diff_entity(model, entity):
+  '''Compare a raw datastore entity with the model.
+
+  Returns a tuple of (missing, stale) property names: properties the entity
+  doesn't store, and properties whose stored value the model can't load.
+  '''
+  missing = []
+  stale = []
+  for name, prop in model.properties().items():
+    if prop.name not in entity:
+      # Empty lists are never stored, there is nothing to backfill.
+      if not isinstance(prop, db.ListProperty) or prop.default_value():
+        missing.append(name)
+    elif not _is_valid(prop, entity[prop.name]):
+      stale.append(name)
+  return missing, stale
+
+
+def convert_value(prop, value):
+  '''Convert a stale stored value to the property's type, raises ValueError if impossible.'''
+  conversion = _CONVERSIONS.get(prop.data_type)
+  if not conversion:
+    raise ValueError('Can not convert %r for %s' % (value, prop.__class__.__name__))
+  try:
+    return prop.validate(conversion(value))
+  except (db.BadValueError, TypeError, ValueError, UnicodeError):
+    raise ValueError('Can not convert %r for %s' % (value, prop.__class__.__name__))
+
+
+def fix_entity(model, entity, stale):
+  '''Load a raw entity as a model instance with its stale values converted.
+
+  Missing properties get their defaults. Raises ValueError if a stale value
+  can't be converted, db.BadValueError if the entity still doesn't load, e.g.
+  without a required property that has no default.
+  '''
+  properties = model.properties()
+  values = {}
+  for name in stale:
+    prop = properties[name]
+    values[name] = convert_value(prop, entity[prop.name])
+    del entity[prop.name]
+  instance = model.from_entity(entity)
+  for name, value in values.items():
+    setattr(instance, name, value)
+  return instance
+
+
+def sample_entities(model, sample_size):
+  '''Get up to sample_size raw entities, spread over the kind where possible.'''
+  query = datastore.Query(model.kind())
+  query.Order('__scatter__')
+  entities = query.Get(sample_size)
+  if len(entities) < sample_size:
+    # Only a fraction of the entities have a __scatter__ value, read from the start instead.
+    entities = datastore.Query(model.kind()).Get(sample_size)
+  return entities
+
+
+def schema_report(model, sample_size=None):
+  '''Diff model.properties() with a sample of the stored entities.
+
+  Returns a dict of:
+    * sampled - number of entities sampled
+    * affected - sampled entities that need a backfill
+    * missing - property name -> sampled entities not storing it
+    * stale - property name -> sampled entities storing a value of a stale type
+    * unknown - stored property -> sampled entities storing it, for properties
+      no longer on the model (not for db.Expando)
+  '''
+  entities = sample_entities(model, sample_size or admin_settings.BACKFILL_SAMPLE_SIZE)
+  datastore_names = set(prop.name for prop in model.properties().values())
+  report = {'sampled': len(entities), 'affected': 0, 'missing': {}, 'stale': {}, 'unknown': {}}
+  for entity in entities:
+    missing, stale = diff_entity(model, entity)
+    if missing or stale:
+      report['affected'] += 1
+    for key, names in (('missing', missing), ('stale', stale)):
+      for name in names:
+        report[key][name] = report[key].get(name, 0) + 1
+    if not issubclass(model, db.Expando):
+      for name in set(entity) - datastore_names:
+        report['unknown'][name] = report['unknown'].get(name, 0) + 1
+  return report
+
+
+@jobs.register_operation
+class BackfillOperation(jobs.JobOperation):
+  '''Rewrite the entities missing properties or storing stale types.
+
+  params:
+    * dry_run - only count the entities that would be rewritten
+  '''
+  name = 'backfill'
+  label = 'Backfill'
+  keys_only = True
+
+  @classmethod
+  def describe(cls, params):
+    return '%s (dry run)' % cls.label if params.get('dry_run') else cls.label
+
+  @classmethod
+  def params_from_request(cls, request):
+    return {'dry_run': bool(request.get('dry_run'))}
+
+  def process(self, keys):
+    model = self.model_admin.model
+    to_put = []
+    errors = 0
+    for entity in datastore.Get(keys):
+      if entity is None:  # Deleted since the keys were fetched.
+        continue
+      missing, stale = diff_entity(model, entity)
+      if not missing and not stale:
+        continue
+      try:
+        to_put.append(fix_entity(model, entity, stale))
+      except (ValueError, db.Error):
+        logging.warning('Can not backfill %s', entity.key(), exc_info=True)
+        errors += 1
+    if to_put and not self.params.get('dry_run'):
+      labels.invalidate(db.put(to_put))
+    return {'changed': len(to_put), 'errors': errors}
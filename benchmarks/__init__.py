@@ -0,0 +1,46 @@
+'''Benchmark and load-test tools for appengine_admin.
+
+Run them with the App Engine SDK (and webapp2/jinja2 from it) on PYTHONPATH,
+e.g. `python -m appengine_admin.benchmarks.loadtest --help`.
+'''
+import math
+
+from google.appengine.ext import testbed as gae_testbed
+
+
+APP_ID = 'appengine-admin-bench'
+
+
+def setup_testbed(datastore_file=None, save_changes=False):
+  '''Activate a testbed with datastore, memcache and user stubs.
+
+  Pass datastore_file to use (and with save_changes, persist) a local
+  datastore, e.g. one written by appengine_admin.benchmarks.dataset.
+  '''
+  testbed = gae_testbed.Testbed()
+  testbed.activate()
+  testbed.setup_env(app_id=APP_ID, USER_EMAIL='admin@example.com', USER_ID='1',
+                    USER_IS_ADMIN='1', overwrite=True)
+  if datastore_file:
+    testbed.init_datastore_v3_stub(datastore_file=datastore_file, use_sqlite=True,
+                                   save_changes=save_changes)
+  else:
+    testbed.init_datastore_v3_stub()
+  testbed.init_memcache_stub()
+  testbed.init_user_stub()
+  testbed.init_taskqueue_stub()
+  return testbed
+
+
+def import_setup(module_paths):
+  '''Import the modules that register the ModelAdmins to benchmark.'''
+  for module_path in module_paths or []:
+    __import__(module_path)
+
+
+def percentile(sorted_values, fraction):
+  '''Nearest-rank percentile of an already sorted list.'''
+  if not sorted_values:
+    return None
+  index = max(0, min(len(sorted_values) - 1, int(math.ceil(fraction * len(sorted_values))) - 1))
+  return sorted_values[index]
@@ -0,0 +1,237 @@
+'''Synthetic dataset generator driven by the registered ModelAdmin schemas.
+
+Reads the property definitions of every registered ModelAdmin.model and writes
+deterministic random entities with batched puts into a sqlite datastore stub
+file, which the load test and benchmarks can reuse across runs.
+
+Entities get key names like `song-42`, so references are built without reading
+anything back and re-running with the same seed overwrites the same entities.
+
+Example:
+===
+python -m appengine_admin.benchmarks.dataset --setup myapp.admin \\
+  --datastore-file /tmp/bench.sqlite --count 10000 --count-for Song=300000 \\
+  --fan-out 20 --text-size 4000 --dynamic-props 3
+===
+'''
+import argparse
+import random
+import string
+import sys
+import time
+from datetime import datetime, timedelta
+
+from google.appengine.api import users
+from google.appengine.ext import db
+
+from . import import_setup, setup_testbed
+from .. import model_register
+
+
+# Maximum number of entities per datastore put.
+MAX_BATCH_SIZE = 500
+_BASE_DATETIME = datetime(2012, 1, 1)
+_WORDS = ('alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel',
+          'india', 'juliet', 'kilo', 'lima', 'mike', 'november', 'oscar', 'papa')
+
+
+class DatasetGenerator(object):
+  '''Generates entities for a set of models.
+
+  Input:
+    * counts - dict of kind -> number of entities to generate
+    * seed - the same seed and counts always generate the same entities
+    * fan_out - average number of keys in a ListProperty(db.Key)
+    * text_size - average length of TextProperty values
+    * dynamic_props - number of dynamic string properties per db.Expando entity
+  '''
+
+  def __init__(self, counts, seed=0, fan_out=5, text_size=1000, dynamic_props=0,
+               batch_size=MAX_BATCH_SIZE):
+    self.counts = counts
+    self.seed = seed
+    self.fan_out = fan_out
+    self.text_size = text_size
+    self.dynamic_props = dynamic_props
+    self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+
+  @staticmethod
+  def key_name(kind, index):
+    return '%s-%d' % (kind.lower(), index)
+
+  def random_key(self, rnd, kinds):
+    kinds = [kind for kind in kinds if self.counts.get(kind)]
+    if not kinds:
+      return None
+    kind = rnd.choice(kinds)
+    return db.Key.from_path(kind, self.key_name(kind, rnd.randrange(self.counts[kind])))
+
+  def referenced_kinds(self, classes):
+    '''Kinds a reference may point to, any generated kind for db.Model.'''
+    if not classes or db.Model in classes or db.Expando in classes:
+      return sorted(self.counts)
+    return [cls.kind() for cls in classes]
+
+  def words(self, rnd, count):
+    return ' '.join(rnd.choice(_WORDS) for _ in xrange(count))
+
+  def text(self, rnd, size):
+    size = rnd.randint(size // 2, size * 3 // 2) if size else 0
+    return ''.join(rnd.choice(string.ascii_letters + ' \n') for _ in xrange(size))
+
+  def value_for(self, rnd, prop, index):
+    '''Generate a value for a property, or None to leave it at its default.'''
+    for prop_cls in type(prop).__mro__:
+      generator = getattr(self, 'generate_%s' % prop_cls.__name__, None)
+      if generator:
+        break
+    else:
+      return None
+    if getattr(prop, 'choices', None):
+      return rnd.choice(list(prop.choices))
+    return generator(rnd, prop, index)
+
+  def generate_StringProperty(self, rnd, prop, index):
+    return self.words(rnd, rnd.randint(1, 4))
+
+  def generate_TextProperty(self, rnd, prop, index):
+    return db.Text(self.text(rnd, self.text_size))
+
+  def generate_ByteStringProperty(self, rnd, prop, index):
+    return db.ByteString(self.text(rnd, 32))
+
+  def generate_BlobProperty(self, rnd, prop, index):
+    return db.Blob(self.text(rnd, 256))
+
+  def generate_IntegerProperty(self, rnd, prop, index):
+    return rnd.randint(0, 10 ** 6)
+
+  def generate_FloatProperty(self, rnd, prop, index):
+    return rnd.random() * 1000
+
+  def generate_BooleanProperty(self, rnd, prop, index):
+    return rnd.choice((True, False))
+
+  def generate_DateTimeProperty(self, rnd, prop, index):
+    if prop.auto_now or prop.auto_now_add:
+      return None
+    value = _BASE_DATETIME + timedelta(seconds=rnd.randint(0, 3 * 365 * 24 * 3600))
+    if isinstance(prop, db.DateProperty):
+      return value.date()
+    if isinstance(prop, db.TimeProperty):
+      return value.time()
+    return value
+
+  def generate_EmailProperty(self, rnd, prop, index):
+    return db.Email('user%d@example.com' % rnd.randint(0, 10 ** 6))
+
+  def generate_LinkProperty(self, rnd, prop, index):
+    return db.Link('http://example.com/%d' % rnd.randint(0, 10 ** 6))
+
+  def generate_CategoryProperty(self, rnd, prop, index):
+    return db.Category(rnd.choice(_WORDS))
+
+  def generate_PhoneNumberProperty(self, rnd, prop, index):
+    return db.PhoneNumber('555-%04d' % rnd.randint(0, 9999))
+
+  def generate_PostalAddressProperty(self, rnd, prop, index):
+    return db.PostalAddress('%d %s street' % (rnd.randint(1, 999), rnd.choice(_WORDS)))
+
+  def generate_RatingProperty(self, rnd, prop, index):
+    return db.Rating(rnd.randint(0, 100))
+
+  def generate_GeoPtProperty(self, rnd, prop, index):
+    return db.GeoPt(rnd.uniform(-90, 90), rnd.uniform(-180, 180))
+
+  def generate_UserProperty(self, rnd, prop, index):
+    if prop.auto_current_user or prop.auto_current_user_add:
+      return None
+    return users.User('user%d@example.com' % rnd.randint(0, 1000))
+
+  def generate_StringListProperty(self, rnd, prop, index):
+    return [rnd.choice(_WORDS) for _ in xrange(rnd.randint(0, 2 * self.fan_out))]
+
+  def generate_ListProperty(self, rnd, prop, index):
+    size = rnd.randint(0, 2 * self.fan_out)
+    if prop.item_type == db.Key:
+      kinds = self.referenced_kinds(getattr(prop, 'object_classes', None))
+      return [key for key in (self.random_key(rnd, kinds) for _ in xrange(size)) if key]
+    if issubclass(prop.item_type, basestring):
+      return [prop.item_type(rnd.choice(_WORDS)) for _ in xrange(size)]
+    if prop.item_type in (int, long, float):
+      return [prop.item_type(rnd.randint(0, 1000)) for _ in xrange(size)]
+    return None
+
+  def generate_ReferenceProperty(self, rnd, prop, index):
+    return self.random_key(rnd, self.referenced_kinds([prop.reference_class]))
+
+  def make_entity(self, model, index):
+    kind = model.kind()
+    rnd = random.Random('%s:%s:%d' % (self.seed, kind, index))
+    values = {}
+    for name, prop in sorted(model.properties().items()):
+      value = self.value_for(rnd, prop, index)
+      if value is not None:
+        values[name] = value
+    entity = model(key_name=self.key_name(kind, index), **values)
+    if issubclass(model, db.Expando):
+      for prop_index in xrange(self.dynamic_props):
+        setattr(entity, 'dynamic_%d' % prop_index, self.words(rnd, rnd.randint(1, 6)))
+    return entity
+
+  def generate(self, models, out=None, put=db.put):
+    '''Generate and put the entities for each model, returns entities written per kind.
+
+    put writes a batch, e.g. a memory_admin.MemoryStore's put_multi to
+    benchmark without the datastore stub.
+    '''
+    written = {}
+    for model in models:
+      kind = model.kind()
+      count = self.counts.get(kind, 0)
+      start = time.time()
+      for batch_start in xrange(0, count, self.batch_size):
+        batch_end = min(count, batch_start + self.batch_size)
+        put([self.make_entity(model, index) for index in xrange(batch_start, batch_end)])
+        if out:
+          out.write('\r%s: %d/%d' % (kind, batch_end, count))
+          out.flush()
+      written[kind] = count
+      if out:
+        out.write('\r%s: %d entities in %.1fs\n' % (kind, count, time.time() - start))
+    return written
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+  parser.add_argument('--setup', action='append', default=[],
+                      help='module that registers the ModelAdmins, may be repeated')
+  parser.add_argument('--datastore-file', required=True, help='sqlite datastore stub file to write to')
+  parser.add_argument('--count', type=int, default=1000, help='entities per registered kind')
+  parser.add_argument('--count-for', action='append', default=[], metavar='KIND=COUNT',
+                      help='override the count for one kind, may be repeated')
+  parser.add_argument('--fan-out', type=int, default=5, help='average keys per ListProperty(db.Key)')
+  parser.add_argument('--text-size', type=int, default=1000, help='average TextProperty length')
+  parser.add_argument('--dynamic-props', type=int, default=0, help='dynamic properties per Expando')
+  parser.add_argument('--seed', type=int, default=0)
+  args = parser.parse_args(argv)
+
+  testbed = setup_testbed(datastore_file=args.datastore_file, save_changes=True)
+  try:
+    import_setup(args.setup)
+    models = [model_admin.model for _, model_admin in sorted(model_register._model_register.items())]
+    if not models:
+      parser.error('No ModelAdmins registered, pass --setup with the module registering them.')
+    counts = dict((model.kind(), args.count) for model in models)
+    for count_for in args.count_for:
+      kind, _, count = count_for.partition('=')
+      counts[kind] = int(count)
+    generator = DatasetGenerator(counts, seed=args.seed, fan_out=args.fan_out,
+                                 text_size=args.text_size, dynamic_props=args.dynamic_props)
+    generator.generate(models, out=sys.stdout)
+  finally:
+    testbed.deactivate()
+
+
+if __name__ == '__main__':
+  main()
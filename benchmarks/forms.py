@@ -0,0 +1,166 @@
+'''Micro-benchmarks for admin form build, process, validate and render.
+
+Measures, for synthetic models of 10, 100 and 500 properties:
+  * create - admin_forms.create class build
+  * init - WTForm(obj=...) instantiation (BaseForm.__init__ binding plus process)
+  * process - WTForm(formdata=..., obj=...) as on a POST
+  * validate - validate() of a processed form
+  * render - rendering every field and label to HTML
+
+Results are written as JSON, and --compare prints the change against an
+earlier results file, e.g. before and after touching wtforms/form.py.
+
+Example:
+===
+python -m appengine_admin.benchmarks.forms --output after.json --compare before.json
+===
+'''
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from google.appengine.ext import db
+from webob.multidict import MultiDict
+
+from .. import admin_forms, utils
+from ..tests.client import AdminClient
+
+
+DEFAULT_SIZES = (10, 100, 500)
+OPERATIONS = ('create', 'init', 'process', 'validate', 'render')
+
+# property class, value for the i-th property
+_PROPERTY_TYPES = [
+  (db.StringProperty, lambda i: u'value %d' % i),
+  (db.IntegerProperty, lambda i: i),
+  (db.BooleanProperty, lambda i: bool(i % 2)),
+  (db.TextProperty, lambda i: u'text\nvalue %d' % i),
+  (db.FloatProperty, lambda i: i / 3.0),
+  (db.DateProperty, lambda i: datetime(2012, 1, 1 + i % 28).date()),
+]
+try:
+  utils.import_pytz()
+  # Only benchmark datetimes with pytz, DateTimeField can't parse them without it.
+  _PROPERTY_TYPES.append((db.DateTimeProperty, lambda i: datetime(2012, 1, 1, i % 24)))
+except ImportError:
+  pass
+
+
+def make_model(size):
+  '''Create a db.Model class with size properties and an instance of it.'''
+  properties = {}
+  values = {}
+  for i in xrange(size):
+    prop_cls, make_value = _PROPERTY_TYPES[i % len(_PROPERTY_TYPES)]
+    name = 'p%03d_%s' % (i, prop_cls.__name__.lower())
+    properties[name] = prop_cls()
+    values[name] = make_value(i)
+  model = type('FormBench%dModel' % size, (db.Model,), properties)
+  return model, model(**values)
+
+
+def measure(func, number, repeat):
+  '''Return the best and median time in ms of one call, timeit style.'''
+  runs = []
+  for _ in xrange(repeat):
+    start = time.time()
+    for _ in xrange(number):
+      func()
+    runs.append((time.time() - start) * 1000 / number)
+  runs.sort()
+  return {'best_ms': runs[0], 'median_ms': runs[len(runs) // 2]}
+
+
+def benchmark_size(size, number, repeat):
+  model, instance = make_model(size)
+  form_cls = admin_forms.create(model)
+  formdata = MultiDict(AdminClient.form_params(form_cls(obj=instance)))
+
+  def validate():
+    form = form_cls(formdata=formdata, obj=instance)
+    start = time.time()
+    form.validate()
+    return time.time() - start
+
+  def render(form=form_cls(obj=instance)):
+    for field in form:
+      field.label()
+      field()
+
+  results = {
+    'create': measure(lambda: admin_forms.create(model), number, repeat),
+    'init': measure(lambda: form_cls(obj=instance), number, repeat),
+    'process': measure(lambda: form_cls(formdata=formdata, obj=instance), number, repeat),
+    'render': measure(render, number, repeat),
+  }
+  # Only time validate() itself, each run needs a freshly processed form.
+  validate_runs = sorted(sum(validate() for _ in xrange(number)) * 1000 / number for _ in xrange(repeat))
+  results['validate'] = {'best_ms': validate_runs[0], 'median_ms': validate_runs[len(validate_runs) // 2]}
+  return results
+
+
+def git_revision():
+  try:
+    return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                   cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def run(sizes=DEFAULT_SIZES, number=10, repeat=5):
+  return {
+    'meta': {
+      'revision': git_revision(),
+      'python': platform.python_version(),
+      'platform': platform.platform(),
+      'time': datetime.utcnow().isoformat(),
+      'number': number,
+      'repeat': repeat,
+    },
+    'results': dict((str(size), benchmark_size(size, number, repeat)) for size in sizes),
+  }
+
+
+def report(results, previous=None, out=sys.stdout):
+  out.write('%6s %-9s %11s %11s %9s\n' % ('props', 'op', 'best ms', 'median ms', 'change'))
+  for size in sorted(results['results'], key=int):
+    for operation in OPERATIONS:
+      timing = results['results'][size][operation]
+      change = ''
+      try:
+        before = previous['results'][size][operation]['best_ms']
+        change = '%+.1f%%' % ((timing['best_ms'] - before) / before * 100)
+      except (KeyError, TypeError, ZeroDivisionError):
+        pass
+      out.write('%6s %-9s %11.3f %11.3f %9s\n' % (size, operation, timing['best_ms'], timing['median_ms'], change))
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+  parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES),
+                      help='comma separated property counts')
+  parser.add_argument('--number', type=int, default=10, help='calls per timing run')
+  parser.add_argument('--repeat', type=int, default=5, help='timing runs per operation')
+  parser.add_argument('--output', help='write the results as JSON to this file')
+  parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+  args = parser.parse_args(argv)
+
+  results = run(sizes=[int(size) for size in args.sizes.split(',')],
+                number=args.number, repeat=args.repeat)
+  previous = None
+  if args.compare:
+    with open(args.compare) as previous_file:
+      previous = json.load(previous_file)
+  report(results, previous)
+  if args.output:
+    with open(args.output, 'w') as output_file:
+      json.dump(results, output_file, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+  main()
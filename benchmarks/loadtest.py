@@ -0,0 +1,192 @@
+'''Concurrent load test for the admin WSGI application.
+
+Mounts get_application_routes() and get_webapp2_config() in a webapp2 app over
+testbed stubs and fires requests from a thread pool at the list, edit, save
+and json (ajax mini page) routes of the registered ModelAdmins.
+
+Example:
+===
+python -m appengine_admin.benchmarks.loadtest --setup myapp.admin \\
+  --datastore-file /tmp/bench.sqlite --requests 2000 --concurrency 8 \\
+  --mix list=4,edit=3,save=1,json=2 --rpc-latency-ms 20
+===
+'''
+import argparse
+import random
+import sys
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from google.appengine.ext import db
+from wtforms.fields import FileField, HiddenField, StringField
+
+from . import import_setup, percentile, setup_testbed
+from .. import model_register
+from ..tests import simulate_rpc_latency
+from ..tests.client import AdminClient
+
+
+OPERATIONS = ('list', 'edit', 'save', 'json')
+DEFAULT_MIX = 'list=4,edit=3,save=1,json=2'
+
+
+def parse_mix(mix):
+  weights = {}
+  for part in mix.split(','):
+    operation, _, weight = part.partition('=')
+    operation = operation.strip()
+    if operation not in OPERATIONS:
+      raise ValueError('Unknown operation %r, use one of %s' % (operation, ', '.join(OPERATIONS)))
+    weights[operation] = float(weight or 1)
+  return weights
+
+
+class LoadTest(object):
+  '''Runs weighted random admin operations concurrently and records latencies.'''
+
+  def __init__(self, model_names, mix, seed=0, keys_per_model=100):
+    self.mix = sorted(mix.items())
+    self.random = random.Random(seed)
+    self.random_lock = threading.Lock()
+    self.local = threading.local()
+    self.keys = {}
+    for model_name in model_names:
+      model = model_register.get_model_admin(model_name).model
+      keys = model.all(keys_only=True).fetch(keys_per_model)
+      if keys:
+        self.keys[model_name] = keys
+    self.model_names = model_names
+    self.latencies = dict((operation, []) for operation in OPERATIONS)
+    self.errors = dict((operation, 0) for operation in OPERATIONS)
+    self.results_lock = threading.Lock()
+
+  @property
+  def client(self):
+    # webapp2 keeps per-request state in thread locals, cookies are per client.
+    if not hasattr(self.local, 'client'):
+      self.local.client = AdminClient(debug=False)
+    return self.local.client
+
+  def pick(self):
+    with self.random_lock:
+      point = self.random.uniform(0, sum(weight for _, weight in self.mix))
+      for operation, weight in self.mix:
+        point -= weight
+        if point <= 0:
+          break
+      if operation in ('edit', 'save') and self.keys:
+        model_name = self.random.choice(sorted(self.keys))
+        key = self.random.choice(self.keys[model_name])
+      else:
+        model_name, key = self.random.choice(self.model_names), None
+    return operation, model_name, key
+
+  def run_one(self, _):
+    operation, model_name, key = self.pick()
+    if operation in ('edit', 'save') and key is None:
+      operation = 'list'
+    start = time.time()
+    try:
+      status, elapsed = getattr(self, 'do_%s' % operation)(model_name, key)
+      failed = status >= 500
+    except Exception:
+      failed, elapsed = True, time.time() - start
+    with self.results_lock:
+      self.latencies[operation].append(elapsed)
+      if failed:
+        self.errors[operation] += 1
+
+  # Each operation returns (status, seconds) for the request being measured.
+
+  def _timed(self, make_request, *args, **kwargs):
+    start = time.time()
+    response = make_request(*args, **kwargs)
+    return response.status_int, time.time() - start
+
+  def do_list(self, model_name, key):
+    return self._timed(self.client.get, self.client.uri_for('list', model_name=model_name))
+
+  def do_json(self, model_name, key):
+    url = self.client.uri_for('list', model_name=model_name) + '?ajax_mini_page=1'
+    return self._timed(self.client.get, url)
+
+  def do_edit(self, model_name, key):
+    return self._timed(self.client.get, self.client.uri_for('edit', model_name=model_name, key=key))
+
+  @staticmethod
+  def change_text_param(form, params):
+    '''Toggle a ' *' suffix on the value of the first text field, raises ValueError without one.
+
+    An unchanged form is answered with "No changes" and writes nothing.
+    '''
+    for field in form:
+      if isinstance(field, StringField) and not isinstance(field, (FileField, HiddenField)):
+        value = field._value()
+        value = value[:-2] if value.endswith(' *') else value + ' *'
+        return [(name, param) for name, param in params if name != field.name] + [(field.name, value)]
+    raise ValueError('No text field to change in the edit form.')
+
+  def do_save(self, model_name, key):
+    '''Submit the edit form with a text field changed, only the POST is measured.'''
+    edit_url = self.client.uri_for('edit', model_name=model_name, key=key)
+    page = self.client.get(edit_url)
+    form = model_register.get_model_admin(model_name).AdminForm(obj=db.get(key))
+    params = self.change_text_param(form, self.client.form_params(form))
+    return self._timed(self.client.post, edit_url, params, csrf_from=page)
+
+  def run(self, requests, concurrency):
+    pool = ThreadPool(concurrency)
+    start = time.time()
+    try:
+      pool.map(self.run_one, xrange(requests), chunksize=1)
+    finally:
+      pool.close()
+      pool.join()
+    return time.time() - start
+
+  def report(self, elapsed, out=sys.stdout):
+    total = sum(len(latencies) for latencies in self.latencies.values())
+    out.write('%d requests in %.2fs: %.1f req/s\n' % (total, elapsed, total / elapsed if elapsed else 0))
+    out.write('%-6s %7s %7s %9s %9s %9s\n' % ('op', 'count', 'errors', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for operation in OPERATIONS:
+      latencies = sorted(self.latencies[operation])
+      if not latencies:
+        continue
+      out.write('%-6s %7d %7d %9.1f %9.1f %9.1f\n' % (
+        operation, len(latencies), self.errors[operation],
+        percentile(latencies, 0.50) * 1000, percentile(latencies, 0.95) * 1000,
+        percentile(latencies, 0.99) * 1000))
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+  parser.add_argument('--setup', action='append', default=[],
+                      help='module that registers the ModelAdmins, may be repeated')
+  parser.add_argument('--datastore-file', help='sqlite datastore stub file to read entities from')
+  parser.add_argument('--models', help='comma separated model names, defaults to all registered')
+  parser.add_argument('--requests', type=int, default=500)
+  parser.add_argument('--concurrency', type=int, default=8)
+  parser.add_argument('--mix', default=DEFAULT_MIX, help='weighted operations, default %s' % DEFAULT_MIX)
+  parser.add_argument('--rpc-latency-ms', type=float, default=0,
+                      help='simulated latency added to every datastore RPC')
+  parser.add_argument('--seed', type=int, default=0)
+  args = parser.parse_args(argv)
+
+  testbed = setup_testbed(datastore_file=args.datastore_file)
+  try:
+    import_setup(args.setup)
+    model_names = args.models.split(',') if args.models else sorted(model_register._model_register)
+    if not model_names:
+      parser.error('No ModelAdmins registered, pass --setup with the module registering them.')
+    if args.rpc_latency_ms:
+      simulate_rpc_latency(args.rpc_latency_ms)
+    load_test = LoadTest(model_names, parse_mix(args.mix), seed=args.seed)
+    elapsed = load_test.run(args.requests, args.concurrency)
+    load_test.report(elapsed)
+  finally:
+    testbed.deactivate()
+
+
+if __name__ == '__main__':
+  main()
@@ -1,8 +1,10 @@
+import hashlib
 from datetime import datetime
 
-from google.appengine.ext import db
+from google.appengine.ext import db, ndb
+from google.net.proto import ProtocolBuffer
 
-from . import widgets, wtforms
+from . import admin_settings, labels, widgets, wtforms
 from wtforms import fields as f, widgets as w
 
 
@@ -104,6 +106,34 @@ class IntegerField(f.IntegerField):
       super(IntegerField, self).process_formdata(valuelist)
 
 
+class NdbKeyField(f.TextField):
+  '''A text input for an ndb.KeyProperty, holding the URL-safe key string.
+
+  Pass kind to only accept keys of that kind.
+  '''
+  def __init__(self, label=None, validators=None, kind=None, **kwargs):
+    super(NdbKeyField, self).__init__(label, validators, **kwargs)
+    self.kind = kind
+
+  def _value(self):
+    if self.raw_data:
+      return self.raw_data[0]
+    return self.data.urlsafe() if self.data else ''
+
+  def process_formdata(self, valuelist):
+    value = valuelist[0].strip() if valuelist else ''
+    if not value:
+      self.data = None
+      return
+    try:
+      key = ndb.Key(urlsafe=value)
+    except (TypeError, ValueError, ProtocolBuffer.ProtocolBufferDecodeError):
+      raise ValueError('Invalid key: %s' % value)
+    if self.kind and key.kind() != self.kind:
+      raise ValueError('Not a key of a %s.' % self.kind)
+    self.data = key
+
+
 class AjaxKeyField(f.Field):
   '''A field with an AJAX paginator widget.
 
@@ -113,7 +143,13 @@ class AjaxKeyField(f.Field):
   Used for:
     * db.ListProprety (with multiple=True)
     * db.ReferenceProperty(db.Key) (with multiple=False)
+
+  With delta=True (set by WTForm.enable_list_deltas when editing) a list is not
+  re-submitted as a whole. The widget posts a version token of the stored list
+  plus the added and removed keys, which are applied to the stored list here.
   '''
+  delta = False
+
   def __init__(self, label=None, validators=None, multiple=True,
                object_classes=None, required=False, **kwargs):
     super(AjaxKeyField, self).__init__(label, validators, **kwargs)
@@ -122,9 +158,60 @@ class AjaxKeyField(f.Field):
     self.required = required
     self.object_classes = {kls.__name__: kls for kls in object_classes or []}
     self.widget = widgets.AjaxKeyWidget(multiple=multiple)
+    self.added_keys = []
+    self.removed_keys = []
+    # Started by WTForm.prefetch, labels.get_labels_async result and kind name -> selector page result.
+    self.prefetched_labels = None
+    self.selector_pages = {}
+
+  def accepts_kind(self, kind):
+    '''Tell if keys of kind may be referenced, any kind when object_classes includes db.Model.'''
+    return not self.object_classes or any(
+      kls is db.Model or kls.kind() == kind for kls in self.object_classes.values())
+
+  @property
+  def version_name(self):
+    return '%s__version' % self.name
+
+  @property
+  def add_name(self):
+    return '%s__add' % self.name
+
+  @property
+  def remove_name(self):
+    return '%s__remove' % self.name
+
+  @staticmethod
+  def list_version(keys):
+    '''Token identifying the contents of a list of keys.'''
+    return hashlib.md5('\n'.join(str(key) for key in keys)).hexdigest()
+
+  @staticmethod
+  def to_keys(values):
+    '''Convert entities, keys and key strings to keys, skipping empty values.'''
+    keys = []
+    for value in values or []:
+      if not value:
+        continue
+      if isinstance(value, db.Model):
+        value = value.key()
+      elif not isinstance(value, db.Key):
+        try:
+          value = db.Key(value)
+        except db.BadKeyError:
+          raise ValueError('Invalid key: %s' % value)
+      keys.append(value)
+    return keys
+
+  def process(self, formdata, data=f._unset_value):
+    self._delta = None
+    if self.multiple and formdata and self.version_name in formdata:
+      self._delta = (formdata.getlist(self.version_name)[0],
+                     formdata.getlist(self.add_name),
+                     formdata.getlist(self.remove_name))
+    super(AjaxKeyField, self).process(formdata, data)
 
   def process_formdata(self, valuelist):
-    self.objects = []
     if not self.multiple:
       if not valuelist:
         self.data = None
@@ -134,12 +221,18 @@ class AjaxKeyField(f.Field):
       else:
         value = valuelist
       if isinstance(value, basestring):
+        # Keep the key, saving a reference doesn't need the entity.
         try:
-          value = db.get(value)
+          value = db.Key(value) if value else None
         except db.BadKeyError:
           raise ValueError('Invalid or missing key.')
+        if value is not None and not self.accepts_kind(value.kind()):
+          raise ValueError('Not a key of a %s.' % ' or '.join(sorted(self.object_classes)))
       self.data = value
-      self.objects.append((value.key(), value))
+      return
+
+    if getattr(self, '_delta', None):
+      self.data = self.apply_delta(*self._delta)
       return
 
     if not valuelist:
@@ -149,18 +242,55 @@ class AjaxKeyField(f.Field):
       self.data = []
       return
 
-    keys = []
+    self.data = self.to_keys(valuelist)
 
-    for key_str in valuelist:
-      if not key_str:
-        continue
-      # Turn string keys into Key objects
-      if isinstance(key_str, db.Key):
-        key = key_str
-      else:
-        key = db.Key(key_str)
-      keys.append(key)
-      obj = db.get(key)
-      self.objects.append((key, obj))
+  def apply_delta(self, version, added, removed):
+    '''Apply submitted added/removed keys to the stored list.'''
+    current = self.to_keys(self.object_data)
+    if version != self.list_version(current):
+      self.data = current
+      raise ValueError('The list was changed since this page was loaded, reload it and try again.')
+    added, removed = self.to_keys(added), self.to_keys(removed)
+    # A key both removed and added again is left where it is.
+    readded_keys = set(added) & set(removed)
+    current_keys = set(current)
+    self.removed_keys = [key for key in removed if key in current_keys and key not in readded_keys]
+    removed_keys = set(self.removed_keys)
+    data = [key for key in current if key not in removed_keys]
+    present_keys = set(data)
+    self.added_keys = []
+    for key in added:
+      if key not in present_keys:
+        data.append(key)
+        present_keys.add(key)
+        self.added_keys.append(key)
+    return data
 
-    self.data = keys
+  def get_display_keys(self):
+    '''Get the keys the widget shows: all of them, or the first page of a delta list plus the added keys.'''
+    try:
+      if not self.delta:
+        return self.to_keys(self.data if self.multiple else [self.data])
+      removed_keys = set(self.removed_keys)
+      shown_keys = [key for key in self.to_keys(self.object_data) if key not in removed_keys]
+      return shown_keys[:admin_settings.AJAX_KEY_FIELD_PAGE_SIZE] + self.to_keys(self.added_keys)
+    except ValueError:
+      return []
+
+  def get_display_objects(self, keys=None, limit=None):
+    '''Get up to limit (key, object) pairs to display, and the total number of keys.
+
+    Defaults to the current data. Objects are labels.Label instances read in
+    one batch, or taken from prefetched_labels, None for missing entities.
+    '''
+    if keys is None:
+      keys = self.data if self.multiple else [self.data]
+    if not self.multiple and keys and isinstance(keys[0], db.Model):
+      return [(keys[0].key(), keys[0])], 1
+    keys = self.to_keys(keys)
+    shown_keys = keys[:limit] if limit else keys
+    if self.prefetched_labels and set(shown_keys) <= set(self.get_display_keys()):
+      shown_labels = self.prefetched_labels.get_result()
+    else:
+      shown_labels = labels.get_labels(shown_keys)
+    return [(key, shown_labels.get(key)) for key in shown_keys], len(keys)
@@ -1,11 +1,16 @@
 import json
+import logging
 import sys
+import time
 import traceback
+import urllib
 
 import webapp2
+from google.appengine.ext import db
+from google.appengine.runtime import apiproxy_errors
 from webapp2_extras import jinja2, sessions
 
-from . import admin_settings, authorized, model_register, utils
+from . import admin_settings, authorized, backfill, jobs, labels, model_register, references, request_stats, utils
 
 
 CSRFHandler = utils.import_path(admin_settings.CSRF_HANDLER_PATH)
@@ -39,11 +44,17 @@ class BaseRequestHandler(CSRFHandler):
       'csrf_token': self.get_csrf_token,
       'settings': {
         'TIMEZONE': admin_settings.TIMEZONE,
+        'JOB_SHARDS': admin_settings.JOB_SHARDS,
       }
     })
+    # Pages of a model pass its ModelAdmin.get_urlsafe_key.
+    template_kwargs.setdefault('admin_key', utils.get_urlsafe_key)
     if hasattr(self, 'models'):
       template_kwargs['models'] = self.models
-    self.response.write(self.jinja2_instance.render_template(path, **template_kwargs))
+    if not utils.is_production():
+      template_kwargs['request_stats'] = request_stats.current()
+    with request_stats.timed('render'):
+      self.response.write(self.jinja2_instance.render_template(path, **template_kwargs))
 
   def redirect_admin(self, route_name, *args, **kwargs):
     self.redirect(self.uri_for('appengine_admin.%s' % route_name, *args, **kwargs))
@@ -53,6 +64,9 @@ class BaseRequestHandler(CSRFHandler):
     self.response.out.write(json.dumps(data))
 
   def dispatch(self):
+    if admin_settings.REQUEST_STATS:
+      route = self.request.route
+      request_stats.start(name=route.name if route else self.request.path)
     # Get a session store for this request.
     self.session_store = sessions.get_store(request=self.request)
     try:
@@ -61,6 +75,42 @@ class BaseRequestHandler(CSRFHandler):
     finally:
       # Save all sessions.
       self.session_store.save_sessions(self.response)
+      model_admin = self.get_route_model_admin()
+      if model_admin:
+        model_admin.end_request()
+      stats = request_stats.finish()
+      if stats:
+        self.report_request_stats(stats)
+        self.check_request_budget(stats)
+
+  def report_request_stats(self, stats):
+    '''Log the request stats and add them as a Server-Timing header in production.
+
+    Outside of production the stats are shown in the page footer instead.
+    '''
+    if not utils.is_production():
+      return
+    logging.info('appengine_admin request stats: %s', json.dumps(stats.summary(), sort_keys=True))
+    self.response.headers['Server-Timing'] = stats.server_timing()
+
+  def check_request_budget(self, stats):
+    '''Notify with reason slow_request when the request went over its budget.'''
+    budget = utils.get_request_budget(stats.name, self.get_route_model_admin())
+    exceeded = stats.exceeded_budget(budget)
+    if not exceeded:
+      return
+    utils.notify_if_configured(reason='slow_request',
+                               requesthandler=self,
+                               exceeded=exceeded,
+                               budget=budget,
+                               request_stats=stats.summary(),
+                               query=stats.offending_query(),
+                               url=self.request.url)
+
+  def get_route_model_admin(self):
+    '''Get the ModelAdmin of the model_name in the route, None if there is none.'''
+    model_name = self.request.route_kwargs.get('model_name')
+    return model_register._model_register.get(model_name) if model_name else None
 
   @webapp2.cached_property
   def session(self):
@@ -110,17 +160,20 @@ class AdminHandler(BaseRequestHandler):
   @authorized.check()
   def list(self, model_name, template_kwargs=None):
     '''List entities for a model by name.'''
+    started = time.time()
     model_admin = model_register.get_model_admin(model_name)
-    paginator = utils.Paginator(model_admin=model_admin)
-    # Get only those items that should be displayed in current page
-    page = paginator.get_page(request=self.request)
-    items = list(page)
     if self.request.get('ajax_mini_page'):
+      # A page of a reference selector, labels only with ModelAdmin.display_field.
+      page = model_admin.get_selector_page(
+        self.request, base_url=self.uri_for('appengine_admin.list', model_name=model_admin.model_name))
+      items = list(page)
+      # The items are loaded anyway, cache their labels for the pages referencing them.
+      item_labels = labels.remember(item for item in items if isinstance(item, (db.Model, labels.Label)))
       json_items = [{
-        'key': str(item.admin_reference_key() if hasattr(item, 'admin_reference_key') else item.key()),
-        'name': unicode(item),
+        'key': str(item.admin_reference_key()) if hasattr(item, 'admin_reference_key') else model_admin.get_urlsafe_key(item),
+        'name': item_labels.get(model_admin.get_item_key(item)) or model_admin.get_label(item),
         'model_name': model_name,
-        'edit_url': self.uri_for('appengine_admin.edit', model_name=model_name, key=item.key())
+        'edit_url': self.uri_for('appengine_admin.edit', model_name=model_name, key=model_admin.get_urlsafe_key(item))
       } for item in items]
       if page.has_next():
         next_url = page.get_next_url()
@@ -131,16 +184,64 @@ class AdminHandler(BaseRequestHandler):
       })
       self.json_response(json_items)
       return
+    # Get only those items that should be displayed in current page
+    page = model_admin.get_list_page(self.request)
+    items = list(page)
+    try:
+      offset = max(int(self.request.get('list_offset') or 0), 0)
+    except ValueError:
+      raise utils.Http404('Bad offset.')
+    rows = self.get_list_rows(model_admin, items[offset:], started + admin_settings.LIST_TIME_BUDGET)
+    continue_url = None
+    if offset + len(rows) < len(items):
+      logging.warning('Listing %s stopped after %d of %d rows, %.1fs into the request.',
+                      model_name, offset + len(rows), len(items), time.time() - started)
+      continue_url = self.get_list_continue_url(offset + len(rows))
     template_kwargs = template_kwargs or {}
     template_kwargs.update({
       'model_name': model_admin.model_name,
       'list_class_fields': model_admin.list_model_class_iter(),
       'list_fields': model_admin.list_model_iter,
+      'admin_key': model_admin.get_urlsafe_key,
+      'supports_db_tools': model_admin.supports_db_tools,
       'items': items,
+      'rows': rows,
+      'rows_offset': offset,
+      'continue_url': continue_url,
       'page': page,
     })
     self.render('list.html', template_kwargs)
 
+  def get_list_rows(self, model_admin, items, deadline):
+    '''Compute (item, values) list rows until the deadline (a timestamp) passes.
+
+    At least one row is computed, so continuing always makes progress. Rows
+    stop early when an RPC of a row times out too.
+    '''
+    rows = []
+    column_cache = model_admin.get_column_cache(items)
+    reference_labels = model_admin.get_reference_labels(items, model_admin.list_fields)
+    for item in items:
+      if rows and time.time() > deadline:
+        break
+      try:
+        rows.append((item, list(model_admin.list_model_iter(item, column_cache, reference_labels))))
+      except (db.Timeout, apiproxy_errors.DeadlineExceededError):
+        if not rows:
+          raise
+        logging.warning('Listing %s timed out on %s.', model_admin.model_name, model_admin.get_item_key(item), exc_info=True)
+        break
+    if column_cache:
+      column_cache.save()
+    return rows
+
+  def get_list_continue_url(self, offset):
+    '''URL of the current list page, continuing from the row at offset.'''
+    params = [(name, value.encode('utf-8')) for name, value in self.request.GET.items()
+              if name != 'list_offset']
+    params.append(('list_offset', offset))
+    return '%s?%s' % (self.request.path, urllib.urlencode(params))
+
   @BaseRequestHandler.csrf_token_required()
   @authorized.check()
   def new(self, model_name, template_kwargs=None):
@@ -151,11 +252,12 @@ class AdminHandler(BaseRequestHandler):
       if item_form.validate():
         # Save the data, and redirect to the edit page
         item = item_form.save()
-        self.add_message('%s %s created!' % (model_name, unicode(item)))
-        self.redirect_admin('edit', model_name=model_admin.model_name, key=item.key())
+        self.add_message('%s %s created!' % (model_name, model_admin.get_label(item)))
+        self.redirect_admin('edit', model_name=model_admin.model_name, key=model_admin.get_urlsafe_key(item))
         return
     else:
       item_form = model_admin.AdminNewForm(handler=self)
+    item_form.prefetch()
 
     template_kwargs = template_kwargs or {}
     template_kwargs.update({
@@ -171,16 +273,15 @@ class AdminHandler(BaseRequestHandler):
     '''Much like new, but pre-populates the fields with the values from an existing instance.
     '''
     model_admin = model_register.get_model_admin(model_name)
-    old_item = utils.safe_get_by_key(model_admin.model, key)
-    if not old_item:
-      raise utils.Http404()
+    old_item = model_admin.get_item(key)
     item_form = model_admin.AdminNewForm(obj=old_item, handler=self)
+    item_form.prefetch()
     template_kwargs = template_kwargs or {}
     template_kwargs.update({
       'item': None,
       'model_name': model_admin.model_name,
       'item_form': item_form,
-      'page_title': 'Clone %s %s' % (model_admin.model_name, old_item)
+      'page_title': 'Clone %s %s' % (model_admin.model_name, model_admin.get_label(old_item))
     })
     self.render('edit.html', template_kwargs)
 
@@ -193,39 +294,72 @@ class AdminHandler(BaseRequestHandler):
     Raises Http404 if record is not found.
     '''
     model_admin = model_register.get_model_admin(model_name)
-    item = utils.safe_get_by_key(model_admin.model, key)
-    if not item:
-      raise utils.Http404()
+    item = model_admin.get_item(key)
 
+    # The cached form class is shared by every request of the process, so the
+    # dynamic properties of the item get fields on a per-request subclass.
+    AdminForm = model_admin.AdminForm
     dynamic_properties = utils.get_dynamic_properties(item)
-    for prop_name, prop_cls in dynamic_properties.items():
-      setattr(model_admin.AdminForm, prop_name, model_admin.AdminForm.converter.convert(item.__class__, prop_cls, None))
-    model_admin.AdminForm.dynamic_properties = dynamic_properties
+    if dynamic_properties:
+      form_attrs = dict((prop_name, AdminForm.converter.convert(item.__class__, prop_cls, None))
+                        for prop_name, prop_cls in dynamic_properties.items())
+      form_attrs['dynamic_properties'] = dynamic_properties
+      AdminForm = type('DynamicForm', (AdminForm,), form_attrs)
     if self.request.method == 'POST':
-      item_form = model_admin.AdminForm(formdata=self.request.POST, obj=item, handler=self)
+      item_form = AdminForm(formdata=self.request.POST, obj=item, handler=self)
       if item_form.validate() and not extra_errors:
+        if not item_form.changed_fields():
+          # Nothing to write, skip the put and its index updates.
+          self.add_message('No changes to %s %s.' % (model_name, model_admin.get_label(item)))
+          self.redirect_admin('edit', model_name=model_admin.model_name, key=model_admin.get_urlsafe_key(item))
+          return item, False
         # Save the data, and redirect to the edit page
         item = item_form.save()
-        self.add_message('%s %s updated.' % (model_name, unicode(item)))
-        self.redirect_admin('edit', model_name=model_admin.model_name, key=item.key())
+        labels.invalidate([model_admin.get_item_key(item)])
+        self.add_message('%s %s updated.' % (model_name, model_admin.get_label(item)))
+        self.redirect_admin('edit', model_name=model_admin.model_name, key=model_admin.get_urlsafe_key(item))
         return item, True
     else:
-      item_form = model_admin.AdminForm(obj=item, handler=self)
+      item_form = AdminForm(obj=item, handler=self)
+    item_form.enable_list_deltas()
+    # Start every read the page needs before rendering waits on any of them.
+    readonly_labels = model_admin.get_reference_labels_async([item], model_admin.readonly_fields)
+    item_form.prefetch()
 
     template_kwargs = template_kwargs or {}
     template_kwargs.update({
       'item': item,
+      'item_label': model_admin.get_label(item),
+      'admin_key': model_admin.get_urlsafe_key,
+      'supports_db_tools': model_admin.supports_db_tools,
       'model_name': model_admin.model_name,
       'item_form': item_form,
-      'readonly_properties': model_admin.list_model_readonly_iter(item),
+      'readonly_properties': model_admin.list_model_readonly_iter(item, readonly_labels),
       'extra_errors': extra_errors,
     })
     self.render('edit.html', template_kwargs)
-    for prop_name, prop_cls in dynamic_properties.items():
-      delattr(model_admin.AdminForm, prop_name)
 
     return item, False
 
+  @BaseRequestHandler.csrf_token_required()
+  @authorized.check()
+  def references(self, model_name, key, template_kwargs=None):
+    '''Render the reverse-references panel of an entity, loaded by the edit page after it is shown.'''
+    model_admin = model_register.get_db_model_admin(model_name)
+    try:
+      key = db.Key(key)
+    except db.BadKeyError:
+      raise utils.Http404()
+    if key.kind() != model_admin.model_name:
+      raise utils.Http404()
+    template_kwargs = template_kwargs or {}
+    template_kwargs.update({
+      'model_name': model_admin.model_name,
+      'references': references.count_reverse_references(key),
+      'limit': admin_settings.REVERSE_REFERENCE_LIMIT,
+    })
+    self.render('reverse_references.html', template_kwargs)
+
   @BaseRequestHandler.csrf_token_required()
   @authorized.check()
   def delete(self, model_name, key):
@@ -234,10 +368,9 @@ class AdminHandler(BaseRequestHandler):
     Raises Http404 if the record not found.
     '''
     model_admin = model_register.get_model_admin(model_name)
-    item = utils.safe_get_by_key(model_admin.model, key)
-    if not item:
-      raise utils.Http404()
-    item.delete()
+    item = model_admin.get_item(key)
+    model_admin.delete_item(item)
+    labels.invalidate([model_admin.get_item_key(item)])
     if self.request.get('goto'):
       self.redirect(self.request.get('goto'))
     else:
@@ -248,7 +381,7 @@ class AdminHandler(BaseRequestHandler):
   def blob(self, model_name, field_name, key):
     '''Returns blob field contents.'''
     model_admin = model_register.get_model_admin(model_name)
-    item = utils.safe_get_by_key(model_admin.model, key)
+    item = model_admin.get_item(key)
     data = getattr(item, field_name, None)
     if data is None:
       raise utils.Http404()
@@ -260,3 +393,72 @@ class AdminHandler(BaseRequestHandler):
     else:
       self.response.headers['Content-Type'] = 'application/octet-stream'
     self.response.out.write(data)
+
+  @BaseRequestHandler.csrf_token_required()
+  @authorized.check()
+  def schema(self, model_name, template_kwargs=None):
+    '''Report properties missing or stale on a sample of the stored entities.'''
+    model_admin = model_register.get_db_model_admin(model_name)
+    template_kwargs = template_kwargs or {}
+    template_kwargs.update({
+      'model_name': model_admin.model_name,
+      'report': backfill.schema_report(model_admin.model),
+    })
+    self.render('schema.html', template_kwargs)
+
+  @BaseRequestHandler.csrf_token_required()
+  @authorized.check()
+  def job_list(self, template_kwargs=None):
+    '''Show the progress of the latest background jobs.'''
+    job_items = jobs.AdminJob.all().order('-created').fetch(admin_settings.ADMIN_ITEMS_PER_PAGE)
+    has_running_jobs = any(job.is_running for job in job_items)
+    # Show the progress of sharded jobs aggregated from their shards, without saving it.
+    shards = {}
+    for job in job_items:
+      if job.shard_count:
+        shards[job.key()] = job.get_shards()
+        jobs.aggregate_shards(job, shards[job.key()])
+    template_kwargs = template_kwargs or {}
+    template_kwargs.update({
+      'jobs': job_items,
+      'shards': shards,
+      'has_running_jobs': has_running_jobs,
+    })
+    self.render('jobs.html', template_kwargs)
+
+  @BaseRequestHandler.csrf_token_required()
+  @authorized.check()
+  def job_start(self, model_name):
+    '''Start a background job running an operation on every entity of a model.'''
+    model_admin = model_register.get_db_model_admin(model_name)
+    try:
+      operation_cls = jobs.get_operation(self.request.get('operation'))
+      if operation_cls.confirm and self.request.get('confirm') != model_admin.model_name:
+        raise ValueError('Type %s to confirm: %s.' % (model_admin.model_name, operation_cls.label))
+      job = jobs.start_job(model_admin.model_name, operation_cls.name,
+                           params=operation_cls.params_from_request(self.request),
+                           shards=int(self.request.get('shards') or 1))
+    except ValueError as e:
+      self.add_message(unicode(e))
+      self.redirect_admin('list', model_name=model_admin.model_name)
+      return
+    self.add_message('Started job %s for %s.' % (job.label, model_name))
+    self.redirect_admin('jobs')
+
+  @BaseRequestHandler.csrf_token_required()
+  @authorized.check()
+  def job_cancel(self, job_id):
+    '''Cancel a running background job.'''
+    job = jobs.cancel_job(db.Key.from_path(jobs.AdminJob.kind(), int(job_id)))
+    if not job:
+      raise utils.Http404('Job not found.')
+    self.add_message('Cancelled job %s for %s.' % (job.label, job.model_name))
+    self.redirect_admin('jobs')
+
+  def job_slice(self):
+    '''Run one slice of a job, only for task queue requests.'''
+    # App Engine strips this header from requests not made by the task queue.
+    if 'X-AppEngine-QueueName' not in self.request.headers:
+      self.error(403)
+      return
+    jobs.run_slice(db.Key(self.request.get('job')), int(self.request.get('slice')))
@@ -0,0 +1,504 @@
+'''Background jobs for admin operations that outlive a single request.
+
+A job walks a query in cursor-checkpointed slices. Each slice runs as a task
+queue task: it processes up to JOB_BATCH_SIZE entities, then stores the cursor
+and counts on the AdminJob entity and enqueues the next slice in the same
+transaction. Slices are at-least-once, so operations must be idempotent.
+
+Slices are throttled by a token bucket kept on the job (one token per entity,
+refilled at the job's rate), so a job doesn't starve the live site of
+datastore capacity.
+
+A job can be split into shards by key range (see split_key_ranges). Each shard
+is an AdminJobShard in its own entity group, running its own slices in
+parallel, and the job's rate and burst are divided between them. Shards have
+key names derived from the job, so the job reads them with a strongly
+consistent batch get and sums their progress when a shard finishes.
+
+Operations are registered by name with register_operation, see DeleteOperation
+and MapOperation.
+'''
+import abc
+import json
+import logging
+import traceback
+from datetime import datetime
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import db
+
+from . import admin_settings, labels, model_register, utils
+
+
+STATE_RUNNING = 'running'
+STATE_DONE = 'done'
+STATE_CANCELLED = 'cancelled'
+STATE_FAILED = 'failed'
+STATES = (STATE_RUNNING, STATE_DONE, STATE_CANCELLED, STATE_FAILED)
+
+# Private variable. Use register_operation() and get_operation()
+_operations = {}
+# __scatter__ keys sampled per shard when splitting a kind into key ranges.
+_SCATTER_OVERSAMPLING = 32
+
+
+class AdminJob(db.Model):
+  '''Progress of a background job, updated by every slice.'''
+  operation = db.StringProperty(required=True)
+  model_name = db.StringProperty(required=True)
+  params = db.TextProperty()  # JSON encoded operation parameters
+  state = db.StringProperty(default=STATE_RUNNING, choices=STATES)
+  cursor = db.TextProperty()
+  slices = db.IntegerProperty(default=0)
+  processed = db.IntegerProperty(default=0)
+  total = db.IntegerProperty()  # None if unknown
+  failures = db.IntegerProperty(default=0)  # failed slices
+  changed = db.IntegerProperty(default=0)  # entities the operation changed, or would on a dry run
+  errors = db.IntegerProperty(default=0)  # entities the operation failed on
+  error = db.TextProperty()
+  shard_count = db.IntegerProperty(default=0)
+  created = db.DateTimeProperty(auto_now_add=True)
+  updated = db.DateTimeProperty(auto_now=True)
+  finished = db.DateTimeProperty()
+  # Token bucket state, entities per second
+  rate = db.FloatProperty()
+  tokens = db.FloatProperty(default=0.0)
+  tokens_updated = db.DateTimeProperty()
+
+  def get_params(self):
+    return json.loads(self.params) if self.params else {}
+
+  @property
+  def is_running(self):
+    return self.state == STATE_RUNNING
+
+  @property
+  def label(self):
+    operation_cls = _operations.get(self.operation)
+    return operation_cls.describe(self.get_params()) if operation_cls else self.operation
+
+  def get_shards(self):
+    if not self.shard_count:
+      return []
+    shards = db.get([AdminJobShard.key_for(self.key(), index) for index in range(self.shard_count)])
+    return [shard for shard in shards if shard is not None]
+
+  def elapsed(self):
+    '''Seconds the job has been running for.'''
+    end = self.finished or datetime.utcnow()
+    return max((end - self.created).total_seconds(), 0.0)
+
+  def throughput(self):
+    '''Entities processed per second.'''
+    elapsed = self.elapsed()
+    return self.processed / elapsed if elapsed else 0.0
+
+  def progress(self):
+    '''Fraction of the entities processed, None if the total is unknown.'''
+    if self.state == STATE_DONE:
+      return 1.0
+    if not self.total:
+      return None
+    return min(float(self.processed) / self.total, 1.0)
+
+
+class AdminJobShard(AdminJob):
+  '''The part of a sharded job between two keys, None for an open end.
+
+  Shards are root entities, so their slices don't contend on one entity group.
+  '''
+  job_key = db.ReferenceProperty(AdminJob, collection_name='job_shards')
+  shard_index = db.IntegerProperty()
+  # Shards of the job, the burst capacity is divided between them.
+  shard_total = db.IntegerProperty(default=1)
+  key_start = db.TextProperty()
+  key_end = db.TextProperty()
+
+  @staticmethod
+  def key_for(job_key, shard_index):
+    return db.Key.from_path(AdminJobShard.kind(), '%s-%d' % (job_key.id_or_name(), shard_index))
+
+
+class TokenBucket(object):
+  '''Tokens refill at rate per second, up to capacity.
+
+  Unlimited when rate is None or 0.
+  '''
+
+  def __init__(self, rate, capacity, tokens=None, updated=None):
+    self.rate = rate
+    self.capacity = capacity
+    self.tokens = capacity if tokens is None else tokens
+    self.updated = updated
+
+  def refill(self, now):
+    if self.rate and self.updated:
+      elapsed = max((now - self.updated).total_seconds(), 0.0)
+      self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+    self.updated = now
+
+  def wait_seconds(self, amount):
+    '''Seconds until amount tokens are available.'''
+    if not self.rate or self.tokens >= amount:
+      return 0.0
+    return (amount - self.tokens) / self.rate
+
+  def consume(self, amount):
+    if self.rate:
+      self.tokens -= amount
+
+
+class JobOperation(object):
+  '''Abstract base class for job operations.
+
+  Subclasses set name (used to start jobs) and label (shown in the admin), and
+  must implement process(), which may return a dict counting the entities it
+  changed and failed on, e.g. {'changed': 10, 'errors': 1}. Set confirm for
+  operations the admin only starts once the model name is typed in.
+  Override query() or fetch() to walk something other than every entity of the
+  model, keeping the key range of shards.
+  '''
+  __metaclass__ = abc.ABCMeta
+
+  name = None
+  label = None
+  keys_only = False
+  confirm = False
+
+  def __init__(self, job):
+    self.job = job
+    self.params = job.get_params()
+
+  @property
+  def model_admin(self):
+    return model_register.get_model_admin(self.job.model_name)
+
+  @classmethod
+  def describe(cls, params):
+    '''Describe a job of this operation in the admin.'''
+    return cls.label
+
+  @classmethod
+  def check_params(cls, params):
+    '''Raise ValueError if the params can't be used to start a job.'''
+    pass
+
+  @classmethod
+  def params_from_request(cls, request):
+    '''Get the params of a job started from the admin.'''
+    return {}
+
+  def query(self):
+    query = self.model_admin.model.all(keys_only=self.keys_only)
+    key_start = getattr(self.job, 'key_start', None)
+    key_end = getattr(self.job, 'key_end', None)
+    if key_start or key_end:
+      query.order('__key__')
+    if key_start:
+      query.filter('__key__ >=', db.Key(key_start))
+    if key_end:
+      query.filter('__key__ <', db.Key(key_end))
+    return query
+
+  def count(self, limit):
+    '''Count the entities to process, None if there are limit or more.'''
+    count = self.query().count(limit=limit)
+    return count if count < limit else None
+
+  def fetch(self, batch_size):
+    '''Fetch the next batch, returns a tuple of (items, cursor, done).'''
+    query = self.query()
+    if self.job.cursor:
+      query.with_cursor(self.job.cursor)
+    items = query.fetch(batch_size, config=self.model_admin.get_read_config())
+    return items, query.cursor(), len(items) < batch_size
+
+  @abc.abstractmethod
+  def process(self, items):
+    '''Process a batch of entities, or keys with keys_only.'''
+
+
+def register_operation(operation_cls):
+  '''Make an operation available for jobs, usable as a class decorator.'''
+  _operations[operation_cls.name] = operation_cls
+  return operation_cls
+
+
+def get_operation(name):
+  '''Get an operation class by name, raises ValueError if not registered.'''
+  try:
+    return _operations[name]
+  except KeyError:
+    raise ValueError('Unknown job operation: %s' % name)
+
+
+@register_operation
+class DeleteOperation(JobOperation):
+  '''Delete every entity of the model.'''
+  name = 'delete'
+  label = 'Delete all'
+  keys_only = True
+  confirm = True
+
+  def process(self, keys):
+    db.delete(keys)
+    labels.invalidate(keys)
+    return {'changed': len(keys)}
+
+
+@register_operation
+class MapOperation(JobOperation):
+  '''Call a mapper on every entity and put the entities it returns.
+
+  params:
+    * mapper - dotted path of a function taking an entity, resolved with
+      utils.import_path. It returns an entity or a list of entities to put, or None.
+
+  Exceptions raised by the mapper are logged and counted as errors.
+  '''
+  name = 'map'
+  label = 'Map'
+
+  @classmethod
+  def describe(cls, params):
+    return '%s (%s)' % (cls.label, params.get('mapper'))
+
+  @classmethod
+  def check_params(cls, params):
+    try:
+      utils.import_path(params.get('mapper') or '')
+    except (ImportError, AttributeError, ValueError):
+      raise ValueError('Mapper not found: %s' % params.get('mapper'))
+
+  @classmethod
+  def params_from_request(cls, request):
+    return {'mapper': request.get('mapper')}
+
+  def process(self, entities):
+    mapper = utils.import_path(self.params['mapper'])
+    to_put = []
+    errors = 0
+    for entity in entities:
+      try:
+        result = mapper(entity)
+      except Exception:
+        logging.exception('Mapper %s failed for %s', self.params['mapper'], entity.key())
+        errors += 1
+        continue
+      if isinstance(result, (list, tuple)):
+        to_put.extend(result)
+      elif result is not None:
+        to_put.append(result)
+    if to_put:
+      labels.invalidate(db.put(to_put))
+    return {'changed': len(to_put), 'errors': errors}
+
+
+def split_key_ranges(model, shards):
+  '''Split the keys of a model into up to shards (key_start, key_end) ranges.
+
+  Split points are taken from a sample of the __scatter__ property, or from
+  evenly spaced offsets into the keys when the sample is too small. The first
+  and last ranges are open ended (None).
+  '''
+  if shards <= 1:
+    return [(None, None)]
+  sample = db.Query(model, keys_only=True).order('__scatter__').fetch(shards * _SCATTER_OVERSAMPLING)
+  if len(sample) >= shards:
+    sample.sort()
+    split_keys = [sample[len(sample) * index // shards] for index in range(1, shards)]
+  else:
+    total = db.Query(model, keys_only=True).count(limit=admin_settings.JOB_COUNT_LIMIT)
+    split_keys = []
+    for index in range(1, shards):
+      offset = total * index // shards
+      if offset:
+        split_keys.extend(db.Query(model, keys_only=True).order('__key__').fetch(1, offset=offset))
+  split_keys = sorted(set(split_keys))
+  return zip([None] + split_keys, split_keys + [None])
+
+
+def slice_url():
+  return admin_settings.ADMIN_BASE_URL + '/jobs/slice/'
+
+
+def _enqueue_slice(job, countdown=0):
+  taskqueue.add(url=slice_url(), queue_name=admin_settings.JOB_QUEUE,
+                params={'job': str(job.key()), 'slice': job.slices},
+                countdown=countdown, transactional=db.is_in_transaction())
+
+
+def _put_and_enqueue(job):
+  def txn():
+    job.put()
+    _enqueue_slice(job)
+  db.run_in_transaction(txn)
+
+
+def start_job(model_name, operation, params=None, rate=None, shards=1):
+  '''Create a job and enqueue its first slice, or that of each of its shards.
+
+  Input:
+    * model_name - name of the registered ModelAdmin to run on
+    * operation - name of a registered operation
+    * params - JSON serializable operation parameters
+    * rate - entities per second, defaults to admin_settings.JOB_RATE_LIMIT
+      and is divided between the shards
+    * shards - number of key ranges to process in parallel
+  '''
+  operation_cls = get_operation(operation)
+  model_admin = model_register.get_model_admin(model_name)
+  params = params or {}
+  operation_cls.check_params(params)
+  job = AdminJob(operation=operation, model_name=model_name, params=json.dumps(params),
+                 rate=float(rate or admin_settings.JOB_RATE_LIMIT or 0) or None,
+                 tokens=float(_bucket_capacity()), tokens_updated=datetime.utcnow())
+  job.total = operation_cls(job).count(admin_settings.JOB_COUNT_LIMIT)
+
+  key_ranges = split_key_ranges(model_admin.model, shards)
+  if len(key_ranges) == 1:
+    _put_and_enqueue(job)
+    return job
+
+  job.shard_count = len(key_ranges)
+  job.put()
+  for shard_index, (key_start, key_end) in enumerate(key_ranges):
+    _put_and_enqueue(AdminJobShard(
+      key=AdminJobShard.key_for(job.key(), shard_index),
+      operation=operation, model_name=model_name, params=job.params,
+      rate=job.rate / job.shard_count if job.rate else None,
+      tokens=job.tokens / job.shard_count, tokens_updated=job.tokens_updated,
+      job_key=job, shard_index=shard_index, shard_total=job.shard_count,
+      key_start=str(key_start) if key_start else None,
+      key_end=str(key_end) if key_end else None))
+  return job
+
+
+def aggregate_shards(job, shards):
+  '''Set the progress of a running sharded job from its shards, without saving it.'''
+  if not job.is_running:
+    return
+  for counter in ('processed', 'changed', 'errors', 'failures', 'slices'):
+    setattr(job, counter, sum(getattr(shard, counter) for shard in shards))
+  states = set(shard.state for shard in shards)
+  if len(shards) == job.shard_count and STATE_RUNNING not in states:
+    for state in (STATE_FAILED, STATE_CANCELLED, STATE_DONE):
+      if state in states:
+        job.state = state
+        break
+    job.finished = max(shard.finished for shard in shards)
+    job.error = '\n'.join(shard.error for shard in shards if shard.error) or None
+
+
+def refresh_sharded_job(job_key):
+  '''Save the progress of a sharded job aggregated from its shards, returns the job.
+
+  Shards are read after their own last slice committed, so the shard finishing
+  last sees every shard finished. Only the job is written, in a transaction,
+  so a concurrent cancel_job is not overwritten.
+  '''
+  job = db.get(job_key)
+  if not job or not job.is_running:
+    return job
+  shards = job.get_shards()
+
+  def txn():
+    job = db.get(job_key)
+    if job and job.is_running:
+      aggregate_shards(job, shards)
+      job.put()
+    return job
+  return db.run_in_transaction(txn)
+
+
+def cancel_job(job_key):
+  '''Stop a running job and its shards, their next slices won't process anything.'''
+  def txn():
+    job = db.get(job_key)
+    if job and job.is_running:
+      job.state = STATE_CANCELLED
+      job.finished = datetime.utcnow()
+      job.put()
+    return job
+  job = db.run_in_transaction(txn)
+  for shard in job.get_shards() if job else []:
+    cancel_job(shard.key())
+  return job
+
+
+def _bucket_capacity(shard_total=1):
+  return float(max(admin_settings.JOB_BURST, admin_settings.JOB_BATCH_SIZE)) / shard_total
+
+
+def _save_slice(job_key, slice_number, update, countdown=0):
+  '''Apply update to the job and enqueue its next slice, unless it was stopped meanwhile.'''
+  def txn():
+    job = db.get(job_key)
+    if not job or not job.is_running or job.slices != slice_number:
+      return job
+    update(job)
+    job.slices += 1
+    job.put()
+    if job.is_running:
+      _enqueue_slice(job, countdown=countdown)
+    return job
+  return db.run_in_transaction(txn)
+
+
+def run_slice(job_key, slice_number):
+  '''Process one batch of a job or shard, called by the task of each slice.
+
+  Duplicate or stale tasks (for another slice number) are ignored.
+  Returns the updated job.
+  '''
+  job = db.get(job_key)
+  if job and job.is_running and job.slices == slice_number:
+    job = _run_slice(job, slice_number)
+  if isinstance(job, AdminJobShard) and not job.is_running:
+    # Also on retries of the last slice, in case the aggregation failed.
+    refresh_sharded_job(AdminJobShard.job_key.get_value_for_datastore(job))
+  return job
+
+
+def _run_slice(job, slice_number):
+  capacity = _bucket_capacity(getattr(job, 'shard_total', 1))
+  batch_size = admin_settings.JOB_BATCH_SIZE
+  if job.rate:
+    # A shard's share of the burst may be smaller than a batch.
+    batch_size = max(1, min(batch_size, int(capacity)))
+  bucket = TokenBucket(job.rate, capacity, job.tokens, job.tokens_updated)
+  bucket.refill(datetime.utcnow())
+  wait = bucket.wait_seconds(batch_size)
+  if wait:
+    def throttled(job):
+      job.tokens, job.tokens_updated = bucket.tokens, bucket.updated
+    return _save_slice(job.key(), slice_number, throttled, countdown=wait)
+
+  operation = get_operation(job.operation)(job)
+  try:
+    items, cursor, done = operation.fetch(batch_size)
+    counts = (operation.process(items) if items else None) or {}
+  except Exception:
+    error = traceback.format_exc()
+    logging.exception('Slice %d of job %s failed', slice_number, job.key())
+
+    def failed(job):
+      job.failures += 1
+      job.error = error
+      if job.failures >= admin_settings.JOB_MAX_FAILURES:
+        job.state = STATE_FAILED
+        job.finished = datetime.utcnow()
+    # Retry the batch in a new slice, backing off on repeated failures.
+    return _save_slice(job.key(), slice_number, failed, countdown=min(2 ** job.failures, 60))
+  bucket.consume(len(items))
+
+  def processed(job):
+    job.processed += len(items)
+    job.changed += counts.get('changed', 0)
+    job.errors += counts.get('errors', 0)
+    job.cursor = cursor
+    job.tokens, job.tokens_updated = bucket.tokens, bucket.updated
+    if done:
+      job.state = STATE_DONE
+      job.finished = datetime.utcnow()
+  return _save_slice(job.key(), slice_number, processed)
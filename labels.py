@@ -0,0 +1,137 @@
+'''Display labels of referenced entities, cached in memcache.
+
+Showing a reference only needs the referenced entity's name (unicode(entity),
+or its ModelAdmin.display_field values), so labels are cached per kind and key and read in batches: one memcache
+get_multi for a page, plus one datastore get for the labels missing from it.
+get_labels_async starts the memcache read without waiting for it.
+The admin invalidates the label of an entity when saving or deleting it.
+'''
+from google.appengine.api import datastore, memcache
+from google.appengine.ext import db
+
+from . import admin_settings, utils
+
+
+KEY_PREFIX = 'appengine_admin:label'
+# kind -> reader(keys) returning a key -> label dict, for kinds stored outside the datastore.
+_label_readers = {}
+
+
+class Label(object):
+  '''Stands in for a referenced entity when only its key and name are needed.'''
+
+  def __init__(self, key, label):
+    self._key = key
+    self.label = label
+
+  def key(self):
+    return self._key
+
+  def kind(self):
+    return self._key.kind()
+
+  def __unicode__(self):
+    return self.label
+
+  def __str__(self):
+    return self.label.encode('utf-8')
+
+  def __repr__(self):
+    return '<Label %s: %r>' % (self._key.kind(), self.label)
+
+
+def _cache_key(key):
+  return '%s:%s:%s' % (KEY_PREFIX, key.kind(), key)
+
+
+def _label_for_entity(entity):
+  '''Label of the model instance for a raw entity, the key for unknown kinds.'''
+  from . import model_register
+  try:
+    model = db.class_for_kind(entity.kind())
+  except db.KindError:
+    return unicode(entity.key())
+  return model_register.get_label(model.from_entity(entity))
+
+
+def register_label_reader(kind, reader):
+  '''Read the labels of kind missing from memcache with reader(keys) instead of a datastore get.'''
+  _label_readers[kind] = reader
+
+
+def _fetch_labels(keys, config=None):
+  '''Read the labels of keys from their store, one datastore get for the datastore kinds.'''
+  fetched = {}
+  datastore_keys = []
+  reader_keys = {}
+  for key in keys:
+    reader = _label_readers.get(key.kind())
+    if reader:
+      reader_keys.setdefault(reader, []).append(key)
+    else:
+      datastore_keys.append(key)
+  for reader, keys_to_read in reader_keys.items():
+    fetched.update(reader(keys_to_read))
+  if datastore_keys:
+    for key, entity in zip(datastore_keys, datastore.Get(datastore_keys, config=config)):
+      if entity is not None:
+        fetched[key] = _label_for_entity(entity)
+  return fetched
+
+
+def get_labels(keys):
+  '''Get a dict of key -> Label for keys, leaving out keys of missing entities.'''
+  return get_labels_async(keys).get_result()
+
+
+def get_labels_async(keys, config=None):
+  '''Start reading the labels of keys, get_result() of the returned object is the get_labels dict.
+
+  The memcache read is sent right away, the datastore get of the labels
+  missing from memcache when the result is asked for, with the datastore RPC
+  config if given.
+  '''
+  keys = list(set(key for key in keys if key))
+  if not keys:
+    return utils.DeferredResult(dict)
+  rpc = memcache.Client().get_multi_async([_cache_key(key) for key in keys])
+  return utils.DeferredResult(lambda: _read_labels(keys, rpc.get_result(), config))
+
+
+def _read_labels(keys, cached, config=None):
+  labels = {}
+  missing_keys = []
+  for key in keys:
+    label = cached.get(_cache_key(key))
+    if label is None:
+      missing_keys.append(key)
+    else:
+      labels[key] = label
+  if missing_keys:
+    fetched = _fetch_labels(missing_keys, config)
+    labels.update(fetched)
+    if fetched:
+      memcache.set_multi(dict((_cache_key(key), label) for key, label in fetched.items()),
+                         time=admin_settings.LABEL_CACHE_TTL)
+  return dict((key, Label(key, label)) for key, label in labels.items())
+
+
+def remember(entities):
+  '''Cache the labels of already loaded entities or Labels, returns them as a key -> label dict.'''
+  from . import model_register
+  labels = {}
+  for entity in entities:
+    if isinstance(entity, Label):
+      labels[entity.key()] = entity.label
+    elif entity.is_saved():
+      labels[entity.key()] = model_register.get_label(entity)
+  if labels:
+    memcache.set_multi(dict((_cache_key(key), label) for key, label in labels.items()),
+                       time=admin_settings.LABEL_CACHE_TTL)
+  return labels
+
+
+def invalidate(keys):
+  '''Forget the labels of changed or deleted entities.'''
+  if keys:
+    memcache.delete_multi([_cache_key(key) for key in keys])
@@ -0,0 +1,330 @@
+'''In-memory store and ModelAdmin for db.Model classes, for tests and benchmarks.
+
+MemoryStore keeps entities in dicts, with a dict index per property for
+equality filters, and answers queries in a deterministic order (the order
+property, then the key). It makes no datastore RPCs, so tests and benchmarks
+measure the admin rather than the datastore stub. latency_ms adds a fixed
+delay to every call, like an RPC round trip, and the calls are recorded in the
+request stats under the `memory` service.
+
+MemoryModelAdmin serves a model from a store:
+===
+from appengine_admin.memory_admin import MemoryModelAdmin, MemoryStore
+
+store = MemoryStore(latency_ms=5)
+
+class AdminSong(MemoryModelAdmin):
+  model = Song
+  store = store
+
+appengine_admin.register(AdminSong)
+===
+
+Memcache is still used for labels and cached list columns. Background jobs,
+the schema report and reverse references remain datastore-only.
+'''
+import bisect
+import time
+import urllib
+
+from google.appengine.ext import db
+
+from . import admin_forms, admin_settings, labels, model_register, request_stats, utils
+
+
+class MemoryStore(object):
+  '''db.Model entities kept in memory.
+
+  Entities are copied in and out, so changing a returned entity doesn't change
+  the store until it is put again.
+
+  Input:
+    * latency_ms - delay added to every call
+    * app - app id of the allocated keys, the current app by default
+  '''
+  SERVICE = 'memory'
+
+  def __init__(self, latency_ms=0, app=None):
+    self.latency_ms = latency_ms
+    self.app = app
+    # kind -> key -> entity
+    self.entities = {}
+    # (kind, property name) -> value -> set of keys
+    self.indexes = {}
+    # (kind, property name) -> sorted list of (sort value, key), dropped on writes
+    self._orders = {}
+    self._last_id = 0
+
+  def _call(self, call, run):
+    '''Run a store call after the injected latency, recording it as an RPC.'''
+    start = time.time()
+    if self.latency_ms:
+      time.sleep(self.latency_ms / 1000.0)
+    result, entities = run()
+    stats = request_stats.current()
+    if stats:
+      stats.add_rpc(self.SERVICE, call, start, time.time(), entities)
+    return result
+
+  @staticmethod
+  def _value(entity, name):
+    '''Get a property value without resolving references.'''
+    prop = entity.properties().get(name)
+    if isinstance(prop, db.ReferenceProperty):
+      return prop.get_value_for_datastore(entity)
+    return getattr(entity, name, None)
+
+  @staticmethod
+  def _values(entity, put=False):
+    '''Get the values of an entity by attribute name, references as keys.
+
+    With put, auto_now and similar properties get the values a put stores.
+    '''
+    values = {}
+    for name, prop in entity.properties().items():
+      if put:
+        values[name] = prop.make_value_from_datastore(prop.get_value_for_datastore(entity))
+      else:
+        values[name] = MemoryStore._value(entity, name)
+    for name in entity.dynamic_properties():
+      values[name] = getattr(entity, name)
+    return values
+
+  @staticmethod
+  def _copy(entity, key, put=False):
+    model = type(entity)
+    values = MemoryStore._values(entity, put)
+    dynamic = dict((name, values.pop(name)) for name in entity.dynamic_properties())
+    copy = model(key=key, **values)
+    for name, value in dynamic.items():
+      setattr(copy, name, value)
+    return copy
+
+  @staticmethod
+  def _indexed_values(entity):
+    '''Get the (name, value) pairs an entity is indexed by, one per list item.'''
+    properties = entity.properties()
+    for name, value in MemoryStore._values(entity).items():
+      prop = properties.get(name)
+      if prop is not None and not prop.indexed:
+        continue
+      for item in value if isinstance(value, list) else [value]:
+        try:
+          hash(item)
+        except TypeError:
+          continue
+        yield name, item
+
+  def _allocate_key(self, entity):
+    self._last_id += 1
+    return db.Key.from_path(entity.kind(), self._last_id, parent=entity.parent_key(), _app=self.app)
+
+  def _index(self, key, entity, add):
+    kind = key.kind()
+    for name, value in self._indexed_values(entity):
+      keys = self.indexes.setdefault((kind, name), {}).setdefault(value, set())
+      if add:
+        keys.add(key)
+      else:
+        keys.discard(key)
+    for order in [order for order in self._orders if order[0] == kind]:
+      del self._orders[order]
+
+  def get(self, key):
+    return self.get_multi([key])[0]
+
+  def get_multi(self, keys):
+    '''Get copies of the entities of keys, None for missing ones.'''
+    def run():
+      entities = [self.entities.get(key.kind(), {}).get(key) for key in keys]
+      entities = [entity and self._copy(entity, entity.key()) for entity in entities]
+      return entities, len([entity for entity in entities if entity is not None])
+    return self._call('Get', run)
+
+  def put(self, entity):
+    return self.put_multi([entity])[0]
+
+  def put_multi(self, entities):
+    '''Store copies of entities, returns the stored copies with their keys.'''
+    def run():
+      stored = []
+      for entity in entities:
+        key = entity.key() if entity.has_key() else self._allocate_key(entity)
+        copy = self._copy(entity, key, put=True)
+        kind_entities = self.entities.setdefault(key.kind(), {})
+        if key in kind_entities:
+          self._index(key, kind_entities[key], add=False)
+        kind_entities[key] = copy
+        self._index(key, copy, add=True)
+        stored.append(self._copy(copy, key))
+      return stored, len(stored)
+    return self._call('Put', run)
+
+  def delete(self, key):
+    self.delete_multi([key])
+
+  def delete_multi(self, keys):
+    def run():
+      for key in keys:
+        entity = self.entities.get(key.kind(), {}).pop(key, None)
+        if entity is not None:
+          self._index(key, entity, add=False)
+      return None, len(keys)
+    self._call('Delete', run)
+
+  def _ordered(self, kind, name):
+    '''Get the keys of kind sorted by the name property then key, as (sort value, key) pairs.'''
+    ordered = self._orders.get((kind, name))
+    if ordered is None:
+      ordered = []
+      for key, entity in self.entities.get(kind, {}).items():
+        value = self._value(entity, name) if name else None
+        # Missing values sort first, other types never compare to None.
+        ordered.append(((value is not None, value), key))
+      ordered.sort()
+      self._orders[(kind, name)] = ordered
+    return ordered
+
+  def query(self, kind, filters=None, order=None, cursor=None, limit=None):
+    '''Query the entities of kind.
+
+    Input:
+      * filters - dict of property name -> value the entities must have
+      * order - property name, prefixed with '-' for descending order, the
+          key breaks ties
+      * cursor - the cursor of the previous page
+      * limit - maximum number of entities to return
+
+    Returns a tuple of (entities, cursor), the cursor is None after the last page.
+    '''
+    def run():
+      descending = bool(order) and order.startswith('-')
+      ordered = self._ordered(kind, order.lstrip('-') if order else None)
+      allowed = None
+      for name, value in (filters or {}).items():
+        keys = self.indexes.get((kind, name), {}).get(value, set())
+        allowed = keys if allowed is None else allowed & keys
+      if cursor:
+        position = self._decode_cursor(cursor)
+        if descending:
+          indexes = xrange(bisect.bisect_left(ordered, position) - 1, -1, -1)
+        else:
+          indexes = xrange(bisect.bisect_right(ordered, position), len(ordered))
+      else:
+        indexes = xrange(len(ordered) - 1, -1, -1) if descending else xrange(len(ordered))
+      found = []
+      for index in indexes:
+        if allowed is None or ordered[index][1] in allowed:
+          found.append(ordered[index])
+          if limit is not None and len(found) > limit:
+            break
+      next_cursor = None
+      if limit is not None and len(found) > limit:
+        found = found[:limit]
+        next_cursor = self._encode_cursor(found[-1])
+      entities = [self._copy(self.entities[kind][key], key) for _, key in found]
+      return (entities, next_cursor), len(entities)
+    return self._call('RunQuery', run)
+
+  @staticmethod
+  def _encode_cursor(position):
+    (has_value, value), key = position
+    return utils.encode_cursor([has_value, value, str(key)])
+
+  @staticmethod
+  def _decode_cursor(cursor):
+    try:
+      has_value, value, key = utils.decode_cursor(cursor)
+      return ((has_value, value), db.Key(key))
+    except (TypeError, db.BadKeyError):
+      raise ValueError('Bad cursor: %s' % cursor)
+
+
+class MemoryForm(admin_forms.WTForm):
+  '''Admin form saving to a MemoryStore, see admin_forms.WTForm.'''
+  # Set by MemoryModelAdmin._create_form
+  store = None
+
+  def put(self, instance):
+    return self.store.put(instance)
+
+
+class MemoryModelAdmin(model_register.ModelAdmin):
+  '''ModelAdmin for a db.Model kept in a MemoryStore, see model_register.ModelAdmin.
+
+  Set store to the MemoryStore of the model. paginate_on orders list pages
+  and selectors, by key without it.
+  '''
+  store = None
+  supports_db_tools = False
+
+  def __init__(self):
+    super(MemoryModelAdmin, self).__init__()
+    if hasattr(self, 'paginate_on'):
+      prop = self.model.properties().get(self.paginate_on[0].lstrip('-'))
+      # Cursors hold the last value, list values have no single one.
+      if prop is None or isinstance(prop, db.ListProperty):
+        raise ValueError('paginate_on of %s is not a single-valued property: %s'
+                         % (self.model_name, self.paginate_on[0]))
+    labels.register_label_reader(self.model_name, self.read_labels)
+
+  def _create_form(self, **kwargs):
+    form = admin_forms.create(base_class=MemoryForm, **kwargs)
+    form.store = self.store
+    return form
+
+  def get_read_config(self):
+    # The store takes no datastore config.
+    return None
+
+  def get_item(self, key):
+    try:
+      key = db.Key(key)
+    except db.BadKeyError:
+      raise utils.Http404('Bad key format.')
+    if key.kind() != self.model_name:
+      raise utils.Http404('Bad kind for key.')
+    item = self.store.get(key)
+    if item is None:
+      raise utils.Http404('Item not found.')
+    return item
+
+  def delete_item(self, item):
+    self.store.delete(item.key())
+
+  def _query_page(self, request_params, cursor_param, items_per_page, base_url):
+    order = self.paginate_on[0] if hasattr(self, 'paginate_on') else None
+    try:
+      items, cursor = self.store.query(self.model_name, order=order, cursor=request_params.get(cursor_param),
+                                       limit=items_per_page)
+    except ValueError:
+      raise utils.Http404('Bad cursor.')
+    next_url = None
+    if cursor:
+      next_url = '%s?%s' % (base_url, urllib.urlencode({cursor_param: cursor}))
+    return utils.CursorPage(items, next_url)
+
+  def get_list_page(self, request):
+    '''Get the page of instances for the list page, continued by the list_cursor param.
+
+    The Previous link goes back to the first page, cursors only go forward.
+    '''
+    page = self._query_page(request, 'list_cursor', admin_settings.ADMIN_ITEMS_PER_PAGE, request.path_url)
+    if request.get('list_cursor'):
+      page.previous_url = request.path_url
+    return page
+
+  def get_selector_page_async(self, request_params, base_url, items_per_page=None):
+    items_per_page = items_per_page or admin_settings.ADMIN_ITEMS_PER_PAGE
+
+    def get_page():
+      page = self._query_page(request_params, 'selector_cursor', items_per_page, base_url)
+      if self.display_fields_only():
+        page.items = [labels.Label(item.key(), self.get_label(item)) for item in page.items]
+      return page
+    return utils.DeferredResult(get_page)
+
+  def read_labels(self, keys):
+    '''Read the key -> label dict of keys from the store, see labels.register_label_reader.'''
+    return dict((entity.key(), self.get_label(entity))
+                for entity in self.store.get_multi(keys) if entity is not None)
@@ -1,10 +1,97 @@
+import hashlib
+import logging
+import time
+import urllib
+
+from google.appengine.api import memcache
 from google.appengine.ext import db
 
-from . import admin_forms, utils
+from . import admin_forms, admin_settings, labels, utils
 
 
 # holds model_name -> ModelAdmin_instance mapping.
 _model_register = {}
+# holds model_name -> {'register': seconds, 'forms': seconds} startup timings.
+_registration_timings = {}
+
+
+def _get_timings(model_name):
+  return _registration_timings.setdefault(model_name, {'register': 0.0, 'forms': 0.0})
+
+
+def cached_column(ttl=None):
+  '''Decorate a callable of ModelAdmin.list_fields to cache its values in memcache.
+
+  Values are cached per entity and recomputed when the entity changes, they
+  must be picklable. ttl is in seconds, defaults to admin_settings.LIST_COLUMN_CACHE_TTL.
+
+  Example:
+  ===
+  @cached_column(ttl=600)
+  def play_count(song):
+    return Play.all().filter('song =', song).count()
+
+  class AdminSong(ModelAdmin):
+    model = Song
+    list_fields = ('title', play_count)
+  ===
+  '''
+  def decorator(func):
+    func.cached_column = True
+    func.cache_ttl = ttl
+    return func
+  return decorator
+
+
+class ColumnCache(object):
+  '''Values of the cached list columns for a page of items.
+
+  Keyed by the column, the entity key and a hash of the entity's stored
+  content, so any change to the entity misses the cache. All values are read
+  with one memcache.get_multi, computed values are stored by save().
+  '''
+  KEY_PREFIX = 'appengine_admin:column'
+
+  def __init__(self, columns, items, encode=None, get_key=None):
+    self.columns = columns
+    self.cache_keys = {}
+    # encode serializes an instance, db entities by default.
+    encode = encode or (lambda item: db.model_to_protobuf(item).Encode())
+    self._get_key = get_key or self._get_key
+    for item in items:
+      key = self._get_key(item)
+      if key is None:
+        continue
+      version = hashlib.md5(encode(item)).hexdigest()
+      for column in columns:
+        self.cache_keys[(column, key)] = ':'.join((
+          self.KEY_PREFIX, column.__module__, column.__name__, utils.urlsafe_key(key), version))
+    self.values = memcache.get_multi(self.cache_keys.values()) if self.cache_keys else {}
+    self.computed = {}
+
+  def get(self, column, item):
+    cache_key = self.cache_keys.get((column, self._get_key(item)))
+    if cache_key in self.values:
+      return self.values[cache_key]
+    value = column(item)
+    if cache_key:
+      self.values[cache_key] = value
+      self.computed.setdefault(column, {})[cache_key] = value
+    return value
+
+  @staticmethod
+  def _get_key(item):
+    '''Key of a stored instance, None if it isn't saved.'''
+    if isinstance(item, db.Model):
+      return item.key() if item.is_saved() else None
+    return utils.get_key(item)
+
+  def save(self):
+    '''Store the values computed since the cache was read.'''
+    for column, values in self.computed.items():
+      ttl = column.cache_ttl if column.cache_ttl is not None else admin_settings.LIST_COLUMN_CACHE_TTL
+      memcache.set_multi(values, time=ttl)
+    self.computed = {}
 
 
 class PropertyMap(object):
@@ -15,7 +102,9 @@ class PropertyMap(object):
 
   @property
   def verbose_name(self):
-    return getattr(self.prop_cls, 'verbose_name', None) or utils.get_human_name(self.name)
+    # ndb properties keep it in _verbose_name.
+    verbose_name = getattr(self.prop_cls, 'verbose_name', None) or getattr(self.prop_cls, '_verbose_name', None)
+    return verbose_name or utils.get_human_name(self.name)
 
 
 class ModelAdmin(object):
@@ -31,6 +120,22 @@ class ModelAdmin(object):
           - customize a model instance before init, before/after save, or with
             per-field processing/cleaning
           - see admin_forms.create for more details
+      * request_budget - overrides admin_settings.REQUEST_BUDGET for this model
+      * route_request_budgets - per route name overrides for this model,
+          e.g. {'appengine_admin.list': {'datastore_rpcs': 5}}
+      * read_policy, rpc_deadline - datastore read policy (e.g.
+          db.EVENTUAL_CONSISTENCY) and deadline in seconds for the list page,
+          selectors and job queries. Editing always reads strongly consistent.
+      * display_field - property name, or tuple of names, whose values label
+          an entity in reference cells, selectors, breadcrumbs and messages
+          instead of unicode(entity). Selectors read a single indexed display
+          field with projection queries, see get_label_projection.
+
+    Other stores subclass ModelAdmin and override its storage hooks:
+    get_model_kind, _create_form, get_item, get_item_key, delete_item,
+    get_list_page, get_selector_page_async, get_reference_labels_async and
+    end_request. See ndb_admin.NdbModelAdmin and
+    sqlalchemy_admin.SQLAlchemyModelAdmin.
   '''
   model = None
   expect_duplicates = False
@@ -43,53 +148,276 @@ class ModelAdmin(object):
   post_init = None
   pre_save = None
   post_save = None
+  request_budget = None
+  route_request_budgets = None
+  read_policy = None
+  rpc_deadline = None
+  display_field = None
+  # Background jobs, the schema report and reverse references read db models only.
+  supports_db_tools = True
 
   def __init__(self):
     super(ModelAdmin, self).__init__()
     # Cache model name as string
-    self.model_name = str(self.model.kind())
+    self.model_name = str(self.get_model_kind())
 
     VALIDATE_PREFIX = 'validate_'
-    field_validators = {}
+    self.field_validators = {}
     for prop_name in dir(self):
       if prop_name.startswith(VALIDATE_PREFIX):
-        field_validators[prop_name[len(VALIDATE_PREFIX):]] = getattr(self, prop_name)
-
-    self.AdminForm = admin_forms.create(
-      model=self.model,
-      only=self.edit_fields,
-      exclude=self.readonly_fields,
-      pre_init=self.pre_init,
-      post_init=self.post_init,
-      pre_save=self.pre_save,
-      post_save=self.post_save,
-      field_validators=field_validators,
-    )
-
-    self.AdminNewForm = admin_forms.create(
-      model=self.model,
-      only=self.new_fields,
-      exclude=self.new_readonly_fields,
-      pre_init=self.pre_init,
-      post_init=self.post_init,
-      pre_save=self.pre_save,
-      post_save=self.post_save,
-      field_validators=field_validators,
-    )
-
-  def list_model_iter(self, model):
+        self.field_validators[prop_name[len(VALIDATE_PREFIX):]] = getattr(self, prop_name)
+
+    # Form classes are built on first access, keyed by their field names.
+    self._form_classes = {}
+
+  @property
+  def AdminForm(self):
+    '''Form class used to edit existing instances, built on first access.'''
+    return self._get_form_class(only=self.edit_fields, exclude=self.readonly_fields)
+
+  @property
+  def AdminNewForm(self):
+    '''Form class used to create new instances, built on first access.'''
+    return self._get_form_class(only=self.new_fields, exclude=self.new_readonly_fields)
+
+  def _get_form_field_names(self, only, exclude):
+    '''Resolve only/exclude to field names, the same way model_form does.'''
+    props = self.model.properties()
+    field_names = [name for name, prop in sorted(props.items(), key=lambda p: p[1].creation_counter)]
+    if only:
+      return tuple(name for name in only if name in field_names)
+    if exclude:
+      return tuple(name for name in field_names if name not in exclude)
+    return tuple(field_names)
+
+  def _get_form_class(self, only, exclude):
+    '''Get the form class for a field set, creating it the first time.
+
+    Edit and new forms resolving to the same field names share one class.
+    '''
+    field_names = self._get_form_field_names(only, exclude)
+    form_class = self._form_classes.get(field_names)
+    if form_class is None:
+      start = time.time()
+      form_class = self._create_form(
+        model=self.model,
+        only=only,
+        exclude=exclude,
+        pre_init=self.pre_init,
+        post_init=self.post_init,
+        pre_save=self.pre_save,
+        post_save=self.post_save,
+        field_validators=self.field_validators,
+      )
+      self._form_classes[field_names] = form_class
+      _get_timings(self.model_name)['forms'] += time.time() - start
+    return form_class
+
+  def _create_form(self, **kwargs):
+    return admin_forms.create(**kwargs)
+
+  def get_model_kind(self):
+    return self.model.kind()
+
+  def get_item_key(self, item):
+    '''Get the key of an instance, see utils.get_key.'''
+    return utils.get_key(item)
+
+  def get_urlsafe_key(self, item):
+    '''Get the key of an instance as used in admin URLs.'''
+    return utils.urlsafe_key(self.get_item_key(item))
+
+  def end_request(self):
+    '''Called after every request for this model, e.g. to release connections.'''
+    pass
+
+  def get_item(self, key):
+    '''Get an instance by its key string, raises utils.Http404 if there is none.'''
+    return utils.safe_get_by_key(self.model, key)
+
+  def delete_item(self, item):
+    item.delete()
+
+  def get_list_page(self, request):
+    '''Get the page of instances for the list page.
+
+    The PAGINATOR_PATH paginator makes its own queries, so with a read config
+    the page is read with a cursor query instead, continued by the list_cursor
+    param. Its Previous link goes back to the first page.
+    '''
+    config = self.get_read_config()
+    if config is None:
+      return utils.Paginator(model_admin=self).get_page(request=request)
+    items_per_page = admin_settings.ADMIN_ITEMS_PER_PAGE
+    query = db.Query(self.model)
+    if hasattr(self, 'paginate_on'):
+      query.order(self.paginate_on[0])
+    cursor = request.get('list_cursor')
+    if cursor:
+      try:
+        query.with_cursor(cursor)
+      except db.BadValueError:
+        raise utils.Http404('Bad cursor.')
+    items = query.fetch(items_per_page, batch_size=items_per_page, config=config)
+    next_url = None
+    if len(items) == items_per_page:
+      next_url = '%s?%s' % (request.path_url, urllib.urlencode({'list_cursor': query.cursor()}))
+    return utils.CursorPage(items, next_url, previous_url=request.path_url if cursor else None)
+
+  def get_read_config(self):
+    '''Get the datastore RPC config for browsing reads, None for the defaults.
+
+    Pass it as config= to the reads. Transactions read strongly consistent,
+    so there is no config inside one.
+    '''
+    if (self.read_policy is None and self.rpc_deadline is None) or db.is_in_transaction():
+      return None
+    return db.create_config(read_policy=self.read_policy, deadline=self.rpc_deadline)
+
+  def get_display_fields(self):
+    '''Get the display_field property names as a tuple, empty if not set.'''
+    if not self.display_field:
+      return ()
+    if isinstance(self.display_field, basestring):
+      return (self.display_field,)
+    return tuple(self.display_field)
+
+  def get_label(self, item):
+    '''Get the label of an instance, from display_field or unicode(item).'''
+    display_fields = self.get_display_fields()
+    if not display_fields:
+      return unicode(item)
+    properties = self.model.properties()
+    values = []
+    for field_name in display_fields:
+      prop = properties.get(field_name)
+      if prop is None:
+        # A dynamic property of an Expando, or a plain attribute.
+        value = getattr(item, field_name, None)
+      else:
+        # Don't resolve references for a label, their key is enough.
+        value = prop.get_value_for_datastore(item)
+      if value is not None:
+        values.append(unicode(value))
+    return u' '.join(values) or unicode(item.key().id_or_name())
+
+  def _has_item_hooks(self):
+    '''True if the model customizes its reference key or edit URL, so selectors need entities.'''
+    return hasattr(self.model, 'admin_reference_key') or hasattr(self.model, 'admin_edit_url')
+
+  def get_label_projection(self):
+    '''Get the display_field names to read with a projection query, None if they can't be.
+
+    There must be a single display field, an indexed and single-valued
+    property: projecting several properties needs a composite index, which
+    production rejects with NeedIndexError unless index.yaml defines it.
+    Entities not storing the field are missing from projection queries.
+    '''
+    display_fields = self.get_display_fields()
+    if len(display_fields) != 1 or self._has_item_hooks():
+      return None
+    properties = self.model.properties()
+    for field_name in display_fields:
+      prop = properties.get(field_name)
+      if prop is None or not prop.indexed or isinstance(prop, db.ListProperty):
+        return None
+    return display_fields
+
+  def display_fields_only(self):
+    '''True if selectors show the display_field labels rather than entities.'''
+    return bool(self.get_display_fields()) and not self._has_item_hooks()
+
+  def get_selector_page(self, request_params, base_url, items_per_page=None):
+    '''Get a page of the entities to pick from in reference selectors.
+
+    With display_field set, the page holds labels.Label objects, read with a
+    projection query of the display fields when possible, otherwise it holds
+    entities. Pages are utils.CursorPage objects continuing from the
+    selector_cursor request param.
+    '''
+    return self.get_selector_page_async(request_params, base_url, items_per_page).get_result()
+
+  def get_selector_page_async(self, request_params, base_url, items_per_page=None):
+    '''Start reading a selector page, get_result() of the returned object is the page.
+
+    The query RPC is sent right away, see get_selector_page.
+    '''
+    items_per_page = items_per_page or admin_settings.ADMIN_ITEMS_PER_PAGE
+    projection = self.get_label_projection()
+    query = db.Query(self.model, projection=projection)
+    if not projection and hasattr(self, 'paginate_on'):
+      query.order(self.paginate_on[0])
+    cursor = request_params.get('selector_cursor')
+    if cursor:
+      query.with_cursor(cursor)
+    results = query.run(limit=items_per_page, batch_size=items_per_page, config=self.get_read_config())
+
+    def get_page():
+      items = list(results)
+      next_url = None
+      if len(items) == items_per_page:
+        next_url = '%s?%s' % (base_url, urllib.urlencode({'selector_cursor': query.cursor()}))
+      if self.display_fields_only():
+        items = [labels.Label(item.key(), self.get_label(item)) for item in items]
+        labels.remember(items)
+      return utils.CursorPage(items, next_url)
+    return utils.DeferredResult(get_page)
+
+  def get_column_cache(self, items):
+    '''Get a ColumnCache for the cached list_fields columns of items, None if there are none.'''
+    columns = [field_name for field_name in self.list_fields
+               if callable(field_name) and getattr(field_name, 'cached_column', False)]
+    if not columns:
+      return None
+    return ColumnCache(columns, items)
+
+  def get_reference_labels(self, items, field_names):
+    '''Get the labels of the entities referenced by items in field_names, as a key -> Label dict.'''
+    return self.get_reference_labels_async(items, field_names).get_result()
+
+  def get_reference_labels_async(self, items, field_names):
+    '''Start reading the labels of get_reference_labels, see labels.get_labels_async.'''
+    properties = self.model.properties()
+    reference_properties = [properties[field_name] for field_name in field_names
+                            if isinstance(properties.get(field_name), db.ReferenceProperty)]
+    return labels.get_labels_async([prop.get_value_for_datastore(item)
+                                    for item in items for prop in reference_properties],
+                                   config=self.get_read_config())
+
+  def _reference_label(self, model, field_name, reference_labels):
+    '''Get the label of a reference, False if field_name isn't a ReferenceProperty.'''
+    prop = self.model.properties().get(field_name)
+    if not isinstance(prop, db.ReferenceProperty):
+      return False
+    key = prop.get_value_for_datastore(model)
+    if key is None:
+      return None
+    return reference_labels.get(key, '[missing]')
+
+  def list_model_iter(self, model, column_cache=None, reference_labels=None):
     '''Create a generator to iterate through the list fields for an instance.
 
-    Used to generate the rows when listing objects.
+    Used to generate the rows when listing objects. Cached columns are read
+    from column_cache, see get_column_cache. References are shown with their
+    label from reference_labels instead of being resolved, see get_reference_labels.
     '''
     for field_name in self.list_fields:
       if isinstance(field_name, basestring):
+        label = False
+        if reference_labels is not None:
+          label = self._reference_label(model, field_name, reference_labels)
+        if label is not False:
+          yield label
+          continue
         try:
           yield getattr(model, field_name)
         except db.ReferencePropertyResolveError:
           yield '[missing]'
       elif callable(field_name):
-        yield callable(model)
+        if column_cache and getattr(field_name, 'cached_column', False):
+          yield column_cache.get(field_name, model)
+        else:
+          yield field_name(model)
 
   def list_model_class_iter(self):
     '''Create a generator to iterate through the list fields for the model class.
@@ -103,16 +431,23 @@ class ModelAdmin(object):
       elif callable(field_name):
         yield PropertyMap(field_name.__name__, field_name)
 
-  def list_model_readonly_iter(self, model):
+  def list_model_readonly_iter(self, model, reference_labels=None):
     '''Create a generator to iterate through the read-only fields for an instance.
 
     Used to generate the list of readonly properties when editing an item.
+    References are shown with their label, pass a get_reference_labels_async
+    result as reference_labels to start reading them early.
     '''
+    if reference_labels is None:
+      reference_labels = self.get_reference_labels_async([model], self.readonly_fields)
+    reference_labels = reference_labels.get_result()
     for field_name in self.readonly_fields:
-      try:
-        result = getattr(model, field_name)
-      except db.ReferencePropertyResolveError:
-        result = '[missing]'
+      result = self._reference_label(model, field_name, reference_labels)
+      if result is False:
+        try:
+          result = getattr(model, field_name)
+        except db.ReferencePropertyResolveError:
+          result = '[missing]'
       yield PropertyMap(field_name, getattr(self.model, field_name), result)
 
 
@@ -123,8 +458,45 @@ def register(*args):
   only the last registered will be active.
   '''
   for model_admin_class in args:
+    start = time.time()
     model_admin_instance = model_admin_class()
     _model_register[model_admin_instance.model_name] = model_admin_instance
+    _get_timings(model_admin_instance.model_name)['register'] = time.time() - start
+
+
+def get_registration_report():
+  '''Get per-model startup timings as a list, slowest first.
+
+  Each entry is a (model_name, register_seconds, forms_seconds) tuple.
+  Forms are built lazily, so forms_seconds stays 0 until they are first used.
+  '''
+  report = [(model_name, timings['register'], timings['forms'])
+            for model_name, timings in _registration_timings.items()]
+  report.sort(key=lambda entry: entry[1] + entry[2], reverse=True)
+  return report
+
+
+def log_registration_report():
+  '''Log the registration report, e.g. at the end of your app's startup code.'''
+  report = get_registration_report()
+  total = sum(register + forms for _, register, forms in report)
+  logging.info('appengine_admin: %d models registered in %.1fms', len(report), total * 1000)
+  for model_name, register, forms in report:
+    logging.info('appengine_admin:   %s register=%.1fms forms=%.1fms',
+                 model_name, register * 1000, forms * 1000)
+
+
+def get_label(instance):
+  '''Get the label of a db or ndb instance, by the display_field of its ModelAdmin if registered.'''
+  if hasattr(instance, '_get_kind'):
+    kind = instance._get_kind()
+  elif hasattr(instance, 'kind'):
+    kind = instance.kind()
+  else:
+    # Other stores register models by class name.
+    kind = type(instance).__name__
+  model_admin = _model_register.get(kind)
+  return model_admin.get_label(instance) if model_admin else unicode(instance)
 
 
 def get_model_admin(model_name):
@@ -137,3 +509,14 @@ def get_model_admin(model_name):
     return _model_register[model_name]
   except KeyError:
     raise utils.Http404()
+
+
+def get_db_model_admin(model_name):
+  '''Like get_model_admin, for the db-only tools: jobs, the schema report and reverse references.
+
+  Raises utils.Http404 exception if the ModelAdmin doesn't support them.
+  '''
+  model_admin = get_model_admin(model_name)
+  if not model_admin.supports_db_tools:
+    raise utils.Http404('Not available for %s.' % model_name)
+  return model_admin
@@ -0,0 +1,240 @@
+'''ModelAdmin for ndb models.
+
+Register NdbModelAdmin subclasses for ndb.Model classes the same way as
+ModelAdmin ones:
+===
+from appengine_admin.ndb_admin import NdbModelAdmin
+
+class AdminSong(NdbModelAdmin):
+  model = Song
+  list_fields = ('title', 'artist')
+
+appengine_admin.register(AdminSong)
+===
+
+Entities are read with ndb's async gets and queries, so they are batched and
+served from ndb's in-context cache and memcache, and pages continue from ndb
+cursors. KeyProperty values are edited as URL-safe key strings. Background
+jobs, the schema report and reverse references remain db-only.
+'''
+import urllib
+
+from google.appengine.api import datastore_errors
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+from google.net.proto import ProtocolBuffer
+
+from . import admin_forms, admin_settings, fields, labels, model_register, utils
+from wtforms.ext.appengine.ndb import ModelConverter, model_form, model_properties
+
+
+class NdbAdminConverter(ModelConverter):
+  '''Converts ndb properties to the admin's form fields.'''
+
+  def convert_DateTimeProperty(self, model, prop, kwargs):
+    if prop._auto_now or prop._auto_now_add or prop._repeated:
+      return None
+    return fields.DateTimeField(format='%Y-%m-%d %H:%M:%S', **kwargs)
+
+  def convert_DateProperty(self, model, prop, kwargs):
+    if prop._auto_now or prop._auto_now_add or prop._repeated:
+      return None
+    return fields.DateField(format='%Y-%m-%d', **kwargs)
+
+  def convert_BooleanProperty(self, model, prop, kwargs):
+    kwargs.setdefault('coerce', admin_forms.coerce_boolean)
+    choices = [
+      (False, 'False'),
+      (True, 'True'),
+    ]
+    if not prop._required:
+      choices.append((None, 'None'))
+    kwargs.setdefault('choices', choices)
+    return fields.BooleanField(**kwargs)
+
+  def convert_IntegerProperty(self, model, prop, kwargs):
+    if prop._repeated:
+      return None
+    return fields.IntegerField(**kwargs)
+
+  def convert_KeyProperty(self, model, prop, kwargs):
+    if prop._repeated:
+      return None
+    return fields.NdbKeyField(kind=prop._kind, **kwargs)
+
+
+class NdbForm(admin_forms.WTForm):
+  '''Admin form for ndb models, see admin_forms.WTForm.'''
+
+  @classmethod
+  def get_model_properties(cls):
+    return model_properties(cls.model)[0]
+
+
+class NdbModelAdmin(model_register.ModelAdmin):
+  '''ModelAdmin for an ndb.Model class, see model_register.ModelAdmin.
+
+  read_policy (e.g. ndb.EVENTUAL_CONSISTENCY) and rpc_deadline apply to the
+  list page, selectors and reference labels.
+  '''
+  supports_db_tools = False
+
+  def __init__(self):
+    super(NdbModelAdmin, self).__init__()
+    self._properties, self._property_names = model_properties(self.model)
+
+  def get_model_kind(self):
+    return self.model._get_kind()
+
+  def _create_form(self, **kwargs):
+    return admin_forms.create(base_class=NdbForm, converter=NdbAdminConverter(),
+                              form_factory=model_form, **kwargs)
+
+  def _get_form_field_names(self, only, exclude):
+    if only:
+      return tuple(name for name in only if name in self._properties)
+    if exclude:
+      return tuple(name for name in self._property_names if name not in exclude)
+    return tuple(self._property_names)
+
+  def get_read_config(self):
+    # ndb reads take get_read_options() instead of a db config.
+    return None
+
+  def get_read_options(self):
+    '''Get the ndb options for browsing reads.'''
+    options = {}
+    if self.read_policy is not None:
+      options['read_policy'] = self.read_policy
+    if self.rpc_deadline is not None:
+      options['deadline'] = self.rpc_deadline
+    return options
+
+  def get_query(self):
+    '''Get the query for the list page, ordered by paginate_on if set.'''
+    query = self.model.query()
+    if hasattr(self, 'paginate_on'):
+      name = self.paginate_on[0]
+      prop = self._properties[name.lstrip('-')]
+      query = query.order(-prop if name.startswith('-') else prop)
+    return query
+
+  def get_item(self, key):
+    try:
+      key = ndb.Key(urlsafe=key)
+    except (TypeError, ValueError, ProtocolBuffer.ProtocolBufferDecodeError):
+      raise utils.Http404('Bad key format.')
+    if key.kind() != self.model_name:
+      raise utils.Http404('Bad kind for key.')
+    item = key.get()
+    if item is None:
+      raise utils.Http404('Item not found.')
+    return item
+
+  def delete_item(self, item):
+    item.key.delete()
+
+  def _fetch_page_async(self, query, request_params, cursor_param, items_per_page):
+    '''Start fetching a page of query from the cursor in request_params, returns an ndb Future.'''
+    cursor = request_params.get(cursor_param)
+    try:
+      start_cursor = Cursor(urlsafe=cursor) if cursor else None
+    except datastore_errors.BadValueError:
+      raise utils.Http404('Bad cursor.')
+    return query.fetch_page_async(items_per_page, start_cursor=start_cursor, **self.get_read_options())
+
+  @staticmethod
+  def _cursor_url(base_url, cursor_param, cursor, more):
+    if not more or not cursor:
+      return None
+    return '%s?%s' % (base_url, urllib.urlencode({cursor_param: cursor.urlsafe()}))
+
+  def get_list_page(self, request):
+    '''Get the page of instances for the list page, continued by the list_cursor param.
+
+    The Previous link goes back to the first page, cursors only go forward.
+    '''
+    future = self._fetch_page_async(self.get_query(), request, 'list_cursor',
+                                    admin_settings.ADMIN_ITEMS_PER_PAGE)
+    items, cursor, more = future.get_result()
+    return utils.CursorPage(items, self._cursor_url(request.path_url, 'list_cursor', cursor, more),
+                            previous_url=request.path_url if request.get('list_cursor') else None)
+
+  def get_label(self, item):
+    display_fields = self.get_display_fields()
+    if not display_fields:
+      return unicode(item)
+    values = []
+    for field_name in display_fields:
+      value = getattr(item, field_name)
+      if isinstance(value, ndb.Key):
+        value = value.id()
+      if value is not None:
+        values.append(unicode(value))
+    return u' '.join(values) or unicode(item.key.id())
+
+  def get_label_projection(self):
+    # A single property, see ModelAdmin.get_label_projection.
+    display_fields = self.get_display_fields()
+    if len(display_fields) != 1 or self._has_item_hooks():
+      return None
+    for field_name in display_fields:
+      prop = self._properties.get(field_name)
+      if prop is None or not prop._indexed or prop._repeated:
+        return None
+    return display_fields
+
+  def get_selector_page_async(self, request_params, base_url, items_per_page=None):
+    items_per_page = items_per_page or admin_settings.ADMIN_ITEMS_PER_PAGE
+    projection = self.get_label_projection()
+    if projection:
+      query = self.model.query(projection=[self._properties[name] for name in projection])
+    else:
+      query = self.get_query()
+    future = self._fetch_page_async(query, request_params, 'selector_cursor', items_per_page)
+
+    def get_page():
+      items, cursor, more = future.get_result()
+      if self.display_fields_only():
+        items = [labels.Label(item.key, self.get_label(item)) for item in items]
+      return utils.CursorPage(items, self._cursor_url(base_url, 'selector_cursor', cursor, more))
+    return utils.DeferredResult(get_page)
+
+  def get_column_cache(self, items):
+    columns = [field_name for field_name in self.list_fields
+               if callable(field_name) and getattr(field_name, 'cached_column', False)]
+    if not columns:
+      return None
+    return model_register.ColumnCache(columns, items, encode=lambda item: item._to_pb().Encode())
+
+  def _key_properties(self, field_names):
+    return [self._properties[field_name] for field_name in field_names
+            if isinstance(self._properties.get(field_name), ndb.KeyProperty)
+            and not self._properties[field_name]._repeated]
+
+  def get_reference_labels_async(self, items, field_names):
+    '''Start reading the labels of the KeyProperty values of items in field_names.
+
+    Returns an ndb Future of a key -> labels.Label dict. The entities are read
+    with one get_multi_async batch, through ndb's caches.
+    '''
+    keys = set()
+    for prop in self._key_properties(field_names):
+      for item in items:
+        keys.add(getattr(item, prop._code_name))
+    keys.discard(None)
+    return self._get_labels_async(list(keys))
+
+  @ndb.tasklet
+  def _get_labels_async(self, keys):
+    entities = yield ndb.get_multi_async(keys, **self.get_read_options())
+    raise ndb.Return(dict((key, labels.Label(key, model_register.get_label(entity)))
+                          for key, entity in zip(keys, entities) if entity is not None))
+
+  def _reference_label(self, model, field_name, reference_labels):
+    if not self._key_properties([field_name]):
+      return False
+    key = getattr(model, field_name)
+    if key is None:
+      return None
+    return reference_labels.get(key, '[missing]')
@@ -0,0 +1,72 @@
+'''Entities of the registered models that reference an entity.
+
+Covers ReferenceProperty back-references (the collection_name on the
+referenced model) and ListProperty(db.Key) memberships. Each referencing
+property is counted with a keys-only query capped at a limit, and all the
+queries are issued before any is read, so their RPCs run in parallel.
+'''
+from google.appengine.ext import db
+
+from . import admin_settings, model_register
+
+
+class ReverseReference(object):
+  '''Count of the entities of a model referencing an entity through one property.'''
+
+  def __init__(self, model_admin, field_name, prop, keys, limit):
+    self.model_name = model_admin.model_name
+    self.field_name = field_name
+    self.is_list = isinstance(prop, db.ListProperty)
+    # The collection of a back-reference, e.g. `song_set` on the referenced entity.
+    self.collection_name = None if self.is_list else prop.collection_name
+    self.capped = len(keys) > limit
+    self.keys = keys[:limit]
+    self.count = len(self.keys)
+
+
+def find_referencing_properties(model):
+  '''Get the (model_admin, field_name, prop) of registered models that may reference model entities.
+
+  ListProperty(db.Key) properties are included unless their object_classes
+  rule out the model.
+  '''
+  found = []
+  for _, model_admin in sorted(model_register._model_register.items()):
+    if not model_admin.supports_db_tools:
+      continue
+    for field_name, prop in sorted(model_admin.model.properties().items()):
+      if not prop.indexed:
+        continue
+      if isinstance(prop, db.ReferenceProperty):
+        if not issubclass(model, prop.reference_class):
+          continue
+      elif isinstance(prop, db.ListProperty) and prop.item_type == db.Key:
+        object_classes = getattr(prop, 'object_classes', None)
+        if object_classes and not any(issubclass(model, cls) for cls in object_classes):
+          continue
+      else:
+        continue
+      found.append((model_admin, field_name, prop))
+  return found
+
+
+def count_reverse_references(key, limit=None):
+  '''Count the entities referencing key per referencing property, up to limit each.
+
+  Returns a list of ReverseReference, for the properties with at least one
+  referencing entity.
+  '''
+  limit = limit or admin_settings.REVERSE_REFERENCE_LIMIT
+  model = db.class_for_kind(key.kind())
+  runs = []
+  for model_admin, field_name, prop in find_referencing_properties(model):
+    query = db.Query(model_admin.model, keys_only=True).filter('%s =' % field_name, key)
+    # run() sends the first batch RPC right away, fetch one more to know if the count is capped.
+    runs.append((model_admin, field_name, prop,
+                 query.run(limit=limit + 1, batch_size=limit + 1, config=model_admin.get_read_config())))
+  references = []
+  for model_admin, field_name, prop, keys in runs:
+    reference = ReverseReference(model_admin, field_name, prop, list(keys), limit)
+    if reference.count:
+      references.append(reference)
+  return references
@@ -0,0 +1,254 @@
+'''Per-request RPC accounting and timings for the admin.
+
+API proxy pre/post call hooks record every datastore and memcache RPC made by
+the request being handled on the current thread, with the number of
+entities/items it moved. An RPC is timed from when it is made to when the
+request collects its result (the post-call hook runs on wait/get_result), so
+an async RPC started early counts the work done before waiting on it, not only
+its service latency. rpc_ms() sums these spans and rpc_wall_ms() is the time
+at least one RPC was outstanding; neither shows how much overlapping saved,
+compare the request time instead. Named timings (template rendering,
+ModelAdmin hooks) are added with timed(). Stores called without the API proxy
+record their calls with RequestStats.add_rpc, see memory_admin.py.
+
+BaseRequestHandler.dispatch starts and finishes the collection, see handlers.py.
+'''
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from google.appengine.api import apiproxy_stub_map
+
+
+SERVICES = ('datastore_v3', 'memcache')
+_HOOK_NAME = 'appengine_admin_request_stats'
+_local = threading.local()
+
+# service -> call -> (message, attribute) whose repeated field size is the entity count
+_ENTITY_COUNTS = {
+  'datastore_v3': {
+    'Get': ('response', 'entity'),
+    'Put': ('request', 'entity'),
+    'Delete': ('request', 'key'),
+    'RunQuery': ('response', 'result'),
+    'Next': ('response', 'result'),
+  },
+  'memcache': {
+    'Get': ('response', 'item'),
+    'Set': ('request', 'item'),
+    'Delete': ('request', 'item'),
+  },
+}
+# Datastore calls that carry a query worth reporting.
+_QUERY_CALLS = ('RunQuery', 'Count')
+_MAX_DETAIL_LENGTH = 500
+
+
+def _count_entities(service, call, request, response):
+  message_name, attribute = _ENTITY_COUNTS.get(service, {}).get(call, (None, None))
+  if not message_name:
+    return 0
+  message = request if message_name == 'request' else response
+  try:
+    return getattr(message, '%s_size' % attribute)()
+  except AttributeError:
+    return 0
+
+
+def _describe(service, call, request):
+  if service != 'datastore_v3' or call not in _QUERY_CALLS:
+    return None
+  return ' '.join(str(request).split())[:_MAX_DETAIL_LENGTH]
+
+
+class RequestStats(object):
+  '''RPCs and timings recorded for a single request.'''
+
+  def __init__(self, name=None):
+    self.name = name
+    self.start = time.time()
+    self.end = None
+    self.rpcs = []
+    self.timings = []
+    self._pending = {}
+
+  def rpc_started(self, service, call, request):
+    self._pending[id(request)] = time.time()
+
+  def rpc_finished(self, service, call, request, response):
+    end = time.time()
+    start = self._pending.pop(id(request), end)
+    self.add_rpc(service, call, start, end, _count_entities(service, call, request, response),
+                 _describe(service, call, request))
+
+  def add_rpc(self, service, call, start, end, entities=0, detail=None):
+    self.rpcs.append({
+      'service': service,
+      'call': call,
+      'start': start,
+      'ms': (end - start) * 1000,
+      'entities': entities,
+      'detail': detail,
+    })
+
+  def add_timing(self, name, seconds):
+    self.timings.append((name, seconds * 1000))
+
+  @property
+  def ms(self):
+    return ((self.end or time.time()) - self.start) * 1000
+
+  def rpc_count(self, service=None):
+    return len([rpc for rpc in self.rpcs if service in (None, rpc['service'])])
+
+  def entity_count(self, service=None):
+    return sum(rpc['entities'] for rpc in self.rpcs if service in (None, rpc['service']))
+
+  def rpc_ms(self, service=None):
+    '''Sum of the times from making each RPC to collecting its result.'''
+    return sum(rpc['ms'] for rpc in self.rpcs if service in (None, rpc['service']))
+
+  def rpc_wall_ms(self, service=None):
+    '''Time during which at least one RPC was made and its result not collected yet.'''
+    intervals = sorted((rpc['start'], rpc['start'] + rpc['ms'] / 1000)
+                       for rpc in self.rpcs if service in (None, rpc['service']))
+    wall = 0.0
+    span_start = span_end = None
+    for start, end in intervals:
+      if span_end is None or start > span_end:
+        if span_end is not None:
+          wall += span_end - span_start
+        span_start, span_end = start, end
+      else:
+        span_end = max(span_end, end)
+    if span_end is not None:
+      wall += span_end - span_start
+    return wall * 1000
+
+  def exceeded_budget(self, budget):
+    '''Return a list of descriptions of the budget limits this request exceeded.'''
+    exceeded = []
+    if budget.get('latency_ms') is not None and self.ms > budget['latency_ms']:
+      exceeded.append('latency %.1fms > %sms' % (self.ms, budget['latency_ms']))
+    datastore_rpcs = self.rpc_count('datastore_v3')
+    if budget.get('datastore_rpcs') is not None and datastore_rpcs > budget['datastore_rpcs']:
+      exceeded.append('%d datastore RPCs > %s' % (datastore_rpcs, budget['datastore_rpcs']))
+    return exceeded
+
+  def offending_query(self):
+    '''Get the query that was repeated the most, or the slowest one on a tie.'''
+    queries = {}
+    for rpc in self.rpcs:
+      if rpc['detail']:
+        count, ms = queries.get(rpc['detail'], (0, 0.0))
+        queries[rpc['detail']] = (count + 1, max(ms, rpc['ms']))
+    if not queries:
+      return None
+    return max(queries.items(), key=lambda query: query[1])[0]
+
+  def summary(self):
+    '''Aggregate the recorded RPCs and timings into a JSON serializable dict.'''
+    rpcs = {}
+    for rpc in self.rpcs:
+      service = rpcs.setdefault(rpc['service'], {'calls': 0, 'ms': 0.0, 'entities': 0, 'by_call': {}})
+      by_call = service['by_call'].setdefault(rpc['call'], {'calls': 0, 'ms': 0.0, 'entities': 0})
+      for totals in (service, by_call):
+        totals['calls'] += 1
+        totals['ms'] += rpc['ms']
+        totals['entities'] += rpc['entities']
+    timings = {}
+    for name, ms in self.timings:
+      totals = timings.setdefault(name, {'calls': 0, 'ms': 0.0})
+      totals['calls'] += 1
+      totals['ms'] += ms
+    return {
+      'name': self.name,
+      'ms': self.ms,
+      'rpc_ms': self.rpc_ms(),
+      'rpc_wall_ms': self.rpc_wall_ms(),
+      'rpcs': rpcs,
+      'timings': timings,
+    }
+
+  def server_timing(self):
+    '''Format the summary as a Server-Timing header value.'''
+    summary = self.summary()
+    metrics = ['total;dur=%.1f' % summary['ms'],
+               'rpc_wall;desc="RPCs outstanding";dur=%.1f' % summary['rpc_wall_ms']]
+    for service, totals in sorted(summary['rpcs'].items()):
+      metrics.append('%s;desc="%d calls, %d entities";dur=%.1f'
+                     % (service, totals['calls'], totals['entities'], totals['ms']))
+    for name, totals in sorted(summary['timings'].items()):
+      metrics.append('%s;dur=%.1f' % (name, totals['ms']))
+    return ', '.join(metrics)
+
+
+def _pre_call_hook(service, call, request, response):
+  stats = current()
+  if stats and service in SERVICES:
+    stats.rpc_started(service, call, request)
+
+
+def _post_call_hook(service, call, request, response):
+  stats = current()
+  if stats and service in SERVICES:
+    stats.rpc_finished(service, call, request, response)
+
+
+def install_hooks():
+  '''Install the API proxy hooks. Safe to call repeatedly.'''
+  apiproxy = apiproxy_stub_map.apiproxy
+  # Append ignores hooks already added under the same name from the same module,
+  # whatever their service, so one pair is added for all services and the hooks
+  # filter on SERVICES.
+  apiproxy.GetPreCallHooks().Append(_HOOK_NAME, _pre_call_hook)
+  apiproxy.GetPostCallHooks().Append(_HOOK_NAME, _post_call_hook)
+
+
+def start(name=None):
+  '''Start recording stats for the request handled by the current thread.'''
+  install_hooks()
+  _local.stats = RequestStats(name)
+  return _local.stats
+
+
+def current():
+  '''Get the stats being recorded on the current thread, or None.'''
+  return getattr(_local, 'stats', None)
+
+
+def finish():
+  '''Stop recording and return the stats of the current request.'''
+  stats = current()
+  _local.stats = None
+  if stats:
+    stats.end = time.time()
+    _local.last = stats
+  return stats
+
+
+def last():
+  '''Get the stats of the last finished request on the current thread.'''
+  return getattr(_local, 'last', None)
+
+
+@contextmanager
+def timed(name):
+  '''Record how long the wrapped block takes under the given name.'''
+  start_time = time.time()
+  try:
+    yield
+  finally:
+    stats = current()
+    if stats:
+      stats.add_timing(name, time.time() - start_time)
+
+
+def timed_callable(name, func):
+  '''Wrap func so that each call is recorded under the given name.'''
+  @wraps(func)
+  def timed_wrapper(*args, **kwargs):
+    with timed(name):
+      return func(*args, **kwargs)
+  return timed_wrapper
@@ -0,0 +1,344 @@
+'''ModelAdmin for SQLAlchemy mapped classes.
+
+Runs the admin over SQL stores, e.g. reporting databases, next to the
+datastore models:
+===
+from appengine_admin.sqlalchemy_admin import SQLAlchemyModelAdmin, create_session
+
+Session = create_session('postgresql://reports@db/reports')
+
+class AdminInvoice(SQLAlchemyModelAdmin):
+  model = Invoice
+  session = Session
+  list_fields = ('number', 'customer', 'total')
+  paginate_on = ('-issued',)
+
+appengine_admin.register(AdminInvoice)
+===
+
+Rows are keyed by their primary key values in admin URLs. List pages are
+keyset paginated: each page continues after the last row's paginate_on and
+primary key values, so deep pages cost as much as the first one. Many-to-one
+relationships in list_fields are loaded with the rows in one joined query.
+Forms come from wtforms.ext.sqlalchemy, with lazy relationship fields that
+never load the whole related table. Background jobs, the schema report and
+reverse references remain datastore-only.
+'''
+import urllib
+
+from sqlalchemy import and_, create_engine, or_
+from sqlalchemy.orm import ColumnProperty, RelationshipProperty, joinedload, load_only, scoped_session, sessionmaker
+from sqlalchemy.orm.interfaces import MANYTOONE
+
+from . import admin_forms, admin_settings, labels, model_register, utils
+from wtforms.ext.sqlalchemy.fields import QuerySelectField, QuerySelectMultipleField, coerce_primary_key
+from wtforms.ext.sqlalchemy.orm import ModelConverter, converts, model_form
+
+
+def create_session(url, **engine_kwargs):
+  '''Create a scoped session over a pooled engine, for SQLAlchemyModelAdmin.session.
+
+  Up to SQLALCHEMY_POOL_SIZE connections stay open between requests and are
+  replaced after SQLALCHEMY_POOL_RECYCLE seconds. SQLite keeps SQLAlchemy's
+  own pooling. Writes are flushed once, when the request commits.
+  '''
+  if not url.startswith('sqlite'):
+    engine_kwargs.setdefault('pool_size', admin_settings.SQLALCHEMY_POOL_SIZE)
+    engine_kwargs.setdefault('pool_recycle', admin_settings.SQLALCHEMY_POOL_RECYCLE)
+  engine = create_engine(url, **engine_kwargs)
+  return scoped_session(sessionmaker(bind=engine, autoflush=False, expire_on_commit=False))
+
+
+class RowKey(object):
+  '''Key of a row, its model name and primary key values.
+
+  Stands in for datastore keys in labels and the list column cache.
+  '''
+
+  def __init__(self, kind, values):
+    self._kind = kind
+    self.values = tuple(values)
+
+  def kind(self):
+    return self._kind
+
+  def urlsafe(self):
+    return ','.join(urllib.quote(unicode(value).encode('utf-8'), safe='') for value in self.values)
+
+  def __eq__(self, other):
+    return isinstance(other, RowKey) and (self._kind, self.values) == (other._kind, other.values)
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __hash__(self):
+    return hash((self._kind, self.values))
+
+  def __str__(self):
+    return '%s:%s' % (self._kind, self.urlsafe())
+
+  def __repr__(self):
+    return '<RowKey %s>' % self
+
+
+class LazyRelationshipConverter(ModelConverter):
+  '''ModelConverter making lazy QuerySelectFields for relationships.
+
+  Submitted rows are read with one IN query on their primary key, and the
+  choices are limited to SQLALCHEMY_CHOICES_LIMIT rows plus the selected ones.
+  '''
+
+  def __init__(self, session):
+    super(LazyRelationshipConverter, self).__init__()
+    self.session = session
+
+  def _lazy_args(self, field_args, prop):
+    # ModelConverterBase passes a factory loading all the rows.
+    related = prop.mapper.class_
+    field_args['query_factory'] = lambda: self.session.query(related)
+    field_args.setdefault('lazy', True)
+    field_args.setdefault('limit', admin_settings.SQLALCHEMY_CHOICES_LIMIT)
+    return field_args
+
+  @converts('MANYTOONE')
+  def conv_ManyToOne(self, field_args, prop, **extra):
+    return QuerySelectField(**self._lazy_args(field_args, prop))
+
+  @converts('MANYTOMANY', 'ONETOMANY')
+  def conv_ManyToMany(self, field_args, prop, **extra):
+    return QuerySelectMultipleField(**self._lazy_args(field_args, prop))
+
+
+class SQLAlchemyForm(admin_forms.WTForm):
+  '''Admin form for SQLAlchemy models, see admin_forms.WTForm.'''
+  # Set by SQLAlchemyModelAdmin._create_form
+  db_session = None
+
+  @classmethod
+  def get_model_properties(cls):
+    return dict((prop.key, prop) for prop in cls.model.__mapper__.iterate_properties)
+
+  def put(self, instance):
+    self.db_session.add(instance)
+    self.db_session.commit()
+    return instance
+
+
+class SQLAlchemyModelAdmin(model_register.ModelAdmin):
+  '''ModelAdmin for a SQLAlchemy mapped class, see model_register.ModelAdmin.
+
+  Available properties, besides those of ModelAdmin:
+    * session - scoped session to read and write with, see create_session.
+        It is removed after every request, returning its connection to the
+        pool. A plain Session is closed instead.
+    * paginate_on - one-item tuple naming an indexed, not nullable column to
+        order list pages by, prefixed with '-' for descending order. The
+        primary key breaks ties. Pages are ordered by primary key without it.
+  '''
+  session = None
+  supports_db_tools = False
+
+  def __init__(self):
+    super(SQLAlchemyModelAdmin, self).__init__()
+    self.mapper = self.model.__mapper__
+    self._properties = dict((prop.key, prop) for prop in self.mapper.iterate_properties)
+    self._primary_key = self.mapper.primary_key
+    self._order = self._get_order()
+
+  def get_model_kind(self):
+    return self.model.__name__
+
+  def _column_name(self, column):
+    return self.mapper.get_property_by_column(column).key
+
+  def _get_order(self):
+    '''Get the keyset order as (attribute name, column, descending) tuples.'''
+    order = []
+    descending = False
+    if hasattr(self, 'paginate_on'):
+      name = self.paginate_on[0]
+      descending = name.startswith('-')
+      prop = self._properties.get(name.lstrip('-'))
+      if not isinstance(prop, ColumnProperty):
+        raise ValueError('paginate_on of %s is not a column: %s' % (self.model_name, name))
+      column = prop.columns[0]
+      if not (column.primary_key or column.index or column.unique):
+        raise ValueError('paginate_on of %s is not an indexed column: %s' % (self.model_name, name))
+      # Keyset filters compare with the last row's value, which can't be NULL.
+      if column.nullable:
+        raise ValueError('paginate_on of %s is a nullable column: %s' % (self.model_name, name))
+      order.append((prop.key, column, descending))
+    for column in self._primary_key:
+      if not any(column is ordered for _, ordered, _ in order):
+        order.append((self._column_name(column), column, descending))
+    return order
+
+  def _create_form(self, **kwargs):
+    def form_factory(model, exclude=None, **form_kwargs):
+      # model_form appends the primary and foreign keys to exclude.
+      return model_form(model, db_session=self.session, exclude=list(exclude or ()), **form_kwargs)
+    form = admin_forms.create(base_class=SQLAlchemyForm, converter=LazyRelationshipConverter(self.session),
+                              form_factory=form_factory, **kwargs)
+    form.db_session = self.session
+    return form
+
+  def _get_form_field_names(self, only, exclude):
+    key_columns = set(self._primary_key)
+    for prop in self._properties.values():
+      if isinstance(prop, RelationshipProperty) and prop.direction.name != 'MANYTOMANY':
+        key_columns.update(local for local, _ in prop.local_remote_pairs)
+    field_names = [prop.key for prop in self.mapper.iterate_properties
+                   if not isinstance(prop, ColumnProperty) or prop.columns[0] not in key_columns]
+    if only:
+      return tuple(name for name in only if name in field_names)
+    if exclude:
+      return tuple(name for name in field_names if name not in exclude)
+    return tuple(field_names)
+
+  def get_read_config(self):
+    # SQL reads take no datastore config.
+    return None
+
+  def end_request(self):
+    if hasattr(self.session, 'remove'):
+      self.session.remove()
+    else:
+      self.session.close()
+
+  def get_item_key(self, item):
+    values = self.mapper.primary_key_from_instance(item)
+    if any(value is None for value in values):
+      return None
+    return RowKey(self.model_name, values)
+
+  def get_item(self, key):
+    try:
+      values = [urllib.unquote(value.encode('utf-8')).decode('utf-8') for value in key.split(',')]
+    except UnicodeError:
+      raise utils.Http404('Bad key format.')
+    if len(values) != len(self._primary_key):
+      raise utils.Http404('Bad key format.')
+    try:
+      ident = tuple(coerce_primary_key(column, value) for column, value in zip(self._primary_key, values))
+    except (TypeError, ValueError, ArithmeticError):
+      raise utils.Http404('Bad key format.')
+    item = self.session.query(self.model).get(ident if len(ident) > 1 else ident[0])
+    if item is None:
+      raise utils.Http404('Item not found.')
+    return item
+
+  def delete_item(self, item):
+    self.session.delete(item)
+    self.session.commit()
+
+  def _after(self, values):
+    '''Get the keyset filter for the rows ordered after a row with values.'''
+    if len(values) != len(self._order):
+      raise ValueError('Bad cursor values: %r' % values)
+    conditions = []
+    for index, (_, column, descending) in enumerate(self._order):
+      equal = [ordered == value for (_, ordered, _), value in zip(self._order[:index], values)]
+      after = column < values[index] if descending else column > values[index]
+      conditions.append(and_(*(equal + [after])))
+    return or_(*conditions)
+
+  def _fetch_page(self, query, request_params, cursor_param, items_per_page, base_url):
+    '''Get a utils.CursorPage of query, continuing after the cursor in request_params.'''
+    cursor = request_params.get(cursor_param)
+    if cursor:
+      try:
+        query = query.filter(self._after(utils.decode_cursor(cursor)))
+      except ValueError:
+        raise utils.Http404('Bad cursor.')
+    query = query.order_by(*[column.desc() if descending else column.asc()
+                             for _, column, descending in self._order])
+    # One more row tells if there is a next page.
+    items = query.limit(items_per_page + 1).all()
+    next_url = None
+    if len(items) > items_per_page:
+      items = items[:items_per_page]
+      cursor = utils.encode_cursor([getattr(items[-1], name) for name, _, _ in self._order])
+      next_url = '%s?%s' % (base_url, urllib.urlencode({cursor_param: cursor}))
+    return utils.CursorPage(items, next_url)
+
+  def _list_references(self):
+    return [name for name in self.list_fields
+            if isinstance(name, basestring) and self._is_reference(name)]
+
+  def _is_reference(self, field_name):
+    prop = self._properties.get(field_name)
+    return isinstance(prop, RelationshipProperty) and prop.direction is MANYTOONE
+
+  def get_list_page(self, request):
+    '''Get the page of rows for the list page, continued by the list_cursor param.
+
+    The Previous link goes back to the first page, pages only continue forward.
+    '''
+    query = self.session.query(self.model)
+    references = self._list_references()
+    if references:
+      query = query.options(*[joinedload(getattr(self.model, name)) for name in references])
+    page = self._fetch_page(query, request, 'list_cursor', admin_settings.ADMIN_ITEMS_PER_PAGE,
+                            request.path_url)
+    if request.get('list_cursor'):
+      page.previous_url = request.path_url
+    return page
+
+  def get_label(self, item):
+    display_fields = self.get_display_fields()
+    if not display_fields:
+      return unicode(item)
+    values = [getattr(item, field_name) for field_name in display_fields]
+    values = [unicode(value) for value in values if value is not None]
+    key = self.get_item_key(item)
+    return u' '.join(values) or (key.urlsafe() if key else u'')
+
+  def get_label_projection(self):
+    display_fields = self.get_display_fields()
+    if not display_fields or self._has_item_hooks():
+      return None
+    for field_name in display_fields:
+      if not isinstance(self._properties.get(field_name), ColumnProperty):
+        return None
+    return display_fields
+
+  def get_selector_page_async(self, request_params, base_url, items_per_page=None):
+    '''See ModelAdmin.get_selector_page_async, the query runs when the result is asked for.
+
+    With display_field set, only the display and ordering columns are loaded.
+    '''
+    items_per_page = items_per_page or admin_settings.ADMIN_ITEMS_PER_PAGE
+    query = self.session.query(self.model)
+    projection = self.get_label_projection()
+    if projection:
+      names = list(projection) + [name for name, _, _ in self._order if name not in projection]
+      query = query.options(load_only(*names))
+
+    def get_page():
+      page = self._fetch_page(query, request_params, 'selector_cursor', items_per_page, base_url)
+      if self.display_fields_only():
+        page.items = [labels.Label(self.get_item_key(item), self.get_label(item)) for item in page.items]
+      return page
+    return utils.DeferredResult(get_page)
+
+  def get_column_cache(self, items):
+    columns = [field_name for field_name in self.list_fields
+               if callable(field_name) and getattr(field_name, 'cached_column', False)]
+    if not columns:
+      return None
+    column_names = sorted(name for name, prop in self._properties.items() if isinstance(prop, ColumnProperty))
+    return model_register.ColumnCache(
+      columns, items, get_key=self.get_item_key,
+      encode=lambda item: repr([getattr(item, name) for name in column_names]))
+
+  def get_reference_labels_async(self, items, field_names):
+    # Referenced rows are loaded with the list rows, see _reference_label.
+    return utils.DeferredResult(dict)
+
+  def _reference_label(self, model, field_name, reference_labels):
+    if not self._is_reference(field_name):
+      return False
+    referenced = getattr(model, field_name)
+    if referenced is None:
+      return None
+    return model_register.get_label(referenced)
@@ -1,9 +1,48 @@
+import time
 import unittest
 
-from google.appengine.api import memcache
+from google.appengine.api import apiproxy_stub_map, memcache
 from google.appengine.ext import testbed
 
 
+_LATENCY_HOOK_NAME = 'appengine_admin_rpc_latency'
+# Services given a latency by simulate_rpc_latency.
+_latency_services = set()
+# id of the request of an RPC in flight -> time it was made
+_rpc_starts = {}
+
+
+def _latency_pre_call_hook(service, call, request, response):
+  if service in _latency_services:
+    _rpc_starts[id(request)] = time.time()
+
+
+def simulate_rpc_latency(latency_ms, service='datastore_v3'):
+  '''Make every call to the service stub answer latency_ms after it was made.
+
+  Stubs answer in microseconds, so without this batching and async changes
+  don't show up as wall-clock wins. The stubs run async RPCs one after
+  another when they are waited on, so the delay counts from when the RPC was
+  made rather than from when the stub runs it: RPCs made together and then
+  waited on wait for the latency once, as they would in production. Call it
+  once per service and testbed.
+  '''
+  apiproxy = apiproxy_stub_map.apiproxy
+  # Hooks are deduplicated by name and module only, so one hook filters on the services.
+  apiproxy.GetPreCallHooks().Append(_LATENCY_HOOK_NAME, _latency_pre_call_hook)
+  _latency_services.add(service)
+  stub = apiproxy.GetStub(service)
+  make_sync_call = stub.MakeSyncCall
+
+  def slow_make_sync_call(service, call, request, response, *args, **kwargs):
+    started = _rpc_starts.pop(id(request), None) or time.time()
+    remaining = started + latency_ms / 1000.0 - time.time()
+    if remaining > 0:
+      time.sleep(remaining)
+    return make_sync_call(service, call, request, response, *args, **kwargs)
+  stub.MakeSyncCall = slow_make_sync_call
+
+
 class TestCase(unittest.TestCase):
   def setUp(self):
     self.testbed = testbed.Testbed()
@@ -11,6 +50,7 @@ class TestCase(unittest.TestCase):
     self.testbed.init_memcache_stub()
     memcache.flush_all()
     self.testbed.init_datastore_v3_stub()
+    self.extendedTestbedSetUp()
 
     self.extendedSetUp()
 
@@ -18,6 +58,10 @@ class TestCase(unittest.TestCase):
     self.extendedTearDown()
     self.testbed.deactivate()
 
+  def extendedTestbedSetUp(self):
+    # method to be overridden by test case bases needing more stubs
+    pass
+
   def extendedTearDown(self):
     # method to be overridden by actual test case
     pass
@@ -25,3 +69,46 @@ class TestCase(unittest.TestCase):
   def extendedSetUp(self):
     # method to be overridden by actual test case
     pass
+
+
+class AdminRequestTestCase(TestCase):
+  '''Drives the admin routes through a WSGI application against the stubs.
+
+  Register the ModelAdmin classes under test in model_admins, then use
+  self.client to make requests and assertRPCs to put upper bounds on the
+  datastore work done by the last request.
+  '''
+  model_admins = ()
+
+  def extendedTestbedSetUp(self):
+    from appengine_admin import model_register
+    from appengine_admin.tests.client import AdminClient
+
+    self.testbed.init_user_stub()
+    self.testbed.setup_env(USER_EMAIL='admin@example.com', USER_ID='1',
+                           USER_IS_ADMIN='1', overwrite=True)
+    self.old_model_register = dict(model_register._model_register)
+    model_register.register(*self.model_admins)
+    self.client = AdminClient()
+
+  def tearDown(self):
+    from appengine_admin import model_register
+    super(AdminRequestTestCase, self).tearDown()
+    model_register._model_register.clear()
+    model_register._model_register.update(self.old_model_register)
+
+  def assertRPCs(self, datastore_rpcs=None, entities_fetched=None):
+    '''Assert upper bounds for the datastore work of the last request.'''
+    stats = self.client.last_stats
+    self.assertIsNotNone(stats, 'No request stats recorded, is REQUEST_STATS enabled?')
+    summary = stats.summary()
+    if datastore_rpcs is not None:
+      self.assertTrue(stats.rpc_count('datastore_v3') <= datastore_rpcs,
+                      '%s made %d datastore RPCs, expected at most %d: %s'
+                      % (stats.name, stats.rpc_count('datastore_v3'), datastore_rpcs,
+                         summary['rpcs'].get('datastore_v3')))
+    if entities_fetched is not None:
+      fetched = self.client.entities_fetched(stats)
+      self.assertTrue(fetched <= entities_fetched,
+                      '%s fetched %d entities, expected at most %d: %s'
+                      % (stats.name, fetched, entities_fetched, summary['rpcs'].get('datastore_v3')))
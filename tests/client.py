@@ -0,0 +1,99 @@
+'''A minimal browser for the admin WSGI application, for tests and load tests.'''
+import re
+
+import webapp2
+
+import appengine_admin
+from appengine_admin import request_stats
+
+
+_CSRF_FORM_RE = re.compile(r'<form[^>]*(?:delete-item-form|form-delete)[^>]*>(.*?)</form>', re.DOTALL)
+_INPUT_RE = re.compile(r'<input([^>]*)>')
+_ATTRIBUTE_RE = re.compile(r'''(\w+)=(?:'([^']*)'|"([^"]*)"|([^\s'">]+))''')
+# Calls whose entity counts are entities read from the datastore.
+_FETCH_CALLS = ('Get', 'RunQuery', 'Next')
+
+
+class AdminClient(object):
+  '''Makes requests to the admin routes, keeping cookies between requests.
+
+  The request stats of the last request are available as last_stats.
+  '''
+
+  def __init__(self, handler_cls=None, debug=True):
+    config = dict(appengine_admin.get_webapp2_config())
+    config['webapp2_extras.sessions'] = {'secret_key': 'appengine_admin-client'}
+    self.app = webapp2.WSGIApplication(
+      routes=appengine_admin.get_application_routes(handler_cls),
+      config=config,
+      debug=debug)
+    self.cookies = {}
+    self.last_stats = None
+
+  def uri_for(self, route_name, **kwargs):
+    '''Build the path of an admin route, e.g. uri_for('list', model_name='Song').'''
+    request = webapp2.Request.blank('/')
+    return self.app.router.build(request, 'appengine_admin.%s' % route_name, (), kwargs)
+
+  def request(self, path, method='GET', params=None):
+    request = webapp2.Request.blank(path, POST=params if method == 'POST' else None)
+    request.method = method
+    if self.cookies:
+      request.headers['Cookie'] = '; '.join('%s=%s' % item for item in self.cookies.items())
+    response = request.get_response(self.app)
+    for cookie in response.headers.getall('Set-Cookie'):
+      name, _, value = cookie.split(';', 1)[0].partition('=')
+      self.cookies[name.strip()] = value.strip()
+    self.last_stats = request_stats.last()
+    return response
+
+  def get(self, path):
+    return self.request(path)
+
+  def post(self, path, params=None, csrf_from=None):
+    '''POST to path, copying the CSRF token from a previously fetched page.'''
+    params = list((params or {}).items()) if isinstance(params, dict) else list(params or [])
+    if csrf_from is not None:
+      params.extend(self.csrf_params(csrf_from.body).items())
+    return self.request(path, method='POST', params=params)
+
+  @staticmethod
+  def csrf_params(html):
+    '''Get the CSRF token inputs rendered in the delete forms of a page.'''
+    match = _CSRF_FORM_RE.search(html)
+    if not match:
+      return {}
+    params = {}
+    for attributes in _INPUT_RE.findall(match.group(1)):
+      attributes = dict((name, ''.join(values)) for name, values in
+                        ((m[0], m[1:]) for m in _ATTRIBUTE_RE.findall(attributes)))
+      if 'name' in attributes:
+        params[attributes['name']] = attributes.get('value', '')
+    return params
+
+  @staticmethod
+  def form_params(form):
+    '''Get the POST params that submit a form's current data unchanged.'''
+    params = []
+    for field in form:
+      if getattr(field, 'readonly', False):
+        continue
+      data = field.data
+      if isinstance(data, (list, tuple)):
+        values = data
+      elif hasattr(field, '_value'):
+        values = [field._value()]
+      else:
+        values = [data]
+      for value in values:
+        if value is None:
+          continue
+        if hasattr(value, 'key') and callable(value.key):
+          value = value.key()
+        params.append((field.name, unicode(value)))
+    return params
+
+  @staticmethod
+  def entities_fetched(stats):
+    return sum(rpc['entities'] for rpc in stats.rpcs
+               if rpc['service'] == 'datastore_v3' and rpc['call'] in _FETCH_CALLS)
@@ -0,0 +1,98 @@
+from google.appengine.api import datastore
+from google.appengine.ext import db
+
+from appengine_admin import admin_settings, backfill, jobs, model_register
+from appengine_admin.tests import AdminRequestTestCase
+
+
+class BackfillTrack(db.Model):
+  title = db.StringProperty()
+  plays = db.IntegerProperty(default=0)
+  rating = db.FloatProperty()
+
+
+class AdminBackfillTrack(model_register.ModelAdmin):
+  model = BackfillTrack
+  list_fields = ('title',)
+
+
+class BackfillAlbum(db.Model):
+  title = db.StringProperty(required=True)
+  year = db.IntegerProperty(default=2000)
+
+
+class AdminBackfillAlbum(model_register.ModelAdmin):
+  model = BackfillAlbum
+
+
+def put_raw(kind='BackfillTrack', **values):
+  '''Store an entity the way an older version of the model would have.'''
+  entity = datastore.Entity(kind)
+  entity.update(values)
+  return datastore.Put(entity)
+
+
+class BackfillTests(AdminRequestTestCase):
+  model_admins = (AdminBackfillTrack, AdminBackfillAlbum)
+
+  def extendedTestbedSetUp(self):
+    super(BackfillTests, self).extendedTestbedSetUp()
+    self.testbed.init_taskqueue_stub()
+
+  def extendedSetUp(self):
+    self.old_rate_limit = admin_settings.JOB_RATE_LIMIT
+    admin_settings.JOB_RATE_LIMIT = None
+    self.missing_key = put_raw(title=u'missing')
+    self.stale_key = put_raw(title=u'stale', plays='7', rating=1.5)
+    self.broken_key = put_raw(title=u'broken', plays='many', rating=1.5)
+    self.current_key = BackfillTrack(title='current', plays=3).put()
+
+  def extendedTearDown(self):
+    admin_settings.JOB_RATE_LIMIT = self.old_rate_limit
+
+  def run_job(self, params, model_name='BackfillTrack'):
+    job = jobs.start_job(model_name, 'backfill', params=params)
+    while job.is_running:
+      job = jobs.run_slice(job.key(), job.slices)
+    return job
+
+  def test_should_report_missing_and_stale_properties(self):
+    report = backfill.schema_report(BackfillTrack)
+    self.assertEquals(4, report['sampled'])
+    self.assertEquals(3, report['affected'])
+    self.assertEquals({'plays': 1, 'rating': 1}, report['missing'])
+    self.assertEquals({'plays': 2}, report['stale'])
+
+  def test_should_only_count_on_a_dry_run(self):
+    job = self.run_job({'dry_run': True})
+    self.assertEquals(jobs.STATE_DONE, job.state)
+    self.assertEquals('Backfill (dry run)', job.label)
+    self.assertEquals(4, job.processed)
+    self.assertEquals(2, job.changed)
+    self.assertEquals(1, job.errors)
+    self.assertFalse('plays' in datastore.Get(self.missing_key))
+
+  def test_should_rewrite_affected_entities(self):
+    job = self.run_job({})
+    self.assertEquals(2, job.changed)
+    missing, stale, broken = datastore.Get([self.missing_key, self.stale_key, self.broken_key])
+    self.assertEquals(0, missing['plays'])
+    self.assertTrue('rating' in missing)
+    self.assertEquals(7, stale['plays'])
+    self.assertEquals('many', broken['plays'])
+    self.assertEquals(3, BackfillTrack.all().filter('plays <', 10).count())
+
+  def test_should_count_entities_that_do_not_load_as_errors(self):
+    untitled_key = put_raw('BackfillAlbum', year=1999)
+    dated_key = put_raw('BackfillAlbum', title=u'dated')
+    job = self.run_job({}, 'BackfillAlbum')
+    self.assertEquals(jobs.STATE_DONE, job.state)
+    self.assertEquals(1, job.changed)
+    self.assertEquals(1, job.errors)
+    self.assertEquals(2000, datastore.Get(dated_key)['year'])
+    self.assertFalse('title' in datastore.Get(untitled_key))
+
+  def test_should_render_the_schema_report(self):
+    response = self.client.get(self.client.uri_for('schema', model_name='BackfillTrack'))
+    self.assertEquals(200, response.status_int)
+    self.assertTrue('3 of 4 sampled' in response.body)
@@ -162,3 +162,137 @@ class FormSaveTests(TestCase):
     self.assertFalse(form.validate())
     self.assertEquals({'int_p_req': [u'This field is required.']}, form.errors)
     self.assertRaises(db.BadValueError, form.save)
+
+
+class FormChangedFieldsTests(TestCase):
+  def extendedSetUp(self):
+    self.subproject1 = put_cls(SubProject, name='subproject 1')
+    self.project1 = put_cls(
+      Project, string_p='project 1', boolean_p=True, list_p=[self.subproject1.key()],
+      datetime_p=datetime(2012, 12, 13, 23), int_p_req=2,
+    )
+    self.formdata = [
+      ('string_p', 'project 1'),
+      ('boolean_p', 'True'),
+      ('datetime_p', '2012-12-13 23:00:00 UTC'),
+      ('list_p', str(self.subproject1.key())),
+      ('int_p_req', '2'),
+    ]
+
+  def test_should_detect_unchanged_form(self):
+    form_cls = admin_forms.create(Project, only=('string_p', 'none_string_p', 'boolean_p', 'datetime_p',
+                                                 'list_p', 'int_p_req'))
+    # The stored None of an optional string is submitted as ''.
+    formdata = MultiDict(self.formdata + [('none_string_p', '')])
+    form = form_cls(formdata=formdata, obj=self.project1)
+    self.assertTrue(form.validate())
+    self.assertEquals(set(), form.changed_fields())
+
+  def test_should_ignore_microseconds_the_form_drops(self):
+    self.project1.datetime_p = datetime(2012, 12, 13, 23, 0, 0, 123456)
+    self.project1.put()
+    form_cls = admin_forms.create(Project, only=('string_p', 'datetime_p', 'int_p_req'))
+    form = form_cls(formdata=MultiDict(self.formdata), obj=self.project1)
+    self.assertTrue(form.validate())
+    self.assertEquals(set(), form.changed_fields())
+
+  def test_should_detect_changed_fields(self):
+    form_cls = admin_forms.create(Project, only=('string_p', 'boolean_p', 'list_p', 'int_p_req'))
+    formdata = MultiDict(self.formdata[:1] + [('boolean_p', 'False'), ('list_p', ''), ('int_p_req', '2')])
+    form = form_cls(formdata=formdata, obj=self.project1)
+    self.assertTrue(form.validate())
+    self.assertEquals(set(['boolean_p', 'list_p']), form.changed_fields())
+
+  def test_should_treat_all_fields_as_changed_for_new_instances(self):
+    form_cls = admin_forms.create(Project, only=('string_p', 'int_p_req'))
+    form = form_cls(formdata=MultiDict(self.formdata))
+    self.assertEquals(set(['string_p', 'int_p_req']), form.changed_fields())
+
+  def test_should_only_run_validators_for_changed_fields(self):
+    validated = []
+
+    def validate_string_p(form, field):
+      validated.append('string_p')
+
+    def validate_int_p_req(form, field):
+      validated.append('int_p_req')
+
+    form_cls = admin_forms.create(Project, only=('string_p', 'int_p_req'), field_validators={
+      'string_p': validate_string_p,
+      'int_p_req': validate_int_p_req,
+    })
+    formdata = MultiDict([('string_p', 'project 2'), ('int_p_req', '2')])
+    form = form_cls(formdata=formdata, obj=self.project1)
+    self.assertTrue(form.validate())
+    self.assertEquals(['string_p'], validated)
+
+    form.save()
+    self.assertEquals('project 2', db.get(self.project1.key()).string_p)
+
+
+class Task(db.Model):
+  project = db.ReferenceProperty(SubProject)
+
+
+class AjaxKeyFieldReferenceTests(TestCase):
+  def extendedSetUp(self):
+    self.subproject = put_cls(SubProject, name='subproject')
+    self.form_cls = admin_forms.create(Task)
+
+  def test_should_keep_the_key_of_the_reference(self):
+    form = self.form_cls(formdata=MultiDict([('project', str(self.subproject.key()))]))
+    self.assertTrue(form.validate())
+    self.assertEquals(self.subproject.key(), form.project.data)
+
+  def test_should_reject_a_key_of_another_kind(self):
+    project = put_cls(Project, string_p='project', int_p_req=1)
+    form = self.form_cls(formdata=MultiDict([('project', str(project.key()))]))
+    self.assertFalse(form.validate())
+    self.assertEquals(['Not a key of a SubProject.'], form.errors['project'])
+
+
+class AjaxKeyFieldDeltaTests(TestCase):
+  def extendedSetUp(self):
+    self.subprojects = [put_cls(SubProject, name='subproject %d' % i) for i in range(3)]
+    self.project1 = put_cls(
+      Project, string_p='project 1', int_p_req=2,
+      list_p=[self.subprojects[0].key(), self.subprojects[1].key()],
+    )
+    self.form_cls = admin_forms.create(Project, only=('list_p',))
+
+  def delta_formdata(self, version=None, added=(), removed=()):
+    field = self.form_cls(obj=self.project1).list_p
+    formdata = [(field.version_name, version or field.list_version(self.project1.list_p))]
+    formdata.extend((field.add_name, str(key)) for key in added)
+    formdata.extend((field.remove_name, str(key)) for key in removed)
+    return MultiDict(formdata)
+
+  def test_should_apply_added_and_removed_keys(self):
+    formdata = self.delta_formdata(added=[self.subprojects[2].key()], removed=[self.subprojects[0].key()])
+    form = self.form_cls(formdata=formdata, obj=self.project1)
+    self.assertTrue(form.validate())
+    self.assertEquals([self.subprojects[1].key(), self.subprojects[2].key()], form.list_p.data)
+    self.assertEquals([self.subprojects[2].key()], form.list_p.added_keys)
+    self.assertEquals([self.subprojects[0].key()], form.list_p.removed_keys)
+
+  def test_should_keep_the_position_of_a_key_removed_and_added_again(self):
+    key = self.subprojects[0].key()
+    formdata = self.delta_formdata(added=[key, self.subprojects[2].key()], removed=[key])
+    form = self.form_cls(formdata=formdata, obj=self.project1)
+    self.assertTrue(form.validate())
+    self.assertEquals([key, self.subprojects[1].key(), self.subprojects[2].key()], form.list_p.data)
+    self.assertEquals([], form.list_p.removed_keys)
+    self.assertEquals([self.subprojects[2].key()], form.list_p.added_keys)
+
+  def test_should_reject_delta_against_a_changed_list(self):
+    formdata = self.delta_formdata(version='stale', added=[self.subprojects[2].key()])
+    form = self.form_cls(formdata=formdata, obj=self.project1)
+    self.assertFalse(form.validate())
+    self.assertEquals(self.project1.list_p, form.list_p.data)
+    self.assertTrue(form.list_p.errors)
+
+  def test_should_keep_unchanged_list_without_a_delta(self):
+    formdata = self.delta_formdata()
+    form = self.form_cls(formdata=formdata, obj=self.project1)
+    self.assertTrue(form.validate())
+    self.assertEquals(set(), form.changed_fields())
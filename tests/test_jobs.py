@@ -0,0 +1,183 @@
+from datetime import datetime, timedelta
+
+from google.appengine.ext import db
+
+from appengine_admin import admin_settings, jobs, model_register
+from appengine_admin.tests import AdminRequestTestCase, TestCase
+
+
+class JobTrack(db.Model):
+  title = db.StringProperty()
+
+
+class AdminJobTrack(model_register.ModelAdmin):
+  model = JobTrack
+  list_fields = ('title',)
+
+
+class JobTestCase(AdminRequestTestCase):
+  model_admins = (AdminJobTrack,)
+
+  def extendedTestbedSetUp(self):
+    super(JobTestCase, self).extendedTestbedSetUp()
+    self.testbed.init_taskqueue_stub()
+    self.taskqueue_stub = self.testbed.get_stub('taskqueue')
+
+  def extendedSetUp(self):
+    self.old_settings = (admin_settings.JOB_BATCH_SIZE, admin_settings.JOB_RATE_LIMIT,
+                         admin_settings.JOB_BURST)
+    admin_settings.JOB_BATCH_SIZE = 10
+    admin_settings.JOB_RATE_LIMIT = None
+    db.put([JobTrack(title='track %d' % i) for i in range(25)])
+
+  def extendedTearDown(self):
+    (admin_settings.JOB_BATCH_SIZE, admin_settings.JOB_RATE_LIMIT,
+     admin_settings.JOB_BURST) = self.old_settings
+
+  def run_job(self, job):
+    while job.is_running:
+      job = jobs.run_slice(job.key(), job.slices)
+    return job
+
+
+class JobTests(JobTestCase):
+  def test_should_delete_in_cursor_checkpointed_slices(self):
+    job = jobs.start_job('JobTrack', 'delete')
+    self.assertEquals(25, job.total)
+    self.assertEquals(1, len(self.taskqueue_stub.get_filtered_tasks(url=jobs.slice_url())))
+
+    job = jobs.run_slice(job.key(), 0)
+    self.assertEquals(10, job.processed)
+    self.assertTrue(job.cursor)
+    self.assertEquals(15, JobTrack.all().count())
+    # A duplicate delivery of the same slice is ignored.
+    self.assertEquals(1, jobs.run_slice(job.key(), 0).slices)
+
+    job = self.run_job(job)
+    self.assertEquals(jobs.STATE_DONE, job.state)
+    self.assertEquals(25, job.processed)
+    self.assertEquals(3, job.slices)
+    self.assertEquals(0, JobTrack.all().count())
+
+  def test_should_throttle_slices_with_the_token_bucket(self):
+    admin_settings.JOB_BURST = 0
+    job = jobs.start_job('JobTrack', 'delete', rate=2)
+    job.tokens, job.tokens_updated = 4.0, datetime.utcnow()
+    job.put()
+    job = jobs.run_slice(job.key(), 0)
+    self.assertEquals(0, job.processed)
+    self.assertEquals(1, job.slices)
+    self.assertEquals(25, JobTrack.all().count())
+
+  def test_should_not_run_cancelled_jobs(self):
+    job = jobs.start_job('JobTrack', 'delete')
+    jobs.cancel_job(job.key())
+    job = jobs.run_slice(job.key(), 0)
+    self.assertEquals(jobs.STATE_CANCELLED, job.state)
+    self.assertEquals(25, JobTrack.all().count())
+
+  def test_should_only_delete_all_when_confirmed(self):
+    page = self.client.get(self.client.uri_for('list', model_name='JobTrack'))
+    start_url = self.client.uri_for('job_start', model_name='JobTrack')
+    response = self.client.post(start_url, {'operation': 'delete', 'confirm': 'jobtrack'}, csrf_from=page)
+    self.assertEquals(302, response.status_int)
+    self.assertEquals(0, jobs.AdminJob.all().count())
+
+    response = self.client.post(start_url, {'operation': 'delete', 'confirm': 'JobTrack'}, csrf_from=page)
+    self.assertEquals(302, response.status_int)
+    self.assertEquals(1, jobs.AdminJob.all().count())
+
+  def test_should_only_run_slices_for_task_queue_requests(self):
+    job = jobs.start_job('JobTrack', 'delete')
+    response = self.client.post(self.client.uri_for('job_slice'),
+                                {'job': str(job.key()), 'slice': '0'})
+    self.assertEquals(403, response.status_int)
+    self.assertEquals(0, jobs.AdminJob.get(job.key()).processed)
+
+
+class TokenBucketTests(TestCase):
+  def test_should_refill_up_to_capacity(self):
+    start = datetime(2012, 1, 1)
+    bucket = jobs.TokenBucket(rate=10, capacity=50, tokens=0, updated=start)
+    bucket.refill(start + timedelta(seconds=2))
+    self.assertEquals(20, bucket.tokens)
+    self.assertEquals(3, bucket.wait_seconds(50))
+    bucket.refill(start + timedelta(seconds=60))
+    self.assertEquals(50, bucket.tokens)
+    bucket.consume(50)
+    self.assertEquals(0, bucket.tokens)
+
+
+def uppercase_title(track):
+  if track.title == 'track 13':
+    raise ValueError('Unlucky track')
+  track.title = track.title.upper()
+  return track
+
+
+class MapJobTests(JobTestCase):
+  def test_should_map_every_entity_across_shards(self):
+    job = jobs.start_job('JobTrack', 'map', params={'mapper': 'appengine_admin.tests.test_jobs.uppercase_title'},
+                         shards=3)
+    shards = job.get_shards()
+    self.assertTrue(1 < len(shards) <= 3)
+    self.assertEquals(len(shards), job.shard_count)
+    for shard in shards:
+      self.run_job(shard)
+
+    job = jobs.AdminJob.get(job.key())
+    self.assertEquals(jobs.STATE_DONE, job.state)
+    self.assertEquals(25, job.processed)
+    self.assertEquals(1, job.errors)
+    titles = sorted(track.title for track in JobTrack.all())
+    self.assertEquals(24, len([title for title in titles if title.startswith('TRACK')]))
+    self.assertTrue('track 13' in titles)
+
+  def test_should_keep_a_cancelled_sharded_job_cancelled(self):
+    job = jobs.start_job('JobTrack', 'delete', shards=3)
+    shards = job.get_shards()
+    # Shards are root entities pointing at their job.
+    self.assertEquals([None] * len(shards), [shard.parent_key() for shard in shards])
+    self.assertEquals([job.key()] * len(shards),
+                      [jobs.AdminJobShard.job_key.get_value_for_datastore(shard) for shard in shards])
+    self.run_job(shards[0])
+    self.assertEquals(jobs.STATE_RUNNING, jobs.AdminJob.get(job.key()).state)
+
+    jobs.cancel_job(job.key())
+    # A late slice of a cancelled shard doesn't aggregate over the cancellation.
+    jobs.run_slice(shards[1].key(), 0)
+    job = jobs.AdminJob.get(job.key())
+    self.assertEquals(jobs.STATE_CANCELLED, job.state)
+    self.assertEquals([jobs.STATE_DONE] + [jobs.STATE_CANCELLED] * (len(shards) - 1),
+                      [shard.state for shard in job.get_shards()])
+
+  def test_should_divide_rate_and_burst_between_shards(self):
+    job = jobs.start_job('JobTrack', 'delete', rate=9, shards=3)
+    shards = job.get_shards()
+    self.assertEquals(len(shards), job.shard_count)
+    self.assertAlmostEqual(job.rate, sum(shard.rate for shard in shards))
+    self.assertAlmostEqual(job.tokens, sum(shard.tokens for shard in shards))
+
+  def test_should_show_sharded_jobs_without_writing(self):
+    job = jobs.start_job('JobTrack', 'delete', shards=3)
+    shards = job.get_shards()
+    self.run_job(shards[0])
+    jobs.run_slice(shards[1].key(), 0)
+    updated = jobs.AdminJob.get(job.key()).updated
+    response = self.client.get(self.client.uri_for('jobs'))
+    self.assertEquals(200, response.status_int)
+    by_call = self.client.last_stats.summary()['rpcs']['datastore_v3']['by_call']
+    self.assertFalse('Put' in by_call)
+    self.assertEquals(updated, jobs.AdminJob.get(job.key()).updated)
+
+  def test_should_map_with_a_module_function_path(self):
+    # A two-part module.function path, the module imported at the top level.
+    job = self.run_job(jobs.start_job('JobTrack', 'map', params={'mapper': 'copy.copy'}))
+    self.assertEquals(jobs.STATE_DONE, job.state)
+    self.assertEquals('Map (copy.copy)', job.label)
+    self.assertEquals(25, job.changed)
+    self.assertEquals(0, job.errors)
+
+  def test_should_not_start_with_a_missing_mapper(self):
+    self.assertRaises(ValueError, jobs.start_job, 'JobTrack', 'map', params={'mapper': 'no.such.mapper'})
+    self.assertEquals(0, jobs.AdminJob.all().count())
@@ -0,0 +1,132 @@
+import json
+
+from webob.multidict import MultiDict
+
+from google.appengine.ext import db
+
+from appengine_admin import admin_forms, labels, model_register, request_stats
+from appengine_admin.tests import AdminRequestTestCase, TestCase
+
+
+class LabelArtist(db.Model):
+  name = db.StringProperty()
+
+  def __unicode__(self):
+    return self.name
+
+
+class LabelSong(db.Model):
+  title = db.StringProperty()
+  artist = db.ReferenceProperty(LabelArtist)
+
+
+class LabelTests(TestCase):
+  def extendedSetUp(self):
+    self.artists = [LabelArtist(name='artist %d' % i) for i in range(3)]
+    db.put(self.artists)
+    self.keys = [artist.key() for artist in self.artists]
+
+  def extendedTearDown(self):
+    request_stats.finish()
+
+  def test_should_read_labels_in_batches(self):
+    stats = request_stats.start()
+    artist_labels = labels.get_labels(self.keys)
+    self.assertEquals(1, stats.rpc_count('datastore_v3'))
+    self.assertEquals(u'artist 1', unicode(artist_labels[self.keys[1]]))
+    self.assertEquals('LabelArtist', artist_labels[self.keys[1]].kind())
+
+    stats = request_stats.start()
+    self.assertEquals(3, len(labels.get_labels(self.keys)))
+    self.assertEquals(0, stats.rpc_count('datastore_v3'))
+    self.assertEquals(1, stats.rpc_count('memcache'))
+
+  def test_should_leave_out_missing_entities(self):
+    missing_key = db.Key.from_path('LabelArtist', 'missing')
+    self.assertEquals([self.keys[0]], labels.get_labels([self.keys[0], missing_key, None]).keys())
+
+  def test_should_invalidate_changed_labels(self):
+    labels.get_labels(self.keys)
+    self.artists[0].name = 'renamed'
+    self.artists[0].put()
+    labels.invalidate([self.keys[0]])
+    self.assertEquals(u'renamed', unicode(labels.get_labels(self.keys)[self.keys[0]]))
+
+  def test_forms_should_not_resolve_references(self):
+    song = LabelSong(title='song', artist=self.artists[0])
+    song.put()
+    song = db.get(song.key())
+    form_cls = admin_forms.create(LabelSong)
+
+    stats = request_stats.start()
+    form = form_cls(obj=song)
+    self.assertEquals(self.keys[0], form.artist.data)
+    form = form_cls(formdata=MultiDict([('title', 'song'), ('artist', str(self.keys[1]))]), obj=song)
+    self.assertTrue(form.validate())
+    self.assertEquals(set(['artist']), form.changed_fields())
+    self.assertEquals(0, stats.rpc_count('datastore_v3'))
+
+
+class LabelAlbum(db.Model):
+  title = db.StringProperty()
+  year = db.IntegerProperty()
+  notes = db.TextProperty()
+
+
+class AdminLabelAlbum(model_register.ModelAdmin):
+  model = LabelAlbum
+  display_field = ('title', 'year')
+
+
+class AdminLabelAlbumTitle(model_register.ModelAdmin):
+  model = LabelAlbum
+  display_field = 'title'
+
+
+class AdminLabelAlbumNotes(model_register.ModelAdmin):
+  model = LabelAlbum
+  display_field = 'notes'
+
+
+class LabelTrack(db.Expando):
+  title = db.StringProperty()
+
+
+class AdminLabelTrack(model_register.ModelAdmin):
+  model = LabelTrack
+  display_field = ('title', 'genre')
+
+
+class DisplayFieldTests(AdminRequestTestCase):
+  model_admins = (AdminLabelAlbum,)
+
+  def extendedSetUp(self):
+    db.put([LabelAlbum(key_name='album-%d' % i, title='album %d' % i, year=2000 + i,
+                       notes='x' * 1000) for i in range(3)])
+
+  def test_should_label_with_display_fields(self):
+    album = LabelAlbum.get_by_key_name('album-1')
+    self.assertEquals(u'album 1 2001', model_register.get_label(album))
+    self.assertEquals(u'album 1 2001', unicode(labels.get_labels([album.key()])[album.key()]))
+
+  def test_should_label_with_dynamic_properties(self):
+    self.assertEquals(u'track 1 jazz', AdminLabelTrack().get_label(LabelTrack(title='track 1', genre='jazz')))
+    self.assertEquals(u'track 2', AdminLabelTrack().get_label(LabelTrack(title='track 2')))
+    self.assertEquals(None, AdminLabelTrack().get_label_projection())
+
+  def test_should_only_project_a_single_indexed_field(self):
+    self.assertEquals(('title',), AdminLabelAlbumTitle().get_label_projection())
+    # Projecting several properties would need a composite index.
+    self.assertEquals(None, AdminLabelAlbum().get_label_projection())
+    self.assertEquals(None, AdminLabelAlbumNotes().get_label_projection())
+
+  def test_should_page_selectors_with_labels(self):
+    page = model_register.get_model_admin('LabelAlbum').get_selector_page({}, '/list/', items_per_page=2)
+    self.assertEquals([u'album 0 2000', u'album 1 2001'], [unicode(label) for label in page])
+    self.assertTrue(page.has_next())
+
+    url = self.client.uri_for('list', model_name='LabelAlbum')
+    response = self.client.get(page.get_next_url().replace('/list/', url) + '&ajax_mini_page=1')
+    items = json.loads(response.body)
+    self.assertEquals([u'album 2 2002'], [item['name'] for item in items[:-1]])
+    self.assertEquals('', items[-1]['next_url'])
@@ -0,0 +1,90 @@
+from google.appengine.ext import db
+
+from appengine_admin import admin_settings, model_register
+from appengine_admin.tests import AdminRequestTestCase
+
+
+class ListTrack(db.Model):
+  title = db.StringProperty()
+
+
+def shouted_title(track):
+  return track.title.upper()
+
+
+computed_titles = []
+
+
+@model_register.cached_column(ttl=60)
+def reversed_title(track):
+  computed_titles.append(track.title)
+  return track.title[::-1]
+
+
+class AdminListTrack(model_register.ModelAdmin):
+  model = ListTrack
+  list_fields = ('title', shouted_title)
+
+
+class AdminCachedListTrack(model_register.ModelAdmin):
+  model = ListTrack
+  list_fields = ('title', reversed_title)
+
+
+class PartialListTests(AdminRequestTestCase):
+  model_admins = (AdminListTrack,)
+
+  def extendedSetUp(self):
+    self.old_budget = admin_settings.LIST_TIME_BUDGET
+    db.put([ListTrack(title='track %d' % i) for i in range(5)])
+    self.list_url = self.client.uri_for('list', model_name='ListTrack')
+
+  def extendedTearDown(self):
+    admin_settings.LIST_TIME_BUDGET = self.old_budget
+
+  def test_should_render_callable_columns(self):
+    response = self.client.get(self.list_url)
+    self.assertEquals(200, response.status_int)
+    self.assertTrue('TRACK 4' in response.body)
+    self.assertFalse('list-continue' in response.body)
+
+  def test_should_render_completed_rows_with_a_continue_link_when_out_of_time(self):
+    admin_settings.LIST_TIME_BUDGET = -1
+    response = self.client.get(self.list_url)
+    self.assertEquals(200, response.status_int)
+    self.assertEquals(1, response.body.count('TRACK '))
+    self.assertTrue('list_offset=1' in response.body)
+
+    response = self.client.get(self.list_url + '?list_offset=1')
+    self.assertEquals(1, response.body.count('TRACK '))
+    self.assertTrue('list_offset=2' in response.body)
+    self.assertTrue('Continued from row 2' in response.body)
+
+  def test_should_404_on_a_bad_offset(self):
+    response = self.client.get(self.list_url + '?list_offset=abc')
+    self.assertEquals(404, response.status_int)
+
+
+class CachedColumnTests(AdminRequestTestCase):
+  model_admins = (AdminCachedListTrack,)
+
+  def extendedSetUp(self):
+    self.tracks = [ListTrack(title='track %d' % i) for i in range(5)]
+    db.put(self.tracks)
+    self.list_url = self.client.uri_for('list', model_name='ListTrack')
+    del computed_titles[:]
+
+  def test_should_compute_columns_once_per_entity_version(self):
+    response = self.client.get(self.list_url)
+    self.assertTrue('4 kcart' in response.body)
+    self.assertEquals(5, len(computed_titles))
+    self.assertEquals(1, self.client.last_stats.summary()['rpcs']['memcache']['by_call']['Get']['calls'])
+
+    self.client.get(self.list_url)
+    self.assertEquals(5, len(computed_titles))
+
+    self.tracks[0].title = 'changed'
+    self.tracks[0].put()
+    response = self.client.get(self.list_url)
+    self.assertTrue('degnahc' in response.body)
+    self.assertEquals(6, len(computed_titles))
@@ -0,0 +1,151 @@
+import time
+from datetime import datetime
+
+from google.appengine.ext import db
+
+from appengine_admin import admin_settings, request_stats, utils
+from appengine_admin.memory_admin import MemoryModelAdmin, MemoryStore
+from appengine_admin.tests import AdminRequestTestCase, TestCase
+
+
+class MemArtist(db.Model):
+  name = db.StringProperty()
+  genre = db.StringProperty()
+
+
+class MemSong(db.Model):
+  title = db.StringProperty(required=True)
+  artist = db.ReferenceProperty(MemArtist)
+  tags = db.StringListProperty()
+
+
+store = MemoryStore()
+
+
+class AdminMemArtist(MemoryModelAdmin):
+  model = MemArtist
+  store = store
+  display_field = 'name'
+
+
+class AdminMemSong(MemoryModelAdmin):
+  model = MemSong
+  store = store
+  list_fields = ('title', 'artist')
+  paginate_on = ('title',)
+
+
+class CursorTests(TestCase):
+  def test_should_round_trip_values(self):
+    values = [datetime(2012, 3, 4, 5, 6, 7, 8), 42, u'name', None]
+    self.assertEquals(values, utils.decode_cursor(utils.encode_cursor(values)))
+
+  def test_should_round_trip_datastore_values(self):
+    values = [db.Key.from_path('MemArtist', 1), db.GeoPt(1.5, -2.5), db.ByteString('\xff\x00')]
+    self.assertEquals(values, utils.decode_cursor(utils.encode_cursor(values)))
+
+  def test_should_reject_bad_cursors(self):
+    self.assertRaises(ValueError, utils.decode_cursor, 'not a cursor')
+
+
+class MemoryStoreTests(TestCase):
+  def extendedSetUp(self):
+    self.store = MemoryStore()
+    self.artists = self.store.put_multi([MemArtist(name='artist %d' % i, genre='rock' if i % 2 else 'pop')
+                                         for i in range(5)])
+
+  def test_should_copy_entities_in_and_out(self):
+    artist = self.store.get(self.artists[0].key())
+    artist.name = 'changed'
+    self.assertEquals('artist 0', self.store.get(artist.key()).name)
+    self.store.put(artist)
+    self.assertEquals('changed', self.store.get(artist.key()).name)
+
+  def test_should_get_multi_and_delete(self):
+    keys = [artist.key() for artist in self.artists[:2]]
+    self.store.delete(keys[0])
+    self.assertEquals([None, 'artist 1'], [artist and artist.name for artist in self.store.get_multi(keys)])
+
+  def test_should_filter_on_indexes(self):
+    found, _ = self.store.query('MemArtist', filters={'genre': 'rock'})
+    self.assertEquals(['artist 1', 'artist 3'], [artist.name for artist in found])
+    song = self.store.put(MemSong(title='song', artist=self.artists[0], tags=['a', 'b']))
+    self.assertEquals([song.key()], [s.key() for s in self.store.query('MemSong', filters={'tags': 'b'})[0]])
+    self.assertEquals([song.key()], [s.key() for s in self.store.query(
+      'MemSong', filters={'artist': self.artists[0].key()})[0]])
+
+  def test_should_page_in_a_deterministic_order(self):
+    first, cursor = self.store.query('MemArtist', order='-name', limit=2)
+    self.assertEquals(['artist 4', 'artist 3'], [artist.name for artist in first])
+    # Writes between pages don't repeat or skip entities.
+    self.store.put(MemArtist(name='artist 0a'))
+    rest, cursor = self.store.query('MemArtist', order='-name', cursor=cursor, limit=10)
+    self.assertEquals(['artist 2', 'artist 1', 'artist 0a', 'artist 0'], [artist.name for artist in rest])
+    self.assertIsNone(cursor)
+
+  def test_should_page_in_reference_order(self):
+    self.store.put_multi([MemSong(title='song %d' % i, artist=self.artists[i % 2]) for i in range(3)])
+    first, cursor = self.store.query('MemSong', order='artist', limit=2)
+    rest, _ = self.store.query('MemSong', order='artist', cursor=cursor, limit=2)
+    self.assertEquals(['song 0', 'song 2', 'song 1'], [song.title for song in first + rest])
+
+  def test_should_record_calls_with_injected_latency(self):
+    self.store.latency_ms = 20
+    stats = request_stats.start('test')
+    start = time.time()
+    self.store.get_multi([artist.key() for artist in self.artists])
+    request_stats.finish()
+    self.assertGreaterEqual(time.time() - start, 0.02)
+    self.assertEquals(1, stats.rpc_count(MemoryStore.SERVICE))
+    self.assertEquals(5, stats.entity_count(MemoryStore.SERVICE))
+    self.assertEquals(0, stats.rpc_count('datastore_v3'))
+
+
+class MemoryModelAdminTests(AdminRequestTestCase):
+  model_admins = (AdminMemArtist, AdminMemSong)
+
+  def extendedSetUp(self):
+    self.old_per_page = admin_settings.ADMIN_ITEMS_PER_PAGE
+    store.__init__()
+    self.artist = store.put(MemArtist(name='the artist'))
+    self.songs = store.put_multi([MemSong(title='song %d' % i, artist=self.artist) for i in range(3)])
+
+  def extendedTearDown(self):
+    admin_settings.ADMIN_ITEMS_PER_PAGE = self.old_per_page
+
+  def test_should_list_without_datastore_rpcs(self):
+    admin_settings.ADMIN_ITEMS_PER_PAGE = 2
+    list_url = self.client.uri_for('list', model_name='MemSong')
+    response = self.client.get(list_url)
+    self.assertEquals(200, response.status_int)
+    self.assertEquals(2, response.body.count('the artist'))
+    self.assertRPCs(datastore_rpcs=0)
+
+    cursor = response.body.split('list_cursor=', 1)[1].split("'", 1)[0]
+    response = self.client.get('%s?list_cursor=%s' % (list_url, cursor))
+    self.assertTrue('song 2' in response.body)
+    self.assertFalse('song 1' in response.body)
+
+  def test_should_save_edits_to_the_store(self):
+    edit_url = self.client.uri_for('edit', model_name='MemSong', key=self.songs[0].key())
+    page = self.client.get(edit_url)
+    self.assertEquals(200, page.status_int)
+    response = self.client.post(edit_url, {
+      'title': 'new title',
+      'artist': str(self.artist.key()),
+    }, csrf_from=page)
+    self.assertEquals(302, response.status_int)
+    self.assertEquals('new title', store.get(self.songs[0].key()).title)
+    self.assertRPCs(datastore_rpcs=0)
+
+  def test_should_only_paginate_on_single_valued_properties(self):
+    admin_cls = type('AdminMemSongByTags', (MemoryModelAdmin,),
+                     {'model': MemSong, 'store': store, 'paginate_on': ('tags',)})
+    self.assertRaises(ValueError, admin_cls)
+
+  def test_should_delete_from_the_store(self):
+    page = self.client.get(self.client.uri_for('list', model_name='MemSong'))
+    response = self.client.post(
+      self.client.uri_for('delete', model_name='MemSong', key=self.songs[0].key()), csrf_from=page)
+    self.assertEquals(302, response.status_int)
+    self.assertIsNone(store.get(self.songs[0].key()))
@@ -0,0 +1,128 @@
+from google.appengine.ext import db
+
+from appengine_admin import admin_settings, model_register
+from appengine_admin.tests import AdminRequestTestCase, TestCase
+
+
+class Artist(db.Model):
+  name = db.StringProperty()
+  birthday = db.DateTimeProperty()
+  bio = db.TextProperty()
+
+
+class AdminArtist(model_register.ModelAdmin):
+  model = Artist
+
+
+class AdminArtistNewFields(model_register.ModelAdmin):
+  model = Artist
+  readonly_fields = ('bio',)
+  new_fields = ('name', 'birthday')
+
+
+class AdminArtistDifferentFields(model_register.ModelAdmin):
+  model = Artist
+  new_fields = ('name',)
+
+
+class LazyFormTests(TestCase):
+  def extendedSetUp(self):
+    self.old_register = dict(model_register._model_register)
+
+  def extendedTearDown(self):
+    model_register._model_register.clear()
+    model_register._model_register.update(self.old_register)
+
+  def test_should_not_build_forms_when_registering(self):
+    model_register.register(AdminArtist)
+    model_admin = model_register.get_model_admin('Artist')
+    self.assertEquals({}, model_admin._form_classes)
+
+  def test_should_build_form_once(self):
+    model_admin = AdminArtistDifferentFields()
+    self.assertIs(model_admin.AdminForm, model_admin.AdminForm)
+    self.assertIs(model_admin.AdminNewForm, model_admin.AdminNewForm)
+    self.assertIsNot(model_admin.AdminForm, model_admin.AdminNewForm)
+    self.assertEquals(['name'], model_admin.AdminNewForm()._fields.keys())
+
+  def test_should_share_forms_with_identical_field_sets(self):
+    model_admin = AdminArtist()
+    self.assertIs(model_admin.AdminForm, model_admin.AdminNewForm)
+    model_admin = AdminArtistNewFields()
+    self.assertIs(model_admin.AdminForm, model_admin.AdminNewForm)
+    self.assertEquals(1, len(model_admin._form_classes))
+
+  def test_should_report_registration_timings(self):
+    model_register.register(AdminArtist)
+    model_register.get_model_admin('Artist').AdminForm
+    report = dict((model_name, (register, forms))
+                  for model_name, register, forms in model_register.get_registration_report())
+    self.assertIn('Artist', report)
+    register, forms = report['Artist']
+    self.assertTrue(register >= 0)
+    self.assertTrue(forms > 0)
+
+
+class Setlist(db.Expando):
+  name = db.StringProperty()
+
+
+class AdminSetlist(model_register.ModelAdmin):
+  model = Setlist
+
+
+class DynamicPropertyFormTests(AdminRequestTestCase):
+  model_admins = (AdminSetlist,)
+
+  def test_should_not_add_dynamic_fields_to_the_shared_form(self):
+    setlist = Setlist(name='tour')
+    setlist.encore = 'last song'
+    setlist.put()
+    response = self.client.get(self.client.uri_for('edit', model_name='Setlist', key=setlist.key()))
+    self.assertEquals(200, response.status_int)
+    self.assertTrue('last song' in response.body)
+    form_class = model_register.get_model_admin('Setlist').AdminNewForm
+    self.assertFalse(hasattr(form_class, 'encore'))
+    self.assertEquals({}, form_class.dynamic_properties)
+
+
+class AdminArtistEventual(model_register.ModelAdmin):
+  model = Artist
+  read_policy = db.EVENTUAL_CONSISTENCY
+  rpc_deadline = 2
+
+
+class ReadConfigTests(AdminRequestTestCase):
+  model_admins = (AdminArtistEventual,)
+
+  def extendedSetUp(self):
+    db.put([Artist(key_name='artist-%d' % i, name='artist %d' % i) for i in range(3)])
+    self.old_per_page = admin_settings.ADMIN_ITEMS_PER_PAGE
+    admin_settings.ADMIN_ITEMS_PER_PAGE = 2
+
+  def extendedTearDown(self):
+    admin_settings.ADMIN_ITEMS_PER_PAGE = self.old_per_page
+
+  def test_should_use_default_config_without_options(self):
+    self.assertIsNone(AdminArtist().get_read_config())
+
+  def test_should_read_strongly_consistent_in_transactions(self):
+    config = AdminArtistEventual().get_read_config()
+    self.assertEquals(db.EVENTUAL_CONSISTENCY, config.read_policy)
+    self.assertEquals(2, config.deadline)
+    self.assertIsNone(db.run_in_transaction(AdminArtistEventual().get_read_config))
+
+  def test_should_page_the_list_with_the_read_config(self):
+    list_url = self.client.uri_for('list', model_name='Artist')
+    response = self.client.get(list_url)
+    self.assertTrue('artist 1' in response.body)
+    self.assertFalse('artist 2' in response.body)
+    queries = [rpc['detail'] for rpc in self.client.last_stats.rpcs if rpc['call'] == 'RunQuery']
+    self.assertEquals(1, len(queries))
+    self.assertTrue('strong: false' in queries[0], queries[0])
+
+    cursor = response.body.split('list_cursor=', 1)[1].split("'", 1)[0]
+    response = self.client.get('%s?list_cursor=%s' % (list_url, cursor))
+    self.assertTrue('artist 2' in response.body)
+    self.assertFalse('artist 1' in response.body)
+    self.assertFalse('list_cursor=' in response.body)
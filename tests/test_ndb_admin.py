@@ -0,0 +1,100 @@
+from google.appengine.ext import ndb
+
+from appengine_admin import admin_settings, fields
+from appengine_admin.ndb_admin import NdbModelAdmin
+from appengine_admin.tests import AdminRequestTestCase
+
+
+class NdbArtist(ndb.Model):
+  name = ndb.StringProperty()
+
+
+class NdbSong(ndb.Model):
+  title = ndb.StringProperty(required=True)
+  plays = ndb.IntegerProperty(default=0)
+  artist = ndb.KeyProperty(kind=NdbArtist)
+  added = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class AdminNdbArtist(NdbModelAdmin):
+  model = NdbArtist
+  display_field = 'name'
+
+
+class AdminNdbSong(NdbModelAdmin):
+  model = NdbSong
+  list_fields = ('title', 'artist')
+  paginate_on = ('title',)
+
+
+class NdbModelAdminTests(AdminRequestTestCase):
+  model_admins = (AdminNdbArtist, AdminNdbSong)
+
+  def extendedSetUp(self):
+    self.old_per_page = admin_settings.ADMIN_ITEMS_PER_PAGE
+    self.artist = NdbArtist(name='the artist')
+    self.artist.put()
+    self.songs = [NdbSong(title='song %d' % i, artist=self.artist.key) for i in range(3)]
+    ndb.put_multi(self.songs)
+    ndb.get_context().clear_cache()
+
+  def extendedTearDown(self):
+    admin_settings.ADMIN_ITEMS_PER_PAGE = self.old_per_page
+
+  def test_should_convert_properties(self):
+    form = AdminNdbSong().AdminForm()
+    self.assertEquals(['title', 'plays', 'artist'], [field.name for field in form])
+    self.assertTrue(isinstance(form.artist, fields.NdbKeyField))
+    self.assertEquals('NdbArtist', form.artist.kind)
+
+  def test_should_list_with_reference_labels(self):
+    response = self.client.get(self.client.uri_for('list', model_name='NdbSong'))
+    self.assertEquals(200, response.status_int)
+    self.assertEquals(3, response.body.count('the artist'))
+    self.assertTrue(self.songs[0].key.urlsafe() in response.body)
+    self.assertFalse('Schema' in response.body)
+
+  def test_should_page_by_cursor(self):
+    admin_settings.ADMIN_ITEMS_PER_PAGE = 2
+    list_url = self.client.uri_for('list', model_name='NdbSong')
+    response = self.client.get(list_url)
+    self.assertTrue('song 1' in response.body)
+    self.assertFalse('song 2' in response.body)
+    self.assertTrue('list_cursor=' in response.body)
+
+    cursor = response.body.split('list_cursor=', 1)[1].split("'", 1)[0]
+    response = self.client.get('%s?list_cursor=%s' % (list_url, cursor))
+    self.assertTrue('song 2' in response.body)
+    self.assertFalse('song 1' in response.body)
+    self.assertFalse('list_cursor=' in response.body)
+
+  def test_should_save_edits(self):
+    other = NdbArtist(name='other')
+    other.put()
+    edit_url = self.client.uri_for('edit', model_name='NdbSong', key=self.songs[0].key.urlsafe())
+    page = self.client.get(edit_url)
+    self.assertEquals(200, page.status_int)
+    response = self.client.post(edit_url, {
+      'title': 'new title',
+      'plays': '7',
+      'artist': other.key.urlsafe(),
+    }, csrf_from=page)
+    self.assertEquals(302, response.status_int)
+    ndb.get_context().clear_cache()
+    song = self.songs[0].key.get()
+    self.assertEquals(('new title', 7, other.key), (song.title, song.plays, song.artist))
+
+  def test_should_reject_keys_of_other_kinds(self):
+    edit_url = self.client.uri_for('edit', model_name='NdbSong', key=self.songs[0].key.urlsafe())
+    page = self.client.get(edit_url)
+    response = self.client.post(edit_url, {
+      'title': 'new title',
+      'artist': self.songs[1].key.urlsafe(),
+    }, csrf_from=page)
+    self.assertEquals(200, response.status_int)
+    self.assertEquals('song 0', self.songs[0].key.get().title)
+
+  def test_should_not_serve_db_tools(self):
+    response = self.client.get(self.client.uri_for(
+      'references', model_name='NdbArtist', key=self.artist.key.urlsafe()))
+    self.assertEquals(404, response.status_int)
@@ -0,0 +1,77 @@
+from unittest import SkipTest
+
+from webob.multidict import MultiDict
+
+from wtforms import Form
+
+from appengine_admin.tests import TestCase
+
+try:
+  from sqlalchemy import Column, Integer, String, create_engine, event
+  from sqlalchemy.ext.declarative import declarative_base
+  from sqlalchemy.orm import sessionmaker
+
+  from wtforms.ext.sqlalchemy.fields import QuerySelectField, QuerySelectMultipleField
+
+  Base = declarative_base()
+
+  class FieldTag(Base):
+    __tablename__ = 'field_tag'
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50), nullable=False)
+except ImportError:
+  Base = None
+
+
+class LazyQuerySelectFieldTests(TestCase):
+  def extendedSetUp(self):
+    if Base is None:
+      raise SkipTest
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    self.session = sessionmaker(bind=engine)()
+    self.tags = [FieldTag(name='tag %d' % i) for i in range(5)]
+    self.session.add_all(self.tags)
+    self.session.commit()
+    self.statements = []
+    event.listen(engine, 'before_cursor_execute', lambda *args: self.statements.append(args[2]))
+
+    session = self.session
+
+    class TagForm(Form):
+      tag = QuerySelectField(query_factory=lambda: session.query(FieldTag), get_label='name',
+                             lazy=True, limit=2)
+      tags = QuerySelectMultipleField(query_factory=lambda: session.query(FieldTag), get_label='name',
+                                      lazy=True, limit=2)
+    self.TagForm = TagForm
+
+  def extendedTearDown(self):
+    if Base is None:
+      return
+    self.session.close()
+
+  def test_should_resolve_selections_with_one_in_query_each(self):
+    form = self.TagForm(MultiDict([('tag', str(self.tags[4].id)),
+                                   ('tags', str(self.tags[1].id)), ('tags', str(self.tags[3].id))]))
+    self.assertTrue(form.validate())
+    self.assertEquals(self.tags[4], form.tag.data)
+    self.assertEquals(set([self.tags[1], self.tags[3]]), set(form.tags.data))
+    self.assertEquals(2, len(self.statements))
+    self.assertTrue(all(' IN ' in statement for statement in self.statements))
+
+  def test_should_reject_values_missing_from_the_query(self):
+    self.assertFalse(self.TagForm(MultiDict([('tag', '100'), ('tags', str(self.tags[0].id))])).validate())
+    form = self.TagForm(MultiDict([('tag', str(self.tags[0].id)),
+                                   ('tags', str(self.tags[0].id)), ('tags', 'nope')]))
+    self.assertFalse(form.validate())
+    self.assertTrue('tags' in form.errors)
+
+  def test_should_limit_choices_and_keep_the_selection(self):
+    form = self.TagForm(MultiDict([('tag', str(self.tags[4].id)), ('tags', str(self.tags[3].id))]))
+    choices = list(form.tag.iter_choices())
+    self.assertEquals([u'tag 0', u'tag 1', u'tag 4'], [label for _, label, _ in choices])
+    self.assertEquals([False, False, True], [selected for _, _, selected in choices])
+    self.assertEquals([u'tag 0', u'tag 1', u'tag 3'], [label for _, label, _ in form.tags.iter_choices()])
+
+  def test_should_need_the_default_get_pk(self):
+    self.assertRaises(TypeError, QuerySelectField(lazy=True, get_pk=lambda obj: obj.id).bind, Form(), 'tag')
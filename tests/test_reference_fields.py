@@ -0,0 +1,90 @@
+from google.appengine.ext import db, ndb
+from webob.multidict import MultiDict
+
+from wtforms import Form
+from wtforms.ext.appengine.fields import KeyPropertyField, ReferencePropertyField
+
+from appengine_admin import request_stats
+from appengine_admin.tests import TestCase
+
+
+class FieldArtist(db.Model):
+  name = db.StringProperty()
+
+  def __unicode__(self):
+    return self.name
+
+
+class FieldAlbum(db.Model):
+  title = db.StringProperty()
+
+
+class NdbFieldArtist(ndb.Model):
+  name = ndb.StringProperty()
+
+
+class ReferenceForm(Form):
+  artist = ReferencePropertyField(reference_class=FieldArtist, limit=2)
+
+
+class KeyForm(Form):
+  artist = KeyPropertyField(reference_class=NdbFieldArtist, get_label='name', limit=2)
+
+
+class ReferencePropertyFieldTests(TestCase):
+  def extendedSetUp(self):
+    self.artists = [FieldArtist(name='artist %d' % i) for i in range(5)]
+    db.put(self.artists)
+
+  def test_should_resolve_the_selection_with_one_get(self):
+    stats = request_stats.start('test')
+    form = ReferenceForm(MultiDict({'artist': str(self.artists[4].key())}))
+    self.assertTrue(form.validate())
+    request_stats.finish()
+    self.assertEquals(self.artists[4].key(), form.artist.data.key())
+    self.assertEquals(1, stats.rpc_count('datastore_v3'))
+    self.assertEquals(1, stats.entity_count('datastore_v3'))
+
+  def test_should_reject_other_kinds_and_bad_keys(self):
+    album = FieldAlbum(title='album')
+    album.put()
+    self.assertFalse(ReferenceForm(MultiDict({'artist': str(album.key())})).validate())
+    self.assertFalse(ReferenceForm(MultiDict({'artist': 'nope'})).validate())
+
+  def test_should_check_overridden_queries_by_key(self):
+    stats = request_stats.start('test')
+    form = ReferenceForm(MultiDict({'artist': str(self.artists[1].key())}))
+    form.artist.query = FieldArtist.all().filter('name <', 'artist 2')
+    self.assertTrue(form.validate())
+    request_stats.finish()
+    # The get of the selection and one keys-only query.
+    self.assertEquals(2, stats.rpc_count('datastore_v3'))
+    # The overridden query is left as it was.
+    self.assertEquals([u'artist 0', u'artist 1'], [label for _, label, _ in form.artist.iter_choices()])
+
+    form = ReferenceForm(MultiDict({'artist': str(self.artists[3].key())}))
+    form.artist.query = FieldArtist.all().filter('name <', 'artist 2')
+    self.assertFalse(form.validate())
+
+  def test_should_limit_choices_and_keep_the_selection(self):
+    form = ReferenceForm(MultiDict({'artist': str(self.artists[4].key())}))
+    choices = list(form.artist.iter_choices())
+    self.assertEquals([u'artist 0', u'artist 1', u'artist 4'], [label for _, label, _ in choices])
+    self.assertEquals([False, False, True], [selected for _, _, selected in choices])
+
+
+class KeyPropertyFieldTests(TestCase):
+  def extendedSetUp(self):
+    self.keys = ndb.put_multi([NdbFieldArtist(name='artist %d' % i) for i in range(5)])
+
+  def test_should_validate_by_key(self):
+    form = KeyForm(MultiDict({'artist': self.keys[3].urlsafe()}))
+    self.assertTrue(form.validate())
+    self.assertEquals(self.keys[3], form.artist.data)
+    self.keys[3].delete()
+    self.assertFalse(KeyForm(MultiDict({'artist': self.keys[3].urlsafe()})).validate())
+
+  def test_should_limit_choices_and_keep_the_selection(self):
+    form = KeyForm(MultiDict({'artist': self.keys[4].urlsafe()}))
+    self.assertEquals([u'artist 0', u'artist 1', u'artist 4'],
+                      [label for _, label, _ in form.artist.iter_choices()])
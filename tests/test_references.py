@@ -0,0 +1,71 @@
+from google.appengine.ext import db
+
+from appengine_admin import admin_settings, model_register, references
+from appengine_admin.tests import AdminRequestTestCase
+
+
+class RefArtist(db.Model):
+  name = db.StringProperty()
+
+
+class RefSong(db.Model):
+  title = db.StringProperty()
+  artist = db.ReferenceProperty(RefArtist)
+  featuring = db.ListProperty(db.Key)
+
+
+class AdminRefArtist(model_register.ModelAdmin):
+  model = RefArtist
+
+
+class AdminRefSong(model_register.ModelAdmin):
+  model = RefSong
+
+
+class ReverseReferenceTests(AdminRequestTestCase):
+  model_admins = (AdminRefArtist, AdminRefSong)
+
+  def extendedSetUp(self):
+    self.old_limit = admin_settings.REVERSE_REFERENCE_LIMIT
+    self.artist = RefArtist(name='artist')
+    self.artist.put()
+    self.other = RefArtist(name='other')
+    self.other.put()
+    db.put([RefSong(title='song %d' % i, artist=self.artist, featuring=[self.other.key()])
+            for i in range(3)])
+
+  def extendedTearDown(self):
+    admin_settings.REVERSE_REFERENCE_LIMIT = self.old_limit
+
+  def test_should_find_referencing_properties(self):
+    found = [(model_admin.model_name, field_name)
+             for model_admin, field_name, _ in references.find_referencing_properties(RefArtist)]
+    self.assertEquals([('RefSong', 'artist'), ('RefSong', 'featuring')], found)
+
+  def test_should_count_back_references_and_memberships(self):
+    artist_references = references.count_reverse_references(self.artist.key())
+    self.assertEquals(1, len(artist_references))
+    self.assertEquals('artist', artist_references[0].field_name)
+    self.assertEquals('refsong_set', artist_references[0].collection_name)
+    self.assertEquals(3, artist_references[0].count)
+
+    other_references = references.count_reverse_references(self.other.key())
+    self.assertEquals([('featuring', True)], [(r.field_name, r.is_list) for r in other_references])
+
+  def test_should_cap_counts(self):
+    reference = references.count_reverse_references(self.artist.key(), limit=2)[0]
+    self.assertEquals(2, reference.count)
+    self.assertTrue(reference.capped)
+
+  def test_should_render_panel_apart_from_the_edit_page(self):
+    response = self.client.get(self.client.uri_for('edit', model_name='RefArtist', key=self.artist.key()))
+    self.assertEquals(200, response.status_int)
+    self.assertFalse('refsong_set' in response.body)
+
+    admin_settings.REVERSE_REFERENCE_LIMIT = 2
+    response = self.client.get(self.client.uri_for('references', model_name='RefArtist', key=self.artist.key()))
+    self.assertEquals(200, response.status_int)
+    self.assertTrue('refsong_set' in response.body)
+    self.assertTrue('2+' in response.body)
+    # One RPC per referencing property.
+    self.assertRPCs(datastore_rpcs=2)
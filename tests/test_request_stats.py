@@ -0,0 +1,111 @@
+from google.appengine.api import memcache
+from google.appengine.ext import db
+
+from appengine_admin import request_stats
+from appengine_admin.tests import TestCase
+
+
+class Track(db.Model):
+  title = db.StringProperty()
+
+
+class RequestStatsTests(TestCase):
+  def extendedSetUp(self):
+    db.put([Track(title='track %d' % i) for i in range(3)])
+
+  def extendedTearDown(self):
+    request_stats.finish()
+
+  def test_should_not_record_outside_of_a_request(self):
+    request_stats.finish()
+    Track.all().fetch(10)
+    self.assertIsNone(request_stats.current())
+
+  def test_should_count_datastore_and_memcache_rpcs(self):
+    stats = request_stats.start(name='test')
+    tracks = Track.all().fetch(10)
+    db.get([track.key() for track in tracks])
+    memcache.get_multi(['a', 'b'])
+    self.assertIs(stats, request_stats.finish())
+    self.assertIs(stats, request_stats.last())
+
+    summary = stats.summary()
+    self.assertEquals(2, summary['rpcs']['datastore_v3']['calls'])
+    self.assertEquals(1, summary['rpcs']['datastore_v3']['by_call']['Get']['calls'])
+    self.assertEquals(3, summary['rpcs']['datastore_v3']['by_call']['Get']['entities'])
+    self.assertEquals(3, summary['rpcs']['datastore_v3']['by_call']['RunQuery']['entities'])
+    self.assertEquals(1, stats.rpc_count('memcache'))
+    self.assertIn('Track', [rpc['detail'] for rpc in stats.rpcs if rpc['detail']][0])
+
+  def test_should_record_memcache_rpcs(self):
+    stats = request_stats.start(name='test')
+    memcache.set_multi({'a': 1, 'b': 2})
+    self.assertEquals({'a': 1, 'b': 2}, memcache.get_multi(['a', 'b']))
+    request_stats.finish()
+
+    by_call = stats.summary()['rpcs']['memcache']['by_call']
+    self.assertEquals(2, stats.rpc_count('memcache'))
+    self.assertEquals(2, by_call['Set']['entities'])
+    self.assertEquals(2, by_call['Get']['entities'])
+    self.assertEquals(0, stats.rpc_count('datastore_v3'))
+
+  def test_should_record_timings(self):
+    stats = request_stats.start()
+    with request_stats.timed('render'):
+      pass
+    request_stats.timed_callable('validate_title', lambda form, field: None)(None, None)
+    request_stats.finish()
+    self.assertEquals(['render', 'validate_title'], [name for name, _ in stats.timings])
+    self.assertIn('render;dur=', stats.server_timing())
+
+
+  def test_should_measure_overlapping_rpcs_once(self):
+    stats = request_stats.RequestStats()
+    for start, ms in ((0.0, 100), (0.05, 100), (0.3, 50)):
+      stats.rpcs.append({'service': 'datastore_v3', 'call': 'Get', 'start': start, 'ms': ms,
+                         'entities': 1, 'detail': None})
+    self.assertAlmostEqual(250, stats.rpc_ms())
+    self.assertAlmostEqual(200, stats.rpc_wall_ms())
+    self.assertAlmostEqual(0, stats.rpc_wall_ms('memcache'))
+
+
+class RequestBudgetTests(TestCase):
+  def extendedSetUp(self):
+    from appengine_admin import admin_settings
+    self.old_budget = admin_settings.REQUEST_BUDGET
+    self.old_route_budgets = admin_settings.ROUTE_REQUEST_BUDGETS
+    admin_settings.REQUEST_BUDGET = {'latency_ms': None, 'datastore_rpcs': 10}
+    admin_settings.ROUTE_REQUEST_BUDGETS = {'appengine_admin.list': {'datastore_rpcs': 2}}
+    db.put([Track(title='track %d' % i) for i in range(3)])
+
+  def extendedTearDown(self):
+    from appengine_admin import admin_settings
+    admin_settings.REQUEST_BUDGET = self.old_budget
+    admin_settings.ROUTE_REQUEST_BUDGETS = self.old_route_budgets
+    request_stats.finish()
+
+  def test_should_resolve_budget_overrides(self):
+    from appengine_admin import model_register, utils
+
+    class AdminTrack(model_register.ModelAdmin):
+      model = Track
+      request_budget = {'latency_ms': 500}
+      route_request_budgets = {'appengine_admin.list': {'datastore_rpcs': 3}}
+
+    self.assertEquals({'latency_ms': None, 'datastore_rpcs': 10},
+                      utils.get_request_budget('appengine_admin.edit'))
+    self.assertEquals({'latency_ms': None, 'datastore_rpcs': 2},
+                      utils.get_request_budget('appengine_admin.list'))
+    self.assertEquals({'latency_ms': 500, 'datastore_rpcs': 3},
+                      utils.get_request_budget('appengine_admin.list', AdminTrack()))
+
+  def test_should_report_exceeded_budget_and_repeated_query(self):
+    stats = request_stats.start(name='appengine_admin.list')
+    for _ in range(3):
+      Track.all().filter('title =', 'track 1').fetch(10)
+    Track.all().fetch(1)
+    request_stats.finish()
+    self.assertEquals([], stats.exceeded_budget({'latency_ms': None, 'datastore_rpcs': 4}))
+    self.assertEquals(['4 datastore RPCs > 2'],
+                      stats.exceeded_budget({'latency_ms': None, 'datastore_rpcs': 2}))
+    self.assertIn('track 1', stats.offending_query())
@@ -0,0 +1,132 @@
+'''Upper bounds on the datastore work of each admin page.
+
+These are regression baselines: lower them when a change makes a page cheaper,
+never raise them to make a test pass without understanding why.
+'''
+from google.appengine.ext import db
+
+from appengine_admin import labels, model_register
+from appengine_admin.tests import AdminRequestTestCase, simulate_rpc_latency
+
+
+ROWS = 50
+# Simulated datastore latency, see test_edit_overlaps_reads.
+LATENCY_MS = 50
+
+
+class BudgetArtist(db.Model):
+  name = db.StringProperty()
+
+
+class BudgetAlbum(db.Model):
+  name = db.StringProperty()
+
+
+class BudgetSong(db.Model):
+  title = db.StringProperty()
+  album = db.ReferenceProperty(BudgetAlbum)
+  artist = db.ReferenceProperty(BudgetArtist)
+  cover = db.BlobProperty()
+
+
+class AdminBudgetSong(model_register.ModelAdmin):
+  model = BudgetSong
+  list_fields = ('title', 'album', 'artist')
+
+
+class AdminBudgetAlbum(model_register.ModelAdmin):
+  model = BudgetAlbum
+  list_fields = ('name',)
+
+
+class AdminBudgetArtist(model_register.ModelAdmin):
+  model = BudgetArtist
+  list_fields = ('name',)
+
+
+class AdminPageRPCTests(AdminRequestTestCase):
+  model_admins = (AdminBudgetSong, AdminBudgetAlbum, AdminBudgetArtist)
+
+  def extendedSetUp(self):
+    self.artists = [BudgetArtist(name='artist %d' % i) for i in range(ROWS)]
+    self.albums = [BudgetAlbum(name='album %d' % i) for i in range(ROWS)]
+    db.put(self.artists + self.albums)
+    self.songs = [BudgetSong(title='song %d' % i, album=self.albums[i], artist=self.artists[i],
+                             cover=db.Blob('cover %d' % i))
+                  for i in range(ROWS)]
+    db.put(self.songs)
+    self.song = self.songs[0]
+
+  def test_list(self):
+    response = self.client.get(self.client.uri_for('list', model_name='BudgetSong'))
+    self.assertEquals(200, response.status_int)
+    # The PAGINATOR_PATH paginator fetches ROWS + 1 entities in the SDK's
+    # default batches of 20: a RunQuery and two Next calls. Then one batch get
+    # for the labels of both reference columns, cold in memcache.
+    self.assertRPCs(datastore_rpcs=3 + 1, entities_fetched=ROWS + 1 + 2 * ROWS)
+
+  def test_list_ajax_mini_page(self):
+    response = self.client.get(self.client.uri_for('list', model_name='BudgetAlbum') + '?ajax_mini_page=1')
+    self.assertEquals(200, response.status_int)
+    # Selector pages are a single cursor query.
+    self.assertRPCs(datastore_rpcs=1, entities_fetched=ROWS)
+
+  def test_edit(self):
+    response = self.client.get(self.client.uri_for('edit', model_name='BudgetSong', key=self.song.key()))
+    self.assertEquals(200, response.status_int)
+    # The entity, the labels of its two references, and a selector page per referenced kind.
+    self.assertRPCs(datastore_rpcs=2 + 2, entities_fetched=3 + 2 * ROWS)
+
+  def test_edit_overlaps_reads(self):
+    # Cached labels leave the entity read and the two selector queries.
+    labels.get_labels([self.albums[0].key(), self.artists[0].key()])
+    simulate_rpc_latency(LATENCY_MS)
+    response = self.client.get(self.client.uri_for('edit', model_name='BudgetSong', key=self.song.key()))
+    self.assertEquals(200, response.status_int)
+    stats = self.client.last_stats
+    queries = [rpc for rpc in stats.rpcs if rpc['service'] == 'datastore_v3' and rpc['call'] == 'RunQuery']
+    self.assertEquals(3, stats.rpc_count('datastore_v3'))
+    self.assertEquals(2, len(queries))
+    # Both selector queries are made before either result is collected.
+    self.assertLess(max(rpc['start'] for rpc in queries),
+                    min(rpc['start'] + rpc['ms'] / 1000 for rpc in queries))
+    self.assertLess(stats.rpc_wall_ms('datastore_v3'), stats.rpc_ms('datastore_v3'))
+
+  def test_edit_save(self):
+    edit_url = self.client.uri_for('edit', model_name='BudgetSong', key=self.song.key())
+    page = self.client.get(edit_url)
+    response = self.client.post(edit_url, {
+      'title': 'new title',
+      'album': str(self.albums[1].key()),
+      'artist': str(self.artists[1].key()),
+    }, csrf_from=page)
+    self.assertEquals(302, response.status_int)
+    self.assertEquals('new title', db.get(self.song.key()).title)
+    # The entity, the put and the re-get after it, references are saved by key.
+    self.assertRPCs(datastore_rpcs=3, entities_fetched=2)
+
+  def test_new(self):
+    response = self.client.get(self.client.uri_for('new', model_name='BudgetSong'))
+    self.assertEquals(200, response.status_int)
+    self.assertRPCs(datastore_rpcs=2, entities_fetched=2 * ROWS)
+
+  def test_clone(self):
+    response = self.client.get(self.client.uri_for('clone', model_name='BudgetSong', key=self.song.key()))
+    self.assertEquals(200, response.status_int)
+    self.assertRPCs(datastore_rpcs=2 + 2, entities_fetched=3 + 2 * ROWS)
+
+  def test_delete(self):
+    page = self.client.get(self.client.uri_for('list', model_name='BudgetAlbum'))
+    response = self.client.post(
+      self.client.uri_for('delete', model_name='BudgetAlbum', key=self.albums[-1].key()),
+      csrf_from=page)
+    self.assertEquals(302, response.status_int)
+    self.assertIsNone(db.get(self.albums[-1].key()))
+    self.assertRPCs(datastore_rpcs=2, entities_fetched=1)
+
+  def test_blob(self):
+    response = self.client.get(self.client.uri_for(
+      'blob', model_name='BudgetSong', field_name='cover', key=self.song.key()))
+    self.assertEquals(200, response.status_int)
+    self.assertEquals('cover 0', response.body)
+    self.assertRPCs(datastore_rpcs=1, entities_fetched=1)
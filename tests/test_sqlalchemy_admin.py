@@ -0,0 +1,139 @@
+from datetime import datetime
+from unittest import SkipTest
+
+from appengine_admin import admin_settings
+from appengine_admin.tests import AdminRequestTestCase, TestCase
+
+try:
+  from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+  from sqlalchemy.ext.declarative import declarative_base
+  from sqlalchemy.orm import relationship
+
+  from appengine_admin.sqlalchemy_admin import RowKey, SQLAlchemyModelAdmin, create_session
+
+  Base = declarative_base()
+  Session = create_session('sqlite://')
+
+  class SqlCustomer(Base):
+    __tablename__ = 'customer'
+    id = Column(Integer, primary_key=True)
+    name = Column(String(100), nullable=False)
+
+    def __unicode__(self):
+      return self.name
+
+  class SqlInvoice(Base):
+    __tablename__ = 'invoice'
+    id = Column(Integer, primary_key=True)
+    number = Column(String(20), nullable=False)
+    issued = Column(DateTime, nullable=False, index=True)
+    customer_id = Column(Integer, ForeignKey('customer.id'))
+    customer = relationship(SqlCustomer)
+    paid = Column(DateTime, index=True)
+
+  class AdminSqlCustomer(SQLAlchemyModelAdmin):
+    model = SqlCustomer
+    session = Session
+    display_field = 'name'
+
+  class AdminSqlInvoice(SQLAlchemyModelAdmin):
+    model = SqlInvoice
+    session = Session
+    list_fields = ('number', 'customer')
+    paginate_on = ('-issued',)
+
+  sql_model_admins = (AdminSqlCustomer, AdminSqlInvoice)
+except ImportError:
+  Base = None
+  sql_model_admins = ()
+
+
+class RowKeyTests(TestCase):
+  def extendedSetUp(self):
+    if Base is None:
+      raise SkipTest
+
+  def test_should_only_paginate_on_indexed_not_nullable_columns(self):
+    for column in ('number', 'paid'):
+      admin_cls = type('AdminSqlInvoiceBy', (SQLAlchemyModelAdmin,),
+                       {'model': SqlInvoice, 'session': Session, 'paginate_on': (column,)})
+      self.assertRaises(ValueError, admin_cls)
+
+  def test_should_close_plain_sessions(self):
+    session = Session.session_factory()
+    session.add(SqlCustomer(name='customer'))
+    admin_cls = type('AdminSqlCustomerPlain', (SQLAlchemyModelAdmin,), {'model': SqlCustomer, 'session': session})
+    admin_cls().end_request()
+    # Closing expunges everything from the session.
+    self.assertEquals([], list(session))
+
+  def test_should_compare_row_keys_by_value(self):
+    self.assertEquals(RowKey('SqlInvoice', [1]), RowKey('SqlInvoice', (1,)))
+    self.assertEquals('SqlInvoice:a%2Cb', str(RowKey('SqlInvoice', ['a,b'])))
+
+
+class SQLAlchemyModelAdminTests(AdminRequestTestCase):
+  model_admins = sql_model_admins
+
+  def extendedSetUp(self):
+    if Base is None:
+      raise SkipTest
+    self.old_per_page = admin_settings.ADMIN_ITEMS_PER_PAGE
+    Base.metadata.create_all(Session.bind)
+    session = Session()
+    self.customer = SqlCustomer(name='ACME')
+    self.invoices = [SqlInvoice(number='N%d' % i, issued=datetime(2012, 1, 1 + i), customer=self.customer)
+                     for i in range(3)]
+    session.add_all(self.invoices)
+    session.commit()
+
+  def extendedTearDown(self):
+    if Base is None:
+      return
+    admin_settings.ADMIN_ITEMS_PER_PAGE = self.old_per_page
+    Session.remove()
+    Base.metadata.drop_all(Session.bind)
+
+  def test_should_list_with_joined_references(self):
+    response = self.client.get(self.client.uri_for('list', model_name='SqlInvoice'))
+    self.assertEquals(200, response.status_int)
+    self.assertEquals(3, response.body.count('ACME'))
+    self.assertFalse('Schema' in response.body)
+
+  def test_should_page_by_keyset(self):
+    admin_settings.ADMIN_ITEMS_PER_PAGE = 2
+    list_url = self.client.uri_for('list', model_name='SqlInvoice')
+    response = self.client.get(list_url)
+    # Newest first.
+    self.assertTrue('N2' in response.body)
+    self.assertFalse('N0' in response.body)
+
+    cursor = response.body.split('list_cursor=', 1)[1].split("'", 1)[0]
+    response = self.client.get('%s?list_cursor=%s' % (list_url, cursor))
+    self.assertTrue('N0' in response.body)
+    self.assertFalse('N1' in response.body)
+    self.assertFalse('list_cursor=' in response.body)
+
+  def test_should_save_edits(self):
+    edit_url = self.client.uri_for('edit', model_name='SqlInvoice', key=str(self.invoices[0].id))
+    page = self.client.get(edit_url)
+    self.assertEquals(200, page.status_int)
+    response = self.client.post(edit_url, {
+      'number': 'N100',
+      'issued': '2012-01-01 00:00:00',
+      'customer': str(self.customer.id),
+    }, csrf_from=page)
+    self.assertEquals(302, response.status_int)
+    Session.remove()
+    self.assertEquals('N100', Session.query(SqlInvoice).get(self.invoices[0].id).number)
+
+  def test_should_delete(self):
+    page = self.client.get(self.client.uri_for('list', model_name='SqlInvoice'))
+    response = self.client.post(
+      self.client.uri_for('delete', model_name='SqlInvoice', key=str(self.invoices[0].id)), csrf_from=page)
+    self.assertEquals(302, response.status_int)
+    self.assertEquals(2, Session.query(SqlInvoice).count())
+
+  def test_should_404_on_bad_keys(self):
+    response = self.client.get(self.client.uri_for('edit', model_name='SqlInvoice', key='nope'))
+    self.assertEquals(404, response.status_int)
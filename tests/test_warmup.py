@@ -0,0 +1,41 @@
+from google.appengine.ext import db
+from webapp2_extras import jinja2
+
+from appengine_admin import admin_settings, model_register, warmup
+from appengine_admin.tests import AdminRequestTestCase
+
+
+class WarmupArtist(db.Model):
+  name = db.StringProperty()
+
+
+class AdminWarmupArtist(model_register.ModelAdmin):
+  model = WarmupArtist
+
+
+class WarmupTests(AdminRequestTestCase):
+  model_admins = (AdminWarmupArtist,)
+
+  def test_should_run_every_stage(self):
+    timings = warmup.warmup(app=self.client.app)
+    self.assertEquals([stage for stage, _ in warmup.WARMUP_STAGES], [stage for stage, _ in timings])
+
+  def test_should_compile_the_admin_routes(self):
+    warmup.warmup(app=self.client.app)
+    admin_routes = [route for route in self.client.app.router.match_routes
+                    if route.template.startswith(admin_settings.ADMIN_BASE_URL)]
+    self.assertTrue(admin_routes)
+    for route in admin_routes:
+      self.assertTrue('regex' in route.__dict__, route.template)
+      self.assertTrue('reverse_template' in route.__dict__, route.template)
+
+  def test_should_build_the_forms(self):
+    warmup.warmup(app=self.client.app)
+    self.assertTrue(model_register.get_model_admin('WarmupArtist')._form_classes)
+
+  def test_should_only_compile_the_admin_templates(self):
+    warmup.warmup(app=self.client.app)
+    environment = jinja2.get_jinja2(app=self.client.app).environment
+    compiled = set(name for _, name in environment.cache.keys())
+    self.assertEquals(set(warmup.admin_template_names()), compiled)
+    self.assertTrue('widgets/ajax_list_property.html' in compiled)
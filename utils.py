@@ -1,6 +1,11 @@
+import base64
+import json
 import logging
 import os
+from datetime import date, datetime, time
+from decimal import Decimal
 
+from google.appengine.api import users
 from google.appengine.ext import db
 
 
@@ -11,9 +16,10 @@ class Http404(Exception):
 def import_path(path):
     class_path, _, class_name = path.rpartition('.')
     imported_module = __import__(class_path)
-    _, _, module_name = class_path.rpartition('.')
-    actual_module = getattr(imported_module, module_name)
-    return getattr(actual_module, class_name)
+    # __import__ returns the top level package, walk down to the actual module.
+    for module_name in class_path.split('.')[1:]:
+      imported_module = getattr(imported_module, module_name)
+    return getattr(imported_module, class_name)
 
 
 def import_pytz():  # XXX: import pytz in a less hacky way
@@ -36,12 +42,77 @@ class Paginator(object):
     self.get_page = paginator.get_page
 
 
+class CursorPage(object):
+  '''A page of entities or labels.Label objects, continued by cursor.
+
+  Used for reference selectors (see ModelAdmin.get_selector_page) and ndb list
+  pages. Cursors only go forward, previous_url is usually the first page.
+  '''
+  def __init__(self, items, next_url=None, previous_url=None):
+    self.items = items
+    self.next_url = next_url
+    self.previous_url = previous_url
+
+  def __iter__(self):
+    return iter(self.items)
+
+  def __len__(self):
+    return len(self.items)
+
+  def has_next(self):
+    return bool(self.next_url)
+
+  def get_next_url(self):
+    return self.next_url
+
+  def has_previous(self):
+    return bool(self.previous_url)
+
+  def get_previous_url(self):
+    return self.previous_url
+
+
+class DeferredResult(object):
+  '''Result of work whose RPCs were already sent, finished by func on the first get_result().
+
+  Works like the get_result() of datastore and memcache async RPCs, so
+  independent reads can be started together and joined before rendering.
+  '''
+  def __init__(self, func):
+    self._func = func
+    self._done = False
+    self._result = None
+
+  def get_result(self):
+    if not self._done:
+      self._result = self._func()
+      self._done = True
+      self._func = None
+    return self._result
+
+
 def get_human_name(prop):
   return prop.capitalize().replace('_', ' ')
 
 
+def get_key(item):
+  '''Get the key of a db or ndb entity, or of a labels.Label.'''
+  key = item.key
+  return key() if callable(key) else key
+
+
+def urlsafe_key(key):
+  '''Get a key as used in admin URLs, the same string for db and ndb keys.'''
+  return key.urlsafe() if hasattr(key, 'urlsafe') else str(key)
+
+
+def get_urlsafe_key(item):
+  '''Get the key of an entity as used in admin URLs, see urlsafe_key.'''
+  return urlsafe_key(get_key(item))
+
+
 def get_dynamic_properties(item):
-  if not item:
+  if not item or not hasattr(item, 'dynamic_properties'):
     return {}
   dynamic_properties = {}
   from . import admin_settings
@@ -66,6 +137,14 @@ def get_dynamic_properties(item):
   return dynamic_properties
 
 
+def get_blob_properties(item, field_name):
+  '''Get the meta info dict (Content_Type, File_Name) stored with a blob field.
+
+  The meta info is read from the `<field_name>_meta` attribute, None if missing.
+  '''
+  return getattr(item, '%s_meta' % field_name, None) or None
+
+
 def safe_get_by_key(model, key):
   '''Get record of particular model by key.
 
@@ -92,9 +171,78 @@ def is_production():
   return True
 
 
+def get_request_budget(route_name, model_admin=None):
+  '''Get the request budget for a route, optionally specific to a ModelAdmin.
+
+  Later overrides win: settings, settings per route, ModelAdmin, ModelAdmin per route.
+  '''
+  from . import admin_settings
+  budget = dict(admin_settings.REQUEST_BUDGET)
+  overrides = [admin_settings.ROUTE_REQUEST_BUDGETS.get(route_name)]
+  if model_admin:
+    overrides.append(model_admin.request_budget)
+    overrides.append((model_admin.route_request_budgets or {}).get(route_name))
+  for override in overrides:
+    if override:
+      budget.update(override)
+  return budget
+
+
 def notify_if_configured(reason, requesthandler, **kwargs):
   logging.error(u'Error occured (reason %s): %s' % (reason, kwargs))
   from . import admin_settings
   notify_func = admin_settings.NOTIFY_CALLBACK
   if notify_func:
     notify_func(reason=reason, requesthandler=requesthandler, **kwargs)
+
+
+# Cursor values that JSON can't hold, by type: (tag, encode, decode).
+_CURSOR_TYPES = (
+  (datetime, 'datetime', lambda value: list(value.timetuple()[:6]) + [value.microsecond],
+   lambda value: datetime(*value)),
+  (date, 'date', lambda value: [value.year, value.month, value.day], lambda value: date(*value)),
+  (time, 'time', lambda value: [value.hour, value.minute, value.second, value.microsecond],
+   lambda value: time(*value)),
+  (Decimal, 'decimal', str, Decimal),
+  (db.Key, 'key', str, db.Key),
+  (db.GeoPt, 'geopt', lambda value: [value.lat, value.lon], lambda value: db.GeoPt(*value)),
+  (users.User, 'user', lambda value: [value.email(), value.auth_domain(), value.user_id()],
+   lambda value: users.User(value[0], _auth_domain=value[1], _user_id=value[2])),
+  (db.ByteString, 'bytes', base64.b64encode, lambda value: db.ByteString(base64.b64decode(value))),
+)
+
+
+def encode_cursor(values):
+  '''Encode the values a page continues after (e.g. of its last row) as a URL-safe cursor.'''
+  encoded = []
+  for value in values:
+    for value_type, tag, encode, _ in _CURSOR_TYPES:
+      if isinstance(value, value_type):
+        value = {tag: encode(value)}
+        break
+    encoded.append(value)
+  return base64.urlsafe_b64encode(json.dumps(encoded))
+
+
+def decode_cursor(cursor):
+  '''Decode an encode_cursor cursor, raises ValueError if it is malformed.'''
+  try:
+    values = json.loads(base64.urlsafe_b64decode(str(cursor)))
+  except (TypeError, UnicodeError):
+    raise ValueError('Bad cursor: %s' % cursor)
+  if not isinstance(values, list):
+    raise ValueError('Bad cursor: %s' % cursor)
+  decoded = []
+  for value in values:
+    if isinstance(value, dict):
+      for _, tag, _, decode in _CURSOR_TYPES:
+        if tag in value:
+          try:
+            value = decode(value[tag])
+          except (TypeError, ValueError, ArithmeticError, db.Error, users.Error):
+            raise ValueError('Bad cursor: %s' % cursor)
+          break
+      else:
+        raise ValueError('Bad cursor: %s' % cursor)
+    decoded.append(value)
+  return decoded
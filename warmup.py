@@ -0,0 +1,120 @@
+'''Warmup for appengine_admin.
+
+Pre-builds everything the first admin request of a new instance would
+otherwise build on demand. Mount WarmupHandler at /_ah/warmup in the same
+WSGIApplication as the admin routes (the jinja2 environment is cached per
+application), or call warmup(app=your_admin_app) from your own warmup handler.
+'''
+import logging
+import os
+import time
+
+import webapp2
+from webapp2_extras import jinja2
+
+from . import admin_settings, model_register, utils
+
+
+# The admin's own templates, the host application's are left to load on demand.
+_TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+
+def _warmup_handlers(app, handler_cls):
+  # Imports the CSRF handler through utils.import_path.
+  from . import handlers
+
+
+def _warmup_routes(app, handler_cls):
+  from . import get_application_routes
+  get_application_routes(handler_cls)
+  # webapp2 routes compile their regex on their first match, and their URL
+  # template on their first build (uri_for).
+  for route in app.router.match_routes:
+    if getattr(route, 'template', '').startswith(admin_settings.ADMIN_BASE_URL):
+      route.regex
+      route.reverse_template
+  request = webapp2.Request.blank(admin_settings.ADMIN_BASE_URL + '/')
+  request.app = app
+  app.router.match(request)
+
+
+def _warmup_forms(app, handler_cls):
+  for model_admin in model_register._model_register.values():
+    model_admin.AdminForm
+    model_admin.AdminNewForm
+
+
+def admin_template_names():
+  '''Get the names of the admin's templates, relative to its template directory.'''
+  for directory, _, file_names in os.walk(_TEMPLATE_DIR):
+    for file_name in file_names:
+      if file_name.endswith('.html'):
+        path = os.path.relpath(os.path.join(directory, file_name), _TEMPLATE_DIR)
+        yield path.replace(os.sep, '/')
+
+
+def _warmup_templates(app, handler_cls):
+  environment = jinja2.get_jinja2(app=app).environment
+  # Loaded through the environment, so templates overridden by the app are the ones compiled.
+  for template_name in admin_template_names():
+    environment.get_template(template_name)
+
+
+def _warmup_timezones(app, handler_cls):
+  try:
+    pytz = utils.import_pytz()
+  except ImportError:  # Dates are displayed without timezones, nothing to prime.
+    return
+  pytz.timezone(admin_settings.TIMEZONE)
+  pytz.timezone('UTC')
+
+
+WARMUP_STAGES = (
+  ('handlers', _warmup_handlers),
+  ('routes', _warmup_routes),
+  ('forms', _warmup_forms),
+  ('templates', _warmup_templates),
+  ('timezones', _warmup_timezones),
+)
+
+
+def warmup(app=None, handler_cls=None):
+  '''Run all warmup stages and return a list of (stage, seconds) tuples.
+
+  Input:
+    * app - the webapp2 application serving the admin, defaults to the active one
+    * handler_cls - the handler class passed to get_application_routes, if any
+  '''
+  app = app or webapp2.get_app()
+  timings = []
+  for stage, stage_func in WARMUP_STAGES:
+    start = time.time()
+    stage_func(app, handler_cls)
+    timings.append((stage, time.time() - start))
+  total = sum(seconds for _, seconds in timings)
+  logging.info('appengine_admin warmup took %.1fms: %s', total * 1000,
+               ', '.join('%s=%.1fms' % (stage, seconds * 1000) for stage, seconds in timings))
+  return timings
+
+
+class WarmupHandler(webapp2.RequestHandler):
+  '''Use this handler for /_ah/warmup in the admin WSGIApplication.
+
+  Example:
+  ===
+  import appengine_admin
+  from appengine_admin.warmup import WarmupHandler
+
+  app = WSGIApplication(
+    routes=[webapp2.Route('/_ah/warmup', WarmupHandler)] + list(appengine_admin.get_application_routes()),
+    config=app_config,
+    debug=DEBUG)
+  ===
+  '''
+  handler_cls = None
+
+  def get(self):
+    timings = warmup(app=self.app, handler_cls=self.handler_cls)
+    self.response.headers['Content-Type'] = 'text/plain'
+    for stage, seconds in timings:
+      self.response.out.write('%s: %.1fms\n' % (stage, seconds * 1000))
@@ -44,10 +44,28 @@ class AjaxKeyWidget(object):
     self.multiple = multiple
 
   def __call__(self, field, **kwargs):
+    from . import admin_settings
     flat_attrs = w.core.html_params(name=field.name, **kwargs)
 
-    # Convert the value into keys, objects and object classes
-    field.process_formdata(field.data)
+    # Convert the value into keys and objects, only the first page of a delta list
+    delta = None
+    if field.delta:
+      removed_keys = set(field.removed_keys)
+      stored_keys = field.to_keys(field.object_data)
+      objects, total = field.get_display_objects(
+        [key for key in stored_keys if key not in removed_keys],
+        limit=admin_settings.AJAX_KEY_FIELD_PAGE_SIZE)
+      delta = {
+        'version_name': field.version_name,
+        'version': field.list_version(stored_keys),
+        'add_name': field.add_name,
+        'remove_name': field.remove_name,
+        'added_objects': field.get_display_objects(field.added_keys)[0],
+        'removed_keys': field.removed_keys,
+        'total': total,
+      }
+    else:
+      objects, _ = field.get_display_objects()
 
     from .handlers import AdminHandler
     handler = AdminHandler()
@@ -59,12 +77,13 @@ class AjaxKeyWidget(object):
       multiple=self.multiple,
       required=field.required,
       flat_attrs=flat_attrs,
-      objects=field.objects,
+      objects=objects,
+      delta=delta,
       object_classes=field.object_classes,
       get_item_edit_url=partial(self._get_item_edit_url, handler=handler),
       get_reference_key=self._get_reference_key,
       name=field.name,
-      paged_selector=partial(self._paged_selector, handler=handler),
+      paged_selector=partial(self._paged_selector, field=field, handler=handler),
     )
 
   @staticmethod
@@ -73,21 +92,32 @@ class AjaxKeyWidget(object):
 
   @staticmethod
   def _get_item_edit_url(model_instance, handler):
+    '''Edit URL of an entity or a labels.Label.'''
     return model_instance.admin_edit_url(handler) if hasattr(model_instance, 'admin_edit_url') \
-           else handler.uri_for('appengine_admin.edit', model_name=model_instance.__class__.__name__, key=model_instance.key())
+           else handler.uri_for('appengine_admin.edit', model_name=model_instance.kind(), key=model_instance.key())
+
+  @classmethod
+  def _paged_selector(cls, paged_cls, field, handler):
+    page = field.selector_pages.get(paged_cls.__name__)
+    if page is None:
+      page = cls.start_selector_page(paged_cls, handler)
+    return page.get_result()
 
   @staticmethod
-  def _paged_selector(paged_cls, handler):
+  def start_selector_page(paged_cls, handler):
+    '''Start reading the first selector page of paged_cls, returns an object with get_result().
+
+    Registered models send their query RPC right away, see ModelAdmin.get_selector_page_async.
+    '''
     from . import admin_settings, model_register
-    from .utils import Http404, import_path, Paginator
+    from .utils import DeferredResult, Http404, import_path
     base_url = handler.uri_for('appengine_admin.list', model_name=paged_cls.__name__)
     try:
       model_admin = model_register.get_model_admin(paged_cls.__name__)
-      paginator = Paginator(model_admin).get_page({}, base_url=base_url)
     except Http404:
       GenericPaginator = import_path(admin_settings.PAGINATOR_PATH)
-      paginator = GenericPaginator(
+      return DeferredResult(lambda: GenericPaginator(
         paged_cls,
         per_page=admin_settings.ADMIN_ITEMS_PER_PAGE
-      ).get_page({}, base_url=base_url)
-    return paginator
+      ).get_page({}, base_url=base_url))
+    return model_admin.get_selector_page_async({}, base_url=base_url)
@@ -1,9 +1,13 @@
 from __future__ import unicode_literals
 
+import copy
 import decimal
 import operator
 import warnings
 
+from google.appengine.ext import db, ndb
+from google.net.proto import ProtocolBuffer
+
 from wtforms import fields, widgets
 from wtforms.compat import text_type, string_types
 
@@ -26,12 +30,19 @@ class ReferencePropertyField(fields.SelectFieldBase):
         to allow `None` to be chosen.
     :param blank_text:
         Use this to override the default blank option's label.
+    :param limit:
+        If set, only the first `limit` entities of the query are rendered as
+        choices, plus the selected one.
+
+    The submitted key is resolved with a get by key, which also validates it
+    for the default query. An overridden `query` is checked with a keys-only
+    query for the key.
     """
     widget = widgets.Select()
 
     def __init__(self, label=None, validators=None, reference_class=None,
                  label_attr=None, get_label=None, allow_blank=False,
-                 blank_text='', **kwargs):
+                 blank_text='', limit=None, **kwargs):
         super(ReferencePropertyField, self).__init__(label, validators,
                                                      **kwargs)
         if label_attr is not None:
@@ -46,16 +57,22 @@ class ReferencePropertyField(fields.SelectFieldBase):
 
         self.allow_blank = allow_blank
         self.blank_text = blank_text
+        self.limit = limit
+        self.reference_class = reference_class
         self._set_data(None)
         if reference_class is not None:
-            self.query = reference_class.all()
+            self.query = self._default_query = reference_class.all()
+        else:
+            self._default_query = None
 
     def _get_data(self):
         if self._formdata is not None:
-            for obj in self.query:
-                if str(obj.key()) == self._formdata:
-                    self._set_data(obj)
-                    break
+            formdata = self._formdata
+            self._set_data(None)
+            try:
+                self._data = db.get(db.Key(formdata))
+            except (db.BadKeyError, db.KindError):
+                pass
         return self._data
 
     def _set_data(self, data):
@@ -68,10 +85,17 @@ class ReferencePropertyField(fields.SelectFieldBase):
         if self.allow_blank:
             yield ('__None', self.blank_text, self.data is None)
 
-        for obj in self.query:
-            key = str(obj.key())
-            label = self.get_label(obj)
-            yield (key, label, self.data and ( self.data.key( ) == obj.key() ) )
+        selected_key = self.data.key() if self.data else None
+        choices = self.query.fetch(self.limit) if self.limit else self.query
+        for obj in choices:
+            if obj.key() == selected_key:
+                selected_key = None
+                yield (str(obj.key()), self.get_label(obj), True)
+            else:
+                yield (str(obj.key()), self.get_label(obj), False)
+        if selected_key is not None:
+            # Selected but past the limit.
+            yield (str(selected_key), self.get_label(self.data), True)
 
     def process_formdata(self, valuelist):
         if valuelist:
@@ -83,12 +107,128 @@ class ReferencePropertyField(fields.SelectFieldBase):
 
     def pre_validate(self, form):
         if not self.allow_blank or self.data is not None:
-            for obj in self.query:
-                if str(self.data.key()) == str(obj.key()):
-                    break
+            if self.data is None:
+                raise ValueError(self.gettext('Not a valid choice'))
+            if self.query is self._default_query:
+                # The get found the entity, only its class is left to check.
+                if not isinstance(self.data, self.reference_class):
+                    raise ValueError(self.gettext('Not a valid choice'))
+                return
+            if not self._in_query(self.data.key()):
+                raise ValueError(self.gettext('Not a valid choice'))
+
+    def _in_query(self, key):
+        if isinstance(self.query, db.Query):
+            # db.Query.filter changes the query in place, filter a copy.
+            query = copy.deepcopy(self.query).filter('__key__ =', key)
+            return query.get(keys_only=True) is not None
+        return any(obj.key() == key for obj in self.query)
+
+
+class KeyPropertyField(fields.SelectFieldBase):
+    """
+    A field for ``ndb.KeyProperty``. The list items are rendered in a select.
+
+    :param reference_class:
+        A ndb.Model class which will be used to generate the default query
+        to make the list of items. If this is not specified, The `query`
+        property must be overridden before validation.
+    :param get_label:
+        If a string, use this attribute on the model class as the label
+        associated with each option. If a one-argument callable, this callable
+        will be passed model instance and expected to return the label text.
+        Otherwise, the model object's `__str__` or `__unicode__` will be used.
+    :param allow_blank:
+        If set to true, a blank choice will be added to the top of the list
+        to allow `None` to be chosen.
+    :param blank_text:
+        Use this to override the default blank option's label.
+    :param limit:
+        If set, only the first `limit` entities of the query are rendered as
+        choices, plus the selected one.
+
+    The submitted key is validated with a get by key, or with the query
+    filtered by the key when `query` is overridden.
+    """
+    widget = widgets.Select()
+
+    def __init__(self, label=None, validators=None, reference_class=None,
+                 get_label=None, allow_blank=False, blank_text='', limit=None,
+                 **kwargs):
+        super(KeyPropertyField, self).__init__(label, validators, **kwargs)
+        if get_label is None:
+            self.get_label = lambda x: x
+        elif isinstance(get_label, string_types):
+            self.get_label = operator.attrgetter(get_label)
+        else:
+            self.get_label = get_label
+
+        self.allow_blank = allow_blank
+        self.blank_text = blank_text
+        self.limit = limit
+        self.reference_class = reference_class
+        self._set_data(None)
+        if reference_class is not None:
+            self.query = self._default_query = reference_class.query()
+        else:
+            self._default_query = None
+
+    def _get_data(self):
+        if self._formdata is not None:
+            formdata = self._formdata
+            self._set_data(None)
+            try:
+                self._data = ndb.Key(urlsafe=formdata)
+            except (TypeError, ValueError, ProtocolBuffer.ProtocolBufferDecodeError):
+                pass
+        return self._data
+
+    def _set_data(self, data):
+        self._data = data
+        self._formdata = None
+
+    data = property(_get_data, _set_data)
+
+    def iter_choices(self):
+        if self.allow_blank:
+            yield ('__None', self.blank_text, self.data is None)
+
+        selected_key = self.data
+        choices = self.query.fetch(self.limit) if self.limit else self.query
+        for obj in choices:
+            if obj.key == selected_key:
+                selected_key = None
+                yield (obj.key.urlsafe(), self.get_label(obj), True)
             else:
+                yield (obj.key.urlsafe(), self.get_label(obj), False)
+        if selected_key is not None:
+            # Selected but past the limit.
+            selected = selected_key.get()
+            if selected is not None:
+                yield (selected_key.urlsafe(), self.get_label(selected), True)
+
+    def process_formdata(self, valuelist):
+        if valuelist:
+            if valuelist[0] == '__None':
+                self.data = None
+            else:
+                self._data = None
+                self._formdata = valuelist[0]
+
+    def pre_validate(self, form):
+        if not self.allow_blank or self.data is not None:
+            if not self._is_choice(self.data):
                 raise ValueError(self.gettext('Not a valid choice'))
 
+    def _is_choice(self, key):
+        if key is None:
+            return False
+        if self.query is self._default_query:
+            return key.kind() == self.reference_class._get_kind() and key.get() is not None
+        if isinstance(self.query, ndb.Query):
+            return self.query.filter(ndb.Model._key == key).get(keys_only=True) is not None
+        return any(obj.key == key for obj in self.query)
+
 
 class StringListPropertyField(fields.TextAreaField):
     """
@@ -0,0 +1,305 @@
+"""
+Form generation utilities for App Engine's new ``ndb.Model`` class.
+
+The goal of ``model_form()`` is to provide a clean, explicit and predictable
+way to create forms based on ``ndb.Model`` classes. It works like
+``wtforms.ext.appengine.db.model_form()``:
+
+.. code-block:: python
+
+   from google.appengine.ext import ndb
+   from wtforms.ext.appengine.ndb import model_form
+
+   class Contact(ndb.Model):
+       name = ndb.StringProperty(required=True)
+       city = ndb.StringProperty()
+       age = ndb.IntegerProperty(required=True)
+       is_admin = ndb.BooleanProperty(default=False)
+
+   ContactForm = model_form(Contact, only=('name', 'age'))
+   form = ContactForm(obj=Contact.get_by_id('test'))
+
+Fields are named after the property attribute names (``_code_name``), which
+may differ from the names stored in the datastore.
+"""
+from wtforms import Form, validators, fields as f
+from wtforms.ext.appengine.fields import GeoPtPropertyField, KeyPropertyField, StringListPropertyField
+
+
+def get_TextField(kwargs):
+    """
+    Returns a ``TextField``, applying the ``ndb.StringProperty`` length limit
+    of 500 bytes.
+    """
+    kwargs['validators'].append(validators.length(max=500))
+    return f.TextField(**kwargs)
+
+
+def get_IntegerField(kwargs):
+    """
+    Returns an ``IntegerField``, applying the ``ndb.IntegerProperty`` range
+    limits.
+    """
+    v = validators.NumberRange(min=-0x8000000000000000, max=0x7fffffffffffffff)
+    kwargs['validators'].append(v)
+    return f.IntegerField(**kwargs)
+
+
+class ModelConverterBase(object):
+    """
+    Converts properties of an ``ndb.Model`` class to form fields, with the
+    ``convert_<PropertyClassName>(model, prop, kwargs)`` methods of the
+    converter.
+    """
+    # Don't automatically add a required validator for these properties
+    NO_AUTO_REQUIRED = frozenset(['BooleanProperty'])
+
+    def __init__(self, converters=None):
+        """
+        Constructs the converter, setting the converter callables.
+
+        :param converters:
+            A dictionary of converter callables for each property type. The
+            callable must accept the arguments (model, prop, kwargs). Defaults
+            to the ``convert_<PropertyClassName>`` methods.
+        """
+        self.converters = {}
+        for name in dir(self):
+            if name.startswith('convert_'):
+                self.converters[name[len('convert_'):]] = getattr(self, name)
+        if converters:
+            self.converters.update(converters)
+
+    def convert(self, model, prop, field_args):
+        """
+        Returns a form field for a single model property.
+
+        :param model:
+            The ``ndb.Model`` class that contains the property.
+        :param prop:
+            The model property: a ``ndb.Property`` instance.
+        :param field_args:
+            Optional keyword arguments to construct the field.
+        """
+        prop_type_name = type(prop).__name__
+        kwargs = {
+            'label': prop._code_name.replace('_', ' ').title(),
+            'default': prop._default,
+            'validators': [],
+        }
+        if field_args:
+            kwargs.update(field_args)
+
+        if prop._required and prop_type_name not in self.NO_AUTO_REQUIRED:
+            kwargs['validators'].append(validators.required())
+
+        if prop._choices and not prop._repeated:
+            # Use choices in a select field.
+            kwargs['choices'] = [(v, v) for v in prop._choices]
+            return f.SelectField(**kwargs)
+        for cls in type(prop).__mro__:
+            converter = self.converters.get(cls.__name__)
+            if converter is not None:
+                return converter(model, prop, kwargs)
+
+
+class ModelConverter(ModelConverterBase):
+    """
+    Converts properties from an ``ndb.Model`` class to form fields.
+
+    Default conversions between properties and fields:
+
+    +====================+===================+==============+==================+
+    | Property subclass  | Field subclass    | datatype     | notes            |
+    +====================+===================+==============+==================+
+    | StringProperty     | TextField         | unicode      | TextAreaField    |
+    |                    |                   |              | if repeated      |
+    +--------------------+-------------------+--------------+------------------+
+    | BooleanProperty    | BooleanField      | bool         |                  |
+    +--------------------+-------------------+--------------+------------------+
+    | IntegerProperty    | IntegerField      | int or long  | skipped if       |
+    |                    |                   |              | repeated         |
+    +--------------------+-------------------+--------------+------------------+
+    | FloatProperty      | FloatField        | float        |                  |
+    +--------------------+-------------------+--------------+------------------+
+    | DateTimeProperty   | DateTimeField     | datetime     | skipped if       |
+    |                    |                   |              | auto_now[_add]   |
+    +--------------------+-------------------+--------------+------------------+
+    | DateProperty       | DateField         | date         | skipped if       |
+    |                    |                   |              | auto_now[_add]   |
+    +--------------------+-------------------+--------------+------------------+
+    | TimeProperty       | DateTimeField     | time         | skipped if       |
+    |                    |                   |              | auto_now[_add]   |
+    +--------------------+-------------------+--------------+------------------+
+    | TextProperty       | TextAreaField     | unicode      |                  |
+    +--------------------+-------------------+--------------+------------------+
+    | GeoPtProperty      | TextField         | ndb.GeoPt    |                  |
+    +--------------------+-------------------+--------------+------------------+
+    | KeyProperty        | KeyPropertyField  | ndb.Key      | needs kind=,     |
+    |                    |                   |              | skipped if       |
+    |                    |                   |              | repeated         |
+    +--------------------+-------------------+--------------+------------------+
+    | BlobProperty,      | None              |              | always skipped   |
+    | UserProperty,      |                   |              |                  |
+    | StructuredProperty,|                   |              |                  |
+    | ComputedProperty   |                   |              |                  |
+    +====================+===================+==============+==================+
+    """
+    def convert_StringProperty(self, model, prop, kwargs):
+        """Returns a form field for a ``ndb.StringProperty``."""
+        if prop._repeated:
+            return StringListPropertyField(**kwargs)
+        return get_TextField(kwargs)
+
+    def convert_BooleanProperty(self, model, prop, kwargs):
+        """Returns a form field for a ``ndb.BooleanProperty``."""
+        return f.BooleanField(**kwargs)
+
+    def convert_IntegerProperty(self, model, prop, kwargs):
+        """Returns a form field for a ``ndb.IntegerProperty``."""
+        if prop._repeated:
+            return None
+        return get_IntegerField(kwargs)
+
+    def convert_FloatProperty(self, model, prop, kwargs):
+        """Returns a form field for a ``ndb.FloatProperty``."""
+        if prop._repeated:
+            return None
+        return f.FloatField(**kwargs)
+
+    def convert_DateTimeProperty(self, model, prop, kwargs):
+        """Returns a form field for a ``ndb.DateTimeProperty``."""
+        if prop._auto_now or prop._auto_now_add or prop._repeated:
+            return None
+        return f.DateTimeField(format='%Y-%m-%d %H:%M:%S', **kwargs)
+
+    def convert_DateProperty(self, model, prop, kwargs):
+        """Returns a form field for a ``ndb.DateProperty``."""
+        if prop._auto_now or prop._auto_now_add or prop._repeated:
+            return None
+        return f.DateField(format='%Y-%m-%d', **kwargs)
+
+    def convert_TimeProperty(self, model, prop, kwargs):
+        """Returns a form field for a ``ndb.TimeProperty``."""
+        if prop._auto_now or prop._auto_now_add or prop._repeated:
+            return None
+        return f.DateTimeField(format='%H:%M:%S', **kwargs)
+
+    def convert_TextProperty(self, model, prop, kwargs):
+        """Returns a form field for a ``ndb.TextProperty``."""
+        if prop._repeated:
+            return None
+        return f.TextAreaField(**kwargs)
+
+    def convert_GeoPtProperty(self, model, prop, kwargs):
+        """Returns a form field for a ``ndb.GeoPtProperty``."""
+        if prop._repeated:
+            return None
+        return GeoPtPropertyField(**kwargs)
+
+    def convert_KeyProperty(self, model, prop, kwargs):
+        """Returns a form field for a ``ndb.KeyProperty``."""
+        if prop._repeated or prop._kind is None:
+            return None
+        kwargs.setdefault('reference_class', model._kind_map[prop._kind])
+        kwargs.setdefault('allow_blank', not prop._required)
+        return KeyPropertyField(**kwargs)
+
+    def convert_BlobProperty(self, model, prop, kwargs):
+        """Returns a form field for a ``ndb.BlobProperty``."""
+        return None
+
+    def convert_UserProperty(self, model, prop, kwargs):
+        """Returns a form field for a ``ndb.UserProperty``."""
+        return None
+
+    def convert_StructuredProperty(self, model, prop, kwargs):
+        """Returns a form field for a ``ndb.StructuredProperty``."""
+        return None
+
+    def convert_ComputedProperty(self, model, prop, kwargs):
+        """Returns a form field for a ``ndb.ComputedProperty``."""
+        return None
+
+
+def model_properties(model):
+    """
+    Returns a dictionary of attribute name -> property for an ``ndb.Model``
+    class, in the order the properties were defined.
+    """
+    props = dict((prop._code_name, prop) for prop in model._properties.values())
+    return props, sorted(props, key=lambda name: props[name]._creation_counter)
+
+
+def model_fields(model, only=None, exclude=None, field_args=None,
+                 converter=None):
+    """
+    Extracts and returns a dictionary of form fields for a given
+    ``ndb.Model`` class.
+
+    :param model:
+        The ``ndb.Model`` class to extract fields from.
+    :param only:
+        An optional iterable with the property names that should be included in
+        the form. Only these properties will have fields.
+    :param exclude:
+        An optional iterable with the property names that should be excluded
+        from the form. All other properties will have fields.
+    :param field_args:
+        An optional dictionary of field names mapping to a keyword arguments
+        used to construct each field object.
+    :param converter:
+        A converter to generate the fields based on the model properties. If
+        not set, ``ModelConverter`` is used.
+    """
+    converter = converter or ModelConverter()
+    field_args = field_args or {}
+
+    # Get the field names we want to include or exclude, starting with the
+    # full list of model properties.
+    props, field_names = model_properties(model)
+
+    if only:
+        field_names = list(f for f in only if f in field_names)
+    elif exclude:
+        field_names = list(f for f in field_names if f not in exclude)
+
+    # Create all fields.
+    field_dict = {}
+    for name in field_names:
+        field = converter.convert(model, props[name], field_args.get(name))
+        if field is not None:
+            field_dict[name] = field
+
+    return field_dict
+
+
+def model_form(model, base_class=Form, only=None, exclude=None, field_args=None,
+               converter=None):
+    """
+    Creates and returns a dynamic ``wtforms.Form`` class for a given
+    ``ndb.Model`` class. See ``wtforms.ext.appengine.db.model_form()``.
+
+    :param model:
+        The ``ndb.Model`` class to generate a form for.
+    :param base_class:
+        Base form class to extend from. Must be a ``wtforms.Form`` subclass.
+    :param only:
+        An optional iterable with the property names that should be included in
+        the form. Only these properties will have fields.
+    :param exclude:
+        An optional iterable with the property names that should be excluded
+        from the form. All other properties will have fields.
+    :param field_args:
+        An optional dictionary of field names mapping to keyword arguments
+        used to construct each field object.
+    :param converter:
+        A converter to generate the fields based on the model properties. If
+        not set, ``ModelConverter`` is used.
+    """
+    # Extract the fields from the model.
+    field_dict = model_fields(model, only, exclude, field_args, converter)
+
+    # Return a dynamically created form class, extending from base_class and
+    # including the created fields as properties.
+    return type(model._get_kind() + 'Form', (base_class,), field_dict)
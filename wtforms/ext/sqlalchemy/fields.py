@@ -16,6 +16,12 @@ try:
 except ImportError:
     has_identity_key = False
 
+try:
+    from sqlalchemy import and_, or_
+    from sqlalchemy.orm import class_mapper
+except ImportError:
+    pass
+
 
 
 __all__ = (
@@ -52,15 +58,25 @@ class QuerySelectField(SelectFieldBase):
     top of the list. Selecting this choice will result in the `data` property
     being `None`. The label for this blank choice can be set by specifying the
     `blank_text` parameter.
+
+    If `lazy` is set to `True`, the query is never loaded whole: submitted
+    values are resolved with one `IN` query on the primary key of the queried
+    model, the choices show the first `limit` rows of the query (all of them
+    without `limit`) plus the selected ones, and validation checks primary
+    keys. The query must be a `Query` on a single model, and `get_pk` must be
+    left to the default.
     """
     widget = widgets.Select()
 
     def __init__(self, label=None, validators=None, query_factory=None,
                  get_pk=None, get_label=None, allow_blank=False,
-                 blank_text='', **kwargs):
+                 blank_text='', lazy=False, limit=None, **kwargs):
         super(QuerySelectField, self).__init__(label, validators, **kwargs)
         self.query_factory = query_factory
 
+        if lazy and get_pk is not None:
+            raise TypeError('A lazy QuerySelectField resolves values by primary key and takes no get_pk.')
+
         if get_pk is None:
             if not has_identity_key:
                 raise Exception('The sqlalchemy identity_key function could not be imported.')
@@ -77,15 +93,26 @@ class QuerySelectField(SelectFieldBase):
 
         self.allow_blank = allow_blank
         self.blank_text = blank_text
+        self.lazy = lazy
+        self.limit = limit
         self.query = None
         self._object_list = None
+        self._invalid_formdata = False
+        # Primary keys known to be in the query, in lazy mode.
+        self._valid_pks = set()
 
     def _get_data(self):
         if self._formdata is not None:
-            for pk, obj in self._get_object_list():
-                if pk == self._formdata:
-                    self._set_data(obj)
-                    break
+            if self.lazy:
+                formdata = self._formdata
+                objects = dict(self._get_objects_by_pk([formdata]))
+                self._set_data(objects.get(formdata))
+                self._invalid_formdata = formdata not in objects
+            else:
+                for pk, obj in self._get_object_list():
+                    if pk == self._formdata:
+                        self._set_data(obj)
+                        break
         return self._data
 
     def _set_data(self, data):
@@ -101,12 +128,73 @@ class QuerySelectField(SelectFieldBase):
             self._object_list = list((text_type(get_pk(obj)), obj) for obj in query)
         return self._object_list
 
+    def _get_objects_by_pk(self, pks):
+        """
+        Get the `(pk, obj)` pairs of the query's objects with the given
+        primary keys, in one `IN` query. Primary keys which don't parse or
+        aren't in the query are left out.
+        """
+        query = self.query or self.query_factory()
+        columns = class_mapper(query.column_descriptions[0]['type']).primary_key
+        idents = []
+        for pk in set(pks):
+            values = [pk] if len(columns) == 1 else pk.split(':')
+            if len(values) != len(columns):
+                continue
+            try:
+                idents.append(tuple(coerce_primary_key(column, value) for column, value in zip(columns, values)))
+            except (TypeError, ValueError, ArithmeticError):
+                continue
+        if not idents:
+            return []
+        if len(columns) == 1:
+            condition = columns[0].in_([ident[0] for ident in idents])
+        else:
+            condition = or_(*[and_(*[column == value for column, value in zip(columns, ident)])
+                              for ident in idents])
+        objects = [(text_type(self.get_pk(obj)), obj) for obj in query.filter(condition)]
+        self._valid_pks.update(pk for pk, obj in objects)
+        return objects
+
+    def _has_pks(self, pks):
+        """
+        Tell if the query has objects with all the given primary keys, querying
+        only those not seen in the query yet.
+        """
+        unknown = set(pks) - self._valid_pks
+        if unknown:
+            self._get_objects_by_pk(unknown)
+        return not (unknown - self._valid_pks)
+
+    def _get_lazy_choices(self, selected):
+        """
+        Get the `(pk, obj)` choices of a lazy field, the first `limit` objects
+        of the query and the selected objects which are not among them.
+        """
+        query = self.query or self.query_factory()
+        if self.limit:
+            query = query.limit(self.limit)
+        choices = [(text_type(self.get_pk(obj)), obj) for obj in query]
+        shown = set(pk for pk, obj in choices)
+        self._valid_pks.update(shown)
+        for obj in selected:
+            pk = text_type(self.get_pk(obj))
+            if pk not in shown:
+                shown.add(pk)
+                choices.append((pk, obj))
+        return choices
+
     def iter_choices(self):
         if self.allow_blank:
             yield ('__None', self.blank_text, self.data is None)
 
-        for pk, obj in self._get_object_list():
-            yield (pk, self.get_label(obj), obj == self.data)
+        if self.lazy:
+            data = self.data
+            for pk, obj in self._get_lazy_choices([data] if data is not None else []):
+                yield (pk, self.get_label(obj), obj == data)
+        else:
+            for pk, obj in self._get_object_list():
+                yield (pk, self.get_label(obj), obj == self.data)
 
     def process_formdata(self, valuelist):
         if valuelist:
@@ -119,12 +207,16 @@ class QuerySelectField(SelectFieldBase):
     def pre_validate(self, form):
         data = self.data
         if data is not None:
-            for pk, obj in self._get_object_list():
-                if data == obj:
-                    break
+            if self.lazy:
+                if not self._has_pks([text_type(self.get_pk(data))]):
+                    raise ValidationError(self.gettext('Not a valid choice'))
             else:
-                raise ValidationError(self.gettext('Not a valid choice'))
-        elif self._formdata or not self.allow_blank:
+                for pk, obj in self._get_object_list():
+                    if data == obj:
+                        break
+                else:
+                    raise ValidationError(self.gettext('Not a valid choice'))
+        elif self._formdata or self._invalid_formdata or not self.allow_blank:
             raise ValidationError(self.gettext('Not a valid choice'))
 
 
@@ -136,6 +228,9 @@ class QuerySelectMultipleField(QuerySelectField):
 
     If any of the items in the data list or submitted form data cannot be
     found in the query, this will result in a validation error.
+
+    With `lazy` set, all the submitted values are resolved with one `IN`
+    query, see `QuerySelectField`.
     """
     widget = widgets.Select(multiple=True)
 
@@ -143,18 +238,22 @@ class QuerySelectMultipleField(QuerySelectField):
         if default is None:
             default = []
         super(QuerySelectMultipleField, self).__init__(label, validators, default=default, **kwargs)
-        self._invalid_formdata = False
 
     def _get_data(self):
         formdata = self._formdata
         if formdata is not None:
-            data = []
-            for pk, obj in self._get_object_list():
-                if not formdata:
-                    break
-                elif pk in formdata:
-                    formdata.remove(pk)
-                    data.append(obj)
+            if self.lazy:
+                objects = self._get_objects_by_pk(formdata)
+                formdata = formdata - set(pk for pk, obj in objects)
+                data = [obj for pk, obj in objects]
+            else:
+                data = []
+                for pk, obj in self._get_object_list():
+                    if not formdata:
+                        break
+                    elif pk in formdata:
+                        formdata.remove(pk)
+                        data.append(obj)
             if formdata:
                 self._invalid_formdata = True
             self._set_data(data)
@@ -167,8 +266,11 @@ class QuerySelectMultipleField(QuerySelectField):
     data = property(_get_data, _set_data)
 
     def iter_choices(self):
-        for pk, obj in self._get_object_list():
-            yield (pk, self.get_label(obj), obj in self.data)
+        get_pk = self.get_pk
+        selected = set(text_type(get_pk(obj)) for obj in self.data)
+        choices = self._get_lazy_choices(self.data) if self.lazy else self._get_object_list()
+        for pk, obj in choices:
+            yield (pk, self.get_label(obj), pk in selected)
 
     def process_formdata(self, valuelist):
         self._formdata = set(valuelist)
@@ -177,12 +279,26 @@ class QuerySelectMultipleField(QuerySelectField):
         if self._invalid_formdata:
             raise ValidationError(self.gettext('Not a valid choice'))
         elif self.data:
-            obj_list = list(x[1] for x in self._get_object_list())
-            for v in self.data:
-                if v not in obj_list:
-                    raise ValidationError(self.gettext('Not a valid choice'))
+            pks = set(text_type(self.get_pk(v)) for v in self.data)
+            if self.lazy:
+                valid = self._has_pks(pks)
+            else:
+                valid = pks.issubset(pk for pk, obj in self._get_object_list())
+            if not valid:
+                raise ValidationError(self.gettext('Not a valid choice'))
 
 
 def get_pk_from_identity(obj):
     cls, key = identity_key(instance=obj)
     return ':'.join(text_type(x) for x in key)
+
+
+def coerce_primary_key(column, value):
+    """
+    Convert a submitted primary key value to the column's Python type.
+    """
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    return value if issubclass(python_type, string_types) else python_type(value)